@@ -1,44 +1,193 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Optional
+
 from pydantic import BaseModel
-from sql_analyzer.agent_factory import init_chatbot
+from sql_analyzer.agent_factory import init_async_chatbot
+from sql_analyzer.config import cfg
+from sql_analyzer import export
+from sql_analyzer.deadline import Deadline, DeadlineExceeded
+from sql_analyzer.llm_scheduler import LLMOverloaded
+from sql_analyzer.metrics import CONTENT_TYPE
+from sql_analyzer.sse import sse_event
+from sql_analyzer.startup import NotReady, Startup
 
 app = FastAPI()
-chatbot = init_chatbot()
+# The chatbot is built and warmed up in the background; endpoints get it from get_chatbot()
+startup = Startup(init_async_chatbot)
 
 class Question(BaseModel):
     text: str
+    # Set to csv, ndjson, arrow or parquet to download the full result
+    format: Optional[str] = None
+
+class Batch(BaseModel):
+    questions: List[str]
+    deadline: Optional[float] = None
+
+def overloaded(e: LLMOverloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def get_chatbot():
+    """The chatbot, waiting up to STARTUP_WAIT seconds while it is built; 503 if it is not there yet."""
+    if startup.chatbot is not None:
+        return startup.chatbot
+    try:
+        return await asyncio.to_thread(startup.get, cfg.startup_wait)
+    except NotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def admit(chatbot):
+    """Shed the request with 429 while the LLM queue is full."""
+    try:
+        chatbot.llm_scheduler.admit()
+    except LLMOverloaded as e:
+        raise overloaded(e)
+
+@app.on_event("startup")
+async def start():
+    """Build the chatbot, load the schema and the model in the background so the server starts at once."""
+    startup.start()
+
+@app.on_event("shutdown")
+async def stop():
+    startup.stop()
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the chatbot is built and the database has answered, 503 before."""
+    return JSONResponse(startup.status(), status_code=200 if startup.ready else 503)
 
 @app.get("/tables")
 async def get_tables():
     """Get available tables."""
+    chatbot = await get_chatbot()
     try:
-        tables = chatbot.get_table_names()
+        tables = await chatbot.aget_table_names()
         return {"tables": tables}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/tables/refresh")
+async def refresh_tables():
+    """Invalidate the cached schema so it is reloaded on next use."""
+    chatbot = await get_chatbot()
+    chatbot.catalog.invalidate()
+    return {"status": "invalidated"}
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss counters of the question caches."""
+    chatbot = await get_chatbot()
+    return chatbot.cache_stats()
+
+@app.get("/format/stats")
+async def get_format_stats():
+    """Get how often answers skipped the formatting LLM call."""
+    chatbot = await get_chatbot()
+    return chatbot.format_stats()
+
+@app.get("/pool/stats")
+async def get_pool_stats():
+    """Get occupancy and wait-time metrics of the connection pool."""
+    chatbot = await get_chatbot()
+    return chatbot.pool_stats()
+
+@app.get("/llm/stats")
+async def get_llm_stats():
+    """Get running, queued and shed LLM calls."""
+    chatbot = await get_chatbot()
+    return chatbot.llm_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: stage latencies, LLM tokens, rows returned, cache and pool figures."""
+    chatbot = await get_chatbot()
+    return PlainTextResponse(chatbot.metrics_text(), media_type=CONTENT_TYPE)
+
 @app.post("/query")
-async def process_query(question: Question):
-    """Process a natural language query."""
+async def process_query(question: Question, request: Request):
+    """Process a natural language query.
+
+    With a format, the response is the full result as a download, with the
+    SQL and the answer in the X-Query-SQL and X-Query-Answer headers.
+    """
+    if question.format:
+        try:
+            export.check_format(question.format)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    chatbot = await get_chatbot()
+    admit(chatbot)
+    deadline = Deadline(cfg.request_timeout)
+    # Run the pipeline without blocking the event loop, reusing cached SQL and answers
+    if question.format:
+        task = asyncio.ensure_future(chatbot.aexport_question(question.text, question.format, deadline))
+    else:
+        task = asyncio.ensure_future(chatbot.aprocess_question(question.text, deadline))
     try:
-        # Extract table name from question
-        table_name = chatbot.extract_table_name(question.text)
-        
-        # Get schema
-        schema = chatbot.get_schema(table_name)
-        
-        # Generate SQL
-        sql = chatbot.generate_sql(question.text, schema)
-        
-        # Execute query
-        result = chatbot.execute_query(sql)
-        
-        # Format response
-        response = chatbot.format_response(question.text, result, sql)
-        
-        return {
-            "sql": sql,
-            "response": response
-        }
+        # Stop the LLM calls and the query once the client has gone away
+        while not task.done():
+            await asyncio.wait({task}, timeout=0.5)
+            if not task.done() and await request.is_disconnected():
+                deadline.cancel("Client disconnected")
+                task.cancel()
+        if task.cancelled():
+            raise HTTPException(status_code=499, detail="Client disconnected")
+        if question.format:
+            answer, chunks = task.result()
+            return StreamingResponse(
+                chunks, media_type=export.content_type(question.format),
+                headers=export.export_headers(question.format, answer),
+            )
+        return task.result()
+    except HTTPException:
+        raise
+    except LLMOverloaded as e:
+        raise overloaded(e)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        task.cancel()
+
+@app.post("/query/stream")
+async def stream_query(question: Question):
+    """Process a natural language query, streaming progress as server-sent events."""
+    chatbot = await get_chatbot()
+    admit(chatbot)
+
+    async def events():
+        deadline = Deadline(cfg.request_timeout)
+        try:
+            async for event in chatbot.astream_question(question.text, deadline):
+                yield sse_event(event)
+        except Exception as e:
+            yield sse_event({"event": "error", "error": str(e)})
+        finally:
+            # A disconnect cancels this generator; stop work still running in threads
+            deadline.cancel("Client disconnected")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/query/batch")
+async def batch_query(batch: Batch):
+    """Process many questions, streaming a result event per question as it completes."""
+    if not batch.questions or len(batch.questions) > cfg.batch_max_questions:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {cfg.batch_max_questions} questions")
+    if batch.deadline is not None and not batch.deadline > 0:
+        raise HTTPException(status_code=400, detail="'deadline' must be a positive number of seconds")
+    chatbot = await get_chatbot()
+    admit(chatbot)
+
+    async def events():
+        try:
+            async for event in chatbot.aprocess_batch(batch.questions, batch.deadline):
+                yield sse_event(event)
+        except Exception as e:
+            yield sse_event({"event": "error", "error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -1,3 +1,5 @@
+import json
+
 import chainlit as cl
 import httpx
 from httpx import TimeoutException, ConnectError
@@ -35,33 +37,71 @@ async def start():
             content="I apologize, but I couldn't connect to the database server. Please make sure it's running."
         ).send()
 
+async def read_events(response: httpx.Response):
+    """Parse the server-sent events of a streaming query response."""
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            yield json.loads(line[len("data: "):])
+
 @cl.on_message
 async def main(message: cl.Message):
-    """Process each message from the user."""
+    """Process each message from the user, rendering the SQL and answer as they stream in."""
     # Let user know we're working
     thinking_msg = cl.Message(content="Thinking...")
     await thinking_msg.send()
+    sql_msg = None
+    answer_msg = None
     
     try:
-        # Send question to API with timeout
+        # Send question to the streaming endpoint with timeout
         async with httpx.AsyncClient(timeout=TIMEOUTS) as client:
-            response = await client.post(
-                f"{API_URL}/query",
+            async with client.stream(
+                "POST",
+                f"{API_URL}/query/stream",
                 json={"text": message.content}
-            )
-            
-            # Check if the request was successful
-            response.raise_for_status()
-            
-            # Parse the response
-            data = response.json()
-            
-            # Show the SQL query
-            await cl.Message(content=f"```sql\n{data['sql']}\n```").send()
-            
-            # Send the final answer
-            await thinking_msg.remove()
-            await cl.Message(content=data["response"]).send()
+            ) as response:
+                # Check if the request was successful
+                response.raise_for_status()
+                
+                async for event in read_events(response):
+                    kind = event["event"]
+                    if kind == "table":
+                        tables = ", ".join(event.get("tables", [event["table"]]))
+                        thinking_msg.content = f"Looking at {tables}..."
+                        await thinking_msg.update()
+                    elif kind == "sql_token":
+                        # Show the SQL query while it is being written
+                        if sql_msg is None:
+                            sql_msg = cl.Message(content="")
+                        await sql_msg.stream_token(event["token"])
+                    elif kind == "sql":
+                        if sql_msg is None:
+                            sql_msg = cl.Message(content="")
+                        sql_msg.content = f"```sql\n{event['sql']}\n```"
+                        await sql_msg.send()
+                    elif kind == "repair":
+                        # The query failed; show the corrected SQL that runs instead
+                        thinking_msg.content = f"The query failed ({event['error']}), retrying with corrected SQL..."
+                        await thinking_msg.update()
+                        sql_msg.content = f"```sql\n{event['sql']}\n```"
+                        await sql_msg.update()
+                    elif kind == "executed":
+                        thinking_msg.content = f"Query returned {event['row_count']} row(s), writing the answer..."
+                        await thinking_msg.update()
+                    elif kind == "answer_token":
+                        if answer_msg is None:
+                            await thinking_msg.remove()
+                            answer_msg = cl.Message(content="")
+                        await answer_msg.stream_token(event["token"])
+                    elif kind == "done":
+                        # Send the final answer
+                        if answer_msg is None:
+                            await thinking_msg.remove()
+                            answer_msg = cl.Message(content="")
+                        answer_msg.content = event["response"]
+                        await answer_msg.send()
+                    elif kind == "error":
+                        raise Exception(event["error"])
             
     except TimeoutException:
         await thinking_msg.remove()
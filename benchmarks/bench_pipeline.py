@@ -0,0 +1,280 @@
+"""
+Offline benchmark of the question pipeline.
+
+Runs SQLChatbot, the FastAPI app in api.py and the HTTP server in server.py
+against the SQLite fixture and the fake LLM, so no MSSQL or Ollama is needed.
+Reports per-stage latency percentiles, end-to-end latency and throughput with
+N concurrent clients, and peak RSS. Use --json to keep results for comparing
+runs.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --rows 1000000 --clients 8 --requests 200
+"""
+import os
+
+# Keep the benchmark's generated SQL, column stats and table index out of the files on disk
+os.environ.setdefault("SQL_STORE_PATH", ":memory:")
+os.environ.setdefault("COLUMN_STATS_PATH", "")
+os.environ.setdefault("TABLE_INDEX_PATH", "")
+
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import resource
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.fixtures import QUESTIONS, create_fixture, fixture_engine
+from sql_analyzer.answer_cache import TTLCache
+from sql_analyzer.async_sql_chatbot import AsyncSQLChatbot
+from sql_analyzer.config import cfg
+from sql_analyzer.sql_chatbot import SQLChatbot
+from sql_analyzer.startup import Startup
+
+STAGES = ["select_tables", "get_schemas", "stream_sql", "execute_query", "stream_response"]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_chatbot(cls, engine, args):
+    llm = FakeLLM(
+        sql_by_question=QUESTIONS,
+        first_token_latency=args.llm_latency,
+        token_latency=args.token_latency,
+    )
+    chatbot = cls(engine, llm)
+    if not args.cache:
+        chatbot.sql_cache = TTLCache(0, 0)
+        chatbot.answer_cache = TTLCache(0, 0)
+        chatbot.sql_store = None
+    return chatbot
+
+
+def instrument_stages(chatbot: SQLChatbot, samples: Dict[str, List[float]]) -> None:
+    """Wrap the pipeline stages of a chatbot instance to record their durations."""
+    lock = threading.Lock()
+
+    def record(name: str, start: float) -> None:
+        with lock:
+            samples.setdefault(name, []).append(time.perf_counter() - start)
+
+    for name in STAGES:
+        original = getattr(chatbot, name)
+        if inspect.isgeneratorfunction(original):
+            def wrapper(*args, _original=original, _name=name, **kwargs):
+                start = time.perf_counter()
+                try:
+                    yield from _original(*args, **kwargs)
+                finally:
+                    record(_name, start)
+        else:
+            def wrapper(*args, _original=original, _name=name, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return _original(*args, **kwargs)
+                finally:
+                    record(_name, start)
+        setattr(chatbot, name, wrapper)
+
+
+def run_concurrent(call: Callable[[str], Any], clients: int, requests: int) -> Dict[str, Any]:
+    """Fire requests from a number of client threads and measure latency and throughput."""
+    questions = list(QUESTIONS)
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            call(questions[i % len(questions)])
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "clients": clients,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": requests / elapsed,
+        "latency": percentiles(latencies),
+    }
+
+
+async def run_concurrent_async(client, clients: int, requests: int) -> Dict[str, Any]:
+    questions = list(QUESTIONS)
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(clients)
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/query", json={"text": questions[i % len(questions)]})
+            if response.status_code != 200:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "clients": clients,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": requests / elapsed,
+        "latency": percentiles(latencies),
+    }
+
+
+def bench_chatbot(engine, args) -> Dict[str, Any]:
+    chatbot = build_chatbot(SQLChatbot, engine, args)
+    stage_samples: Dict[str, List[float]] = {}
+    instrument_stages(chatbot, stage_samples)
+    concurrent = run_concurrent(chatbot.process_question, args.clients, args.requests)
+    return {"stages": {name: percentiles(stage_samples.get(name, [])) for name in STAGES}, **concurrent}
+
+
+def bench_api(engine, args) -> Dict[str, Any]:
+    import httpx
+    import sql_analyzer.agent_factory as agent_factory
+
+    chatbot = build_chatbot(AsyncSQLChatbot, engine, args)
+    agent_factory.init_async_chatbot = lambda: chatbot
+    import api
+
+    async def run() -> Dict[str, Any]:
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            return await run_concurrent_async(client, args.clients, args.requests)
+
+    return asyncio.run(run())
+
+
+def bench_server(engine, args) -> Dict[str, Any]:
+    import server
+
+    class QuietHandler(server.ChatbotHandler):
+        def log_message(self, format, *args):
+            pass
+
+    chatbot = build_chatbot(SQLChatbot, engine, args)
+    server.startup = Startup(lambda: chatbot, warm_up_llm=False).start()
+    httpd = server.WorkerPoolHTTPServer(("127.0.0.1", 0), QuietHandler, args.server_threads, args.requests)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/query"
+
+    def call(question: str) -> Any:
+        request = urllib.request.Request(
+            url, data=json.dumps({"text": question}).encode(), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    try:
+        return run_concurrent(call, args.clients, args.requests)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"\nFixture rows: {results['rows']:,}  peak RSS: {results['peak_rss_mb']:.1f} MB")
+    for target in ("chatbot", "api", "server"):
+        if target not in results:
+            continue
+        result = results[target]
+        latency = result["latency"]
+        print(
+            f"\n[{target}] {result['requests']} requests, {result['clients']} clients, "
+            f"{result['errors']} errors, {result['throughput_rps']:.2f} req/s"
+        )
+        if latency:
+            print(f"  end-to-end  p50 {latency['p50_ms']:9.1f} ms  p95 {latency['p95_ms']:9.1f} ms  p99 {latency['p99_ms']:9.1f} ms")
+        for stage, stats in result.get("stages", {}).items():
+            if stats:
+                print(f"  {stage:<19} p50 {stats['p50_ms']:9.1f} ms  p95 {stats['p95_ms']:9.1f} ms  p99 {stats['p99_ms']:9.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline SQL chatbot pipeline benchmark")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows in the fixture table")
+    parser.add_argument("--db-path", default="bench_fixture.db")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="requests per target")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake LLM seconds to first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="fake LLM seconds per token")
+    parser.add_argument("--server-threads", type=int, default=8)
+    parser.add_argument("--cache", action="store_true", help="keep the SQL and answer caches and the SQL store enabled")
+    parser.add_argument("--no-fast-format", action="store_true", help="always format answers with the LLM")
+    parser.add_argument("--targets", default="chatbot,api,server", help="comma separated subset to run")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger("sql_analyzer").setLevel(logging.WARNING)
+    if args.no_fast_format:
+        cfg.fast_format_enabled = False
+
+    start = time.perf_counter()
+    create_fixture(args.db_path, args.rows)
+    print(f"Fixture ready in {time.perf_counter() - start:.1f}s")
+    engine = fixture_engine(args.db_path)
+
+    results: Dict[str, Any] = {"rows": args.rows, "args": vars(args)}
+    targets = args.targets.split(",")
+    if "chatbot" in targets:
+        results["chatbot"] = bench_chatbot(engine, args)
+    if "api" in targets:
+        results["api"] = bench_api(engine, args)
+    if "server" in targets:
+        results["server"] = bench_server(engine, args)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Cold-start benchmark for the servers and the CLI.
+
+Every measurement runs in a fresh interpreter so nothing is imported yet:
+the import time of api.py, server.py and the agent factory (how long until
+a server can listen), the import time of the chatbot modules (what importing
+the agent factory used to cost), and the time from start-up until the
+chatbot is built, the schema is loaded (ready) and the table index exists,
+against the SQLite fixture and the fake LLM. Reports the median of --repeat
+runs; use --json to keep results for comparing runs.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+IMPORTS = {
+    "api": "api",
+    "server": "server",
+    "agent_factory": "sql_analyzer.agent_factory",
+    "chatbot_modules": "sql_analyzer.async_sql_chatbot",
+}
+
+
+def child_import(module: str) -> Dict[str, Any]:
+    import importlib
+
+    before = len(sys.modules)
+    start = time.perf_counter()
+    importlib.import_module(module)
+    return {"seconds": time.perf_counter() - start, "modules": len(sys.modules) - before}
+
+
+def child_ready(db_path: str) -> Dict[str, Any]:
+    import logging
+
+    from sql_analyzer.startup import Startup
+
+    logging.getLogger("sql_analyzer").setLevel(logging.WARNING)
+
+    def factory():
+        # Imports the chatbot modules like agent_factory does
+        from benchmarks.fake_llm import FakeLLM
+        from benchmarks.fixtures import QUESTIONS, fixture_engine
+        from sql_analyzer.sql_chatbot import SQLChatbot
+
+        return SQLChatbot(fixture_engine(db_path), FakeLLM(sql_by_question=QUESTIONS))
+
+    startup = Startup(factory, warm_up_llm=False).start()
+    startup.wait(60)
+    return startup.status()
+
+
+def run_child(args: List[str]) -> Dict[str, Any]:
+    env = dict(os.environ)
+    # Keep the child away from the on-disk SQL store, table index and column stats
+    env.setdefault("SQL_STORE_PATH", ":memory:")
+    env.setdefault("TABLE_INDEX_PATH", "")
+    env.setdefault("COLUMN_STATS_PATH", "")
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child", *args],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median(samples: List[float]) -> float:
+    return statistics.median(samples) if samples else float("nan")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold-start benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--rows", type=int, default=1000, help="rows in the fixture table")
+    parser.add_argument("--db-path", default="bench_fixture.db")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        kind, target = args.child
+        result = child_import(target) if kind == "import" else child_ready(target)
+        print(json.dumps(result))
+        return
+
+    from benchmarks.fixtures import create_fixture
+
+    create_fixture(args.db_path, args.rows)
+    results: Dict[str, Any] = {"args": vars(args), "imports": {}, "startup": {}}
+    for name, module in IMPORTS.items():
+        runs = [run_child(["import", module]) for _ in range(args.repeat)]
+        results["imports"][name] = {
+            "module": module,
+            "seconds": median([run["seconds"] for run in runs]),
+            "modules": runs[-1]["modules"],
+        }
+    runs = [run_child(["ready", args.db_path]) for _ in range(args.repeat)]
+    errors = [run["error"] for run in runs if run["error"]]
+    if errors:
+        print(f"Start-up failed: {errors[0]}", file=sys.stderr)
+    for stage in ("chatbot", "schema", "table_index"):
+        results["startup"][stage] = median([run["timings"][stage] for run in runs if stage in run["timings"]])
+
+    print(f"\nMedian of {args.repeat} fresh interpreters")
+    print("\nImport time")
+    for name, result in results["imports"].items():
+        print(f"  {result['module']:<32} {result['seconds'] * 1000:8.1f} ms  {result['modules']:5d} modules")
+    print("\nBackground start-up (seconds after Startup was created)")
+    for stage, seconds in results["startup"].items():
+        print(f"  {stage:<32} {seconds * 1000:8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Deterministic stand-in for Ollama with configurable latency.
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.outputs import GenerationChunk
+
+
+class FakeLLM(LLM):
+    """Answers SQL prompts from a question -> SQL table and everything else with a fixed sentence.
+
+    A prompt is treated as a SQL generation prompt when it contains one of the
+    known questions but not yet its SQL after it (examples come before). ``first_token_latency`` simulates
+    prompt processing and ``token_latency`` the decode time of each token.
+    """
+
+    sql_by_question: Dict[str, str]
+    first_token_latency: float = 0.2
+    token_latency: float = 0.01
+    answer: str = "There are 42 matching transfers."
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ollama"
+
+    def _respond(self, prompt: str) -> str:
+        for question, sql in self.sql_by_question.items():
+            position = prompt.find(question)
+            if position >= 0 and sql not in prompt[position:]:
+                return sql
+        return self.answer
+
+    def _chunk(self, prompt: str, words: List[str], i: int) -> GenerationChunk:
+        text = words[i] if i == 0 else " " + words[i]
+        if i < len(words) - 1:
+            return GenerationChunk(text=text)
+        # Like Ollama, report token counts on the final chunk (roughly 4 characters per token)
+        info = {"done": True, "prompt_eval_count": len(prompt) // 4, "eval_count": len(words)}
+        return GenerationChunk(text=text, generation_info=info)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        time.sleep(self.first_token_latency)
+        words = self._respond(prompt).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_latency)
+            yield self._chunk(prompt, words, i)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join([chunk.text async for chunk in self._astream(prompt, stop, run_manager, **kwargs)])
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        words = self._respond(prompt).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield self._chunk(prompt, words, i)
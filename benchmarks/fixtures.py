@@ -0,0 +1,101 @@
+"""
+SQLite stand-in for the MSSQL database used by the benchmarks.
+
+The fixture copies the shape of Prj_Data_Transfers_SC and can be scaled to
+millions of rows. The schema catalog reads its tables and columns with the
+SQLite dialect's sqlite_master queries.
+"""
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy.engine import Engine
+
+from sql_analyzer.sql_db_factory import local_engine
+
+TABLE = "Prj_Data_Transfers_SC"
+
+CREATE_TABLE = f"""
+    CREATE TABLE {TABLE} (
+        Id INTEGER PRIMARY KEY,
+        CompanyId INTEGER NOT NULL,
+        Draft_Numero VARCHAR(20) NOT NULL,
+        Recibido CHAR(1) NOT NULL,
+        Despachado CHAR(1) NOT NULL,
+        Estatus CHAR(1) NOT NULL,
+        Fecha_Originacion DATETIME NOT NULL,
+        Fecha_Despacho DATETIME NULL,
+        Fecha_Recibo DATETIME NULL
+    )
+"""
+
+# Questions the benchmark asks, with the SQL the fake LLM answers them with
+QUESTIONS = {
+    "How many transfers were received today?":
+        f"SELECT COUNT(*) FROM {TABLE} WHERE Recibido = 'Y' AND date(Fecha_Recibo) = date('now')",
+    "How many transfers are open for company 3?":
+        f"SELECT COUNT(*) FROM {TABLE} WHERE Estatus = 'O' AND CompanyId = 3",
+    "Show the latest received transfer":
+        f"SELECT * FROM {TABLE} WHERE Recibido = 'Y' ORDER BY Fecha_Recibo DESC LIMIT 1",
+    "How many transfers were dispatched per company?":
+        f"SELECT CompanyId, COUNT(*) AS Despachados FROM {TABLE} WHERE Despachado = 'Y' GROUP BY CompanyId",
+    "Show all open transfers":
+        f"SELECT * FROM {TABLE} WHERE Estatus = 'O'",
+}
+
+
+def _rows(count: int, seed: int):
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    for i in range(1, count + 1):
+        created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+        dispatched = created + timedelta(hours=rng.randint(1, 72)) if rng.random() < 0.8 else None
+        received = dispatched + timedelta(hours=rng.randint(1, 48)) if dispatched and rng.random() < 0.7 else None
+        yield (
+            i,
+            rng.randint(1, 20),
+            f"D{i:08d}",
+            "Y" if received else "N",
+            "Y" if dispatched else "N",
+            "C" if received else rng.choice("OOOP"),
+            created.isoformat(sep=" "),
+            dispatched.isoformat(sep=" ") if dispatched else None,
+            received.isoformat(sep=" ") if received else None,
+        )
+
+
+def create_fixture(path: str, rows: int, seed: int = 42, batch_size: int = 50_000) -> str:
+    """Create (or reuse, if it already has the requested size) the fixture database."""
+    if os.path.exists(path):
+        with sqlite3.connect(path) as conn:
+            try:
+                if conn.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0] == rows:
+                    return path
+            except sqlite3.OperationalError:
+                pass
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(CREATE_TABLE)
+        batch = []
+        for row in _rows(rows, seed):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                conn.executemany(f"INSERT INTO {TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.executemany(f"INSERT INTO {TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+        conn.execute(f"CREATE INDEX ix_{TABLE}_CompanyId ON {TABLE} (CompanyId)")
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+
+def fixture_engine(path: str) -> Engine:
+    """Pooled engine on the fixture, created like the production SQLite engine."""
+    return local_engine(f"sqlite:///{path}")
@@ -1,25 +1,100 @@
 from http.server import HTTPServer, BaseHTTPRequestHandler
+import argparse
 import json
+import os
+import queue
+import select
+import signal
+import socket
+import threading
 import traceback
+from contextlib import contextmanager
 from urllib.parse import parse_qs, urlparse
+from sql_analyzer import export
 from sql_analyzer.agent_factory import init_chatbot
+from sql_analyzer.config import cfg
+from sql_analyzer.deadline import Deadline, DeadlineExceeded
+from sql_analyzer.llm_scheduler import LLMOverloaded
 from sql_analyzer.log_init import logger
+from sql_analyzer.metrics import CONTENT_TYPE
+from sql_analyzer.sse import sse_event
+from sql_analyzer.startup import NotReady, Startup
 
-# Initialize chatbot
-chatbot = init_chatbot()
+# Each worker process builds its own chatbot (and engine) in the background, see serve_worker()
+startup = None
+
+
+class WorkerPoolHTTPServer(HTTPServer):
+    """HTTPServer that hands requests to a fixed pool of threads through a bounded queue.
+
+    When the queue is full new connections get an immediate 503 instead of
+    waiting behind long-running LLM calls. Closing the server lets the threads
+    finish the requests already queued before they exit.
+    """
+
+    REJECT_RESPONSE = (
+        b"HTTP/1.0 503 Service Unavailable\r\n"
+        b"Content-Type: application/json\r\n"
+        b"Retry-After: 1\r\n"
+        b"Connection: close\r\n\r\n"
+        b'{"error": "Server busy, please retry"}'
+    )
+
+    def __init__(self, server_address, handler_class, threads=8, queue_size=64, bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._threads = [
+            threading.Thread(target=self._process_queue, name=f"http-worker-{i}", daemon=True)
+            for i in range(threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            logger.warning("Request queue full, rejecting %s", client_address)
+            try:
+                request.sendall(self.REJECT_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _process_queue(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
 
 class ChatbotHandler(BaseHTTPRequestHandler):
-    def _set_response(self, status_code=200, content_type="application/json"):
+    def _set_response(self, status_code=200, content_type="application/json", headers=None):
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
     
-    def _send_json_response(self, data, status_code=200):
+    def _send_json_response(self, data, status_code=200, headers=None):
         try:
-            self._set_response(status_code)
+            self._set_response(status_code, headers=headers)
             response = json.dumps(data).encode('utf-8')
             self.wfile.write(response)
         except (BrokenPipeError, ConnectionResetError):
@@ -29,11 +104,102 @@ class ChatbotHandler(BaseHTTPRequestHandler):
             # Log the error but don't try to send it since the connection might be dead
             logger.error(f"Error sending response: {str(e)}")
     
+    def _send_overloaded(self, error):
+        logger.warning(f"Shedding request: {str(error)}")
+        self._send_json_response({"error": str(error)}, 429, {"Retry-After": str(error.retry_after)})
+
+    def _chatbot(self):
+        """The chatbot, waiting up to STARTUP_WAIT seconds while it is built; None after answering 503."""
+        try:
+            return startup.get(cfg.startup_wait)
+        except NotReady as e:
+            self._send_json_response({"error": str(e)}, 503, {"Retry-After": str(e.retry_after)})
+            return None
+
+    def _admit(self, chatbot):
+        """False, after answering 429, while the LLM queue is full."""
+        try:
+            chatbot.llm_scheduler.admit()
+        except LLMOverloaded as e:
+            self._send_overloaded(e)
+            return False
+        return True
+
+    @contextmanager
+    def _watch_disconnect(self, deadline):
+        """Cancel the deadline if the client closes the connection while the block runs.
+
+        The request body has been read, so the socket becomes readable only
+        when the client sends EOF (or, unusually, pipelines more data).
+        """
+        # Written to when the block ends, so the watcher returns without polling
+        wake, waker = socket.socketpair()
+
+        def watch():
+            try:
+                readable, _, _ = select.select([self.connection, wake], [], [])
+                if wake in readable:
+                    return
+                # EOF is a disconnect; pipelined data is not, and there is nothing more to learn
+                if not self.connection.recv(1, socket.MSG_PEEK):
+                    deadline.cancel("Client disconnected")
+            except (OSError, ValueError):
+                deadline.cancel("Client disconnected")
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        try:
+            yield
+        finally:
+            waker.send(b"\0")
+            watcher.join()
+            wake.close()
+            waker.close()
+
+    def _send_event_stream(self, events):
+        """Write pipeline events as server-sent events while they are produced."""
+        try:
+            self._set_response(200, "text/event-stream")
+            try:
+                for event in events:
+                    self.wfile.write(sse_event(event).encode('utf-8'))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                logger.error(f"Error streaming query: {str(e)}\n{traceback.format_exc()}")
+                self.wfile.write(sse_event({"event": "error", "error": str(e)}).encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            # Client disconnected, stop the remaining stages
+            events.close()
+    
+    def _send_export(self, fmt, answer, chunks):
+        """Stream an exported result as a download, stopping its query if the client goes away."""
+        try:
+            self._set_response(200, export.content_type(fmt), export.export_headers(fmt, answer))
+            for chunk in chunks:
+                self.wfile.write(chunk)
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            # Headers are gone; all that is left is to cut the download short
+            logger.error(f"Error exporting result: {str(e)}\n{traceback.format_exc()}")
+        finally:
+            chunks.close()
+
     def do_OPTIONS(self):
         self._set_response()
         
     def do_GET(self):
         """Handle GET requests - used for getting tables."""
+        if self.path == "/ready":
+            # Readiness: the chatbot is built and the database has answered
+            self._send_json_response(startup.status(), 200 if startup.ready else 503)
+            return
+        chatbot = self._chatbot()
+        if chatbot is None:
+            return
         if self.path == "/tables":
             try:
                 tables = chatbot.get_table_names()
@@ -41,11 +207,28 @@ class ChatbotHandler(BaseHTTPRequestHandler):
             except Exception as e:
                 logger.error(f"Error getting tables: {str(e)}\n{traceback.format_exc()}")
                 self._send_json_response({"error": str(e)}, 500)
+        elif self.path == "/cache/stats":
+            self._send_json_response(chatbot.cache_stats())
+        elif self.path == "/format/stats":
+            self._send_json_response(chatbot.format_stats())
+        elif self.path == "/pool/stats":
+            self._send_json_response(chatbot.pool_stats())
+        elif self.path == "/llm/stats":
+            self._send_json_response(chatbot.llm_stats())
+        elif self.path == "/metrics":
+            try:
+                self._set_response(200, CONTENT_TYPE)
+                self.wfile.write(chatbot.metrics_text().encode('utf-8'))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
         else:
             self._send_json_response({"error": "Not found"}, 404)
     
     def do_POST(self):
         """Handle POST requests - used for processing queries."""
+        chatbot = self._chatbot()
+        if chatbot is None:
+            return
         if self.path == "/query":
             try:
                 content_length = int(self.headers['Content-Length'])
@@ -55,30 +238,34 @@ class ChatbotHandler(BaseHTTPRequestHandler):
                 # Log the incoming question
                 logger.info(f"Processing question: {data['text']}")
                 
-                # Extract table name from question
-                table_name = chatbot.extract_table_name(data["text"])
-                logger.info(f"Extracted table name: {table_name}")
-                
-                # Get schema
-                schema = chatbot.get_schema(table_name)
-                logger.info(f"Retrieved schema for table {table_name}")
-                
-                # Generate SQL
-                sql = chatbot.generate_sql(data["text"], schema)
-                logger.info(f"Generated SQL: {sql}")
-                
-                # Execute query
-                result = chatbot.execute_query(sql)
-                logger.info(f"Query executed successfully")
+                # With a format the full result is sent as a download
+                fmt = data.get("format")
+                if fmt:
+                    try:
+                        export.check_format(fmt)
+                    except ValueError as e:
+                        self._send_json_response({"error": str(e)}, 400)
+                        return
+                if not self._admit(chatbot):
+                    return
+                # Run the pipeline, reusing cached SQL and answers where possible
+                deadline = Deadline(cfg.request_timeout)
+                with self._watch_disconnect(deadline):
+                    if fmt:
+                        answer, chunks = chatbot.export_question(data["text"], fmt, deadline)
+                    else:
+                        answer = chatbot.process_question(data["text"], deadline)
+                logger.info(f"Answered with SQL: {answer['sql']}")
                 
-                # Format response
-                response = chatbot.format_response(data["text"], result, sql)
-                logger.info("Response formatted")
-                
-                self._send_json_response({
-                    "sql": sql,
-                    "response": response
-                })
+                if fmt:
+                    self._send_export(fmt, answer, chunks)
+                else:
+                    self._send_json_response(answer)
+            except LLMOverloaded as e:
+                self._send_overloaded(e)
+            except DeadlineExceeded as e:
+                logger.warning(f"Query stopped: {str(e)}")
+                self._send_json_response({"error": str(e)}, 504)
             except json.JSONDecodeError as e:
                 logger.error(f"Invalid JSON: {str(e)}")
                 self._send_json_response({"error": "Invalid JSON"}, 400)
@@ -88,14 +275,125 @@ class ChatbotHandler(BaseHTTPRequestHandler):
             except Exception as e:
                 logger.error(f"Error processing query: {str(e)}\n{traceback.format_exc()}")
                 self._send_json_response({"error": str(e)}, 500)
+        elif self.path == "/query/stream":
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length).decode())
+                question = data["text"]
+            except json.JSONDecodeError as e:
+                logger.error(f"Invalid JSON: {str(e)}")
+                self._send_json_response({"error": "Invalid JSON"}, 400)
+            except KeyError as e:
+                logger.error(f"Missing field: {str(e)}")
+                self._send_json_response({"error": "Missing required field 'text'"}, 400)
+            else:
+                if not self._admit(chatbot):
+                    return
+                logger.info(f"Streaming question: {question}")
+                deadline = Deadline(cfg.request_timeout)
+                with self._watch_disconnect(deadline):
+                    self._send_event_stream(chatbot.stream_question(question, deadline))
+        elif self.path == "/query/batch":
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length).decode())
+                questions = data["questions"]
+                deadline = data.get("deadline")
+            except json.JSONDecodeError as e:
+                logger.error(f"Invalid JSON: {str(e)}")
+                self._send_json_response({"error": "Invalid JSON"}, 400)
+            except KeyError as e:
+                logger.error(f"Missing field: {str(e)}")
+                self._send_json_response({"error": "Missing required field 'questions'"}, 400)
+            else:
+                if not isinstance(questions, list) or not 0 < len(questions) <= cfg.batch_max_questions:
+                    self._send_json_response({"error": f"Send between 1 and {cfg.batch_max_questions} questions"}, 400)
+                elif deadline is not None and (
+                    isinstance(deadline, bool) or not isinstance(deadline, (int, float)) or not deadline > 0
+                ):
+                    self._send_json_response({"error": "'deadline' must be a positive number of seconds"}, 400)
+                elif self._admit(chatbot):
+                    logger.info(f"Processing batch of {len(questions)} questions")
+                    # Deadlines above BATCH_DEADLINE are capped by process_batch
+                    cancel = Deadline()
+                    with self._watch_disconnect(cancel):
+                        self._send_event_stream(chatbot.process_batch(questions, deadline, cancel))
+        elif self.path == "/tables/refresh":
+            chatbot.catalog.invalidate()
+            logger.info("Schema catalog invalidated")
+            self._send_json_response({"status": "invalidated"})
         else:
             self._send_json_response({"error": "Not found"}, 404)
 
-def run(port=8000):
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, ChatbotHandler)
-    logger.info(f"Starting server on port {port}...")
-    httpd.serve_forever()
+def serve_worker(sock, threads, queue_size, worker=0):
+    """Serve requests from an already listening socket until SIGTERM/SIGINT."""
+    global startup
+    # Build the chatbot, load the schema and the model while already accepting requests;
+    # only the first worker profiles columns, the others read its stats file
+    startup = Startup(init_chatbot, profile_columns=worker == 0).start()
+
+    httpd = WorkerPoolHTTPServer(sock.getsockname()[:2], ChatbotHandler, threads, queue_size, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    httpd.server_name, httpd.server_port = socket.getfqdn(), sock.getsockname()[1]
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot run on this thread
+        threading.Thread(target=httpd.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        httpd.serve_forever()
+    finally:
+        startup.stop()
+        httpd.server_close()
+        logger.info(f"Worker {os.getpid()} stopped")
+
+
+def run(port=8000, workers=None, threads=None, queue_size=None):
+    workers = workers or cfg.server_workers
+    threads = threads or cfg.server_threads
+    queue_size = queue_size or cfg.server_queue_size
+
+    sock = socket.create_server(('', port), backlog=queue_size)
+    # Workers race to accept; the losers must not block inside accept()
+    sock.setblocking(False)
+    logger.info(f"Starting server on port {port} with {workers} worker(s) x {threads} thread(s)...")
+    if workers == 1:
+        serve_worker(sock, threads, queue_size)
+        return
+
+    # Pre-fork: every child accepts from the shared listening socket
+    children = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(sock, threads, queue_size, worker)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop_children(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_children)
+    signal.signal(signal.SIGINT, stop_children)
+    for pid in children:
+        os.waitpid(pid, 0)
+    sock.close()
+    logger.info("Server stopped")
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="SQL Chatbot HTTP server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, help="number of pre-forked worker processes")
+    parser.add_argument("--threads", type=int, help="request threads per worker")
+    parser.add_argument("--queue-size", type=int, help="pending requests per worker before rejecting with 503")
+    args = parser.parse_args()
+    run(args.port, args.workers, args.threads, args.queue_size)
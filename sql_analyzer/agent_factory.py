@@ -1,43 +1,67 @@
 """
 Initialize the SQL Chatbot
+
+The chatbot modules pull in LangChain, SQLAlchemy and sqlglot, so they are
+imported when a chatbot is built rather than when this module is imported.
 """
-from langchain_community.llms import Ollama
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sql_analyzer.async_sql_chatbot import AsyncSQLChatbot
+    from sql_analyzer.sql_chatbot import SQLChatbot
+
+
+def init_chatbot() -> "SQLChatbot":
+    from sql_analyzer.ollama_llm import llm_factory
+    from sql_analyzer.sql_chatbot import SQLChatbot
+    from sql_analyzer.sql_db_factory import analytics_engine_factory, engine_factory
 
-from sql_analyzer.config import cfg
-from sql_analyzer.log_init import logger
-from sql_analyzer.sql_chatbot import SQLChatbot
-from sql_analyzer.sql_db_factory import sql_db_factory
+    return SQLChatbot(engine_factory(), llm_factory(), analytics_engine=analytics_engine_factory())
 
 
-def init_chatbot() -> SQLChatbot:
-    db = sql_db_factory()
-    llm = Ollama(base_url=cfg.ollama_url, model=cfg.ollama_model)
-    return SQLChatbot(db, llm)
+def init_async_chatbot() -> "AsyncSQLChatbot":
+    from sql_analyzer.async_sql_chatbot import AsyncSQLChatbot
+    from sql_analyzer.ollama_llm import llm_factory
+    from sql_analyzer.sql_db_factory import analytics_engine_factory, async_engine_factory, engine_factory
+
+    return AsyncSQLChatbot(
+        engine_factory(),
+        llm_factory(),
+        async_engine=async_engine_factory(),
+        analytics_engine=analytics_engine_factory(),
+    )
 
 
 if __name__ == "__main__":
-    chatbot = init_chatbot()
-    logger.info("Available tables: %s", chatbot.get_table_names())
-    
-    print("\nWelcome to SQL Chatbot! Type 'exit' to quit.")
-    print("Available tables:", ", ".join(chatbot.get_table_names()))
-    
+    from sql_analyzer.startup import Startup
+
+    # Build the chatbot and load the schema while the user types the first question
+    startup = Startup(init_chatbot).start()
+
+    print("\nWelcome to SQL Chatbot! Type 'tables' to list the tables, 'exit' to quit.")
+
     while True:
         try:
             question = input("\nWhat would you like to know? ").strip()
             if question.lower() in ['exit', 'quit']:
                 break
-                
+
             if not question:
                 continue
-                
+
+            chatbot = startup.get()
+            if question.lower() == 'tables':
+                print("Available tables:", ", ".join(chatbot.get_table_names()))
+                continue
+
             print("\nThinking...")
             response = chatbot.answer_question(question)
             print("\nAnswer:", response)
-            
+
         except KeyboardInterrupt:
             break
         except Exception as e:
             print(f"\nError: {str(e)}")
-    
+
+    startup.stop()
     print("\nGoodbye!")
@@ -0,0 +1,62 @@
+"""
+Routing of analytical queries to a local columnar copy of the database.
+
+SQL is still generated and validated for the database the chatbot talks to.
+Queries that aggregate are transpiled with sqlglot to the dialect of the
+copy (DuckDB or SQLite) and run there when all of their tables exist in it,
+which keeps large scans off the primary database. The copy is filled and
+refreshed outside the chatbot, e.g. by a nightly export; a query that fails
+on it runs on the primary database instead.
+"""
+from typing import Optional
+
+import sqlglot
+from sqlalchemy.engine import Engine
+from sqlglot import exp
+
+from sql_analyzer.dialects import dialect_for
+from sql_analyzer.log_init import logger
+from sql_analyzer.schema_catalog import SchemaCatalog
+
+ROUTING_MODES = ("aggregate", "all")
+
+
+def analytical(statement: exp.Expression) -> bool:
+    """The query groups, aggregates or uses window functions."""
+    return statement.find(exp.Group, exp.AggFunc, exp.Window) is not None
+
+
+class AnalyticsRouter:
+    def __init__(self, engine: Engine, source_dialect: str, mode: str = "aggregate"):
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"Unknown analytics routing {mode!r}, use one of {', '.join(ROUTING_MODES)}")
+        self.engine = engine
+        self.dialect = dialect_for(engine)
+        # sqlglot dialect the SQL is generated in
+        self.source_dialect = source_dialect
+        self.mode = mode
+        self.catalog = SchemaCatalog(engine, change_check=False, dialect=self.dialect)
+
+    def route(self, sql: str) -> Optional[str]:
+        """The query in the dialect of the copy, or None when it runs on the primary database."""
+        try:
+            statement = sqlglot.parse_one(sql, read=self.source_dialect)
+        except sqlglot.errors.ParseError:
+            return None
+        if self.mode == "aggregate" and not analytical(statement):
+            return None
+        ctes = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        tables = {table.name.lower() for table in statement.find_all(exp.Table)} - ctes
+        try:
+            known = {name.lower() for name in self.catalog.table_names()}
+        except Exception as e:
+            # The copy may be missing or being replaced; the primary database still answers
+            logger.warning("Analytics copy unavailable: %s", e)
+            self.catalog.invalidate()
+            return None
+        if not tables or not tables <= known:
+            return None
+        try:
+            return statement.sql(dialect=self.dialect.sqlglot)
+        except sqlglot.errors.UnsupportedError:
+            return None
@@ -0,0 +1,509 @@
+"""
+Asyncio variant of the SQL Chatbot for use inside an event loop.
+"""
+import asyncio
+import time
+from contextlib import closing
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from sql_analyzer import export
+from sql_analyzer.config import cfg
+from sql_analyzer.deadline import Deadline, DeadlineExceeded, astatement_deadline
+from sql_analyzer.db_pool import pool_stats
+from sql_analyzer.log_init import logger
+from sql_analyzer.metrics import ANALYTICS_QUERIES, QUESTION_SECONDS, QUESTIONS_TOTAL, SCHEMA_TOKENS, STAGE_SECONDS
+from sql_analyzer.ollama_llm import LLMUsageCallback
+from sql_analyzer.result_summary import QueryResult
+from sql_analyzer.schema_catalog import SchemaCatalog
+from sql_analyzer.schema_prompt import estimate_tokens
+from sql_analyzer.singleflight import AsyncSingleFlight
+from sql_analyzer.sql_repair import QueryError
+from sql_analyzer.sql_chatbot import SQLChatbot, advance
+
+if TYPE_CHECKING:
+    from langchain_community.llms import Ollama
+
+
+class AsyncSQLChatbot(SQLChatbot):
+    """SQLChatbot with awaitable stages.
+
+    LLM calls go through the async Ollama client and blocking SQLAlchemy work
+    runs in the default thread pool, so the event loop stays free while a
+    question is being answered. When an async engine is given, queries run on
+    it directly instead.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        llm: "Ollama",
+        catalog: Optional[SchemaCatalog] = None,
+        async_engine: Optional[AsyncEngine] = None,
+        analytics_engine: Optional[Engine] = None,
+    ):
+        super().__init__(engine, llm, catalog, analytics_engine)
+        self.async_engine = async_engine
+        # Coalescing of identical in-flight questions and queries on the event loop
+        self.asql_flight = AsyncSingleFlight()
+        self.aquery_flight = AsyncSingleFlight()
+        self.aanswer_flight = AsyncSingleFlight()
+
+    async def aget_table_names(self) -> List[str]:
+        return await asyncio.to_thread(self.get_table_names)
+
+    async def aselect_tables(self, question: str) -> List[str]:
+        return await asyncio.to_thread(self.select_tables, question)
+
+    async def aget_schemas(self, table_names: List[str], question: str = "") -> str:
+        return await asyncio.to_thread(self.get_schemas, table_names, question)
+
+    async def agenerate_sql(self, question: str, schema: str, deadline: Optional[Deadline] = None) -> str:
+        """Generate SQL based on question and schema."""
+        return "".join([token async for token in self.astream_sql(question, schema, deadline)]).strip()
+
+    async def astream_sql(self, question: str, schema: str, deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+        """Generate SQL, yielding tokens as the LLM produces them."""
+        async for token in self._allm_stream(self.sql_prompt(question, schema), "sql_generation", deadline):
+            yield token
+
+    async def avalidate_sql(self, question: str, sql: str, schema: str, deadline: Optional[Deadline] = None) -> str:
+        """Check generated SQL before it runs, sending rejected SQL back to the LLM for repair."""
+        if not cfg.sql_validation:
+            return sql
+        steps = self._validation_steps(question, sql, schema)
+        done, value = await asyncio.to_thread(advance, steps)
+        while not done:
+            fixed = "".join([token async for token in self._allm_stream(value, "sql_repair", deadline)]).strip()
+            done, value = await asyncio.to_thread(advance, steps, fixed)
+        return value
+
+    async def aexecute_query(
+        self,
+        sql: str,
+        max_rows: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+        engine: Optional[Engine] = None,
+    ) -> QueryResult:
+        """Execute a SQL query and return at most max_rows rows of the results.
+
+        Cancelling the awaiting task cancels the deadline, which stops the
+        query on the database. On the async engine the query also gets a
+        database-side timeout for the time left. Queries on another (sync)
+        engine always run in the thread pool.
+        """
+        deadline = deadline or Deadline()
+        try:
+            if self.async_engine is None or engine is not None:
+                return await asyncio.to_thread(self.execute_query, sql, max_rows, deadline, engine)
+            return await asyncio.wait_for(self._aexecute_async(sql, max_rows, deadline), deadline.remaining())
+        except asyncio.CancelledError:
+            deadline.cancel()
+            raise
+        except DeadlineExceeded:
+            raise
+        except TimeoutError:
+            raise DeadlineExceeded("Request deadline exceeded")
+
+    async def _aexecute_async(self, sql: str, max_rows: Optional[int], deadline: Deadline) -> QueryResult:
+        max_rows = cfg.max_result_rows if max_rows is None else max_rows
+        try:
+            async with self.async_engine.connect() as conn, astatement_deadline(conn, deadline):
+                result = await conn.stream(text(sql))
+                rows = QueryResult(columns=list(result.keys()))
+                # Fetch in batches and stop one row past the cap to detect truncation
+                while len(rows) <= max_rows:
+                    deadline.check()
+                    batch = await result.fetchmany(min(cfg.result_fetch_batch, max_rows + 1 - len(rows)))
+                    if not batch:
+                        break
+                    rows.extend(batch)
+                if len(rows) > max_rows:
+                    del rows[max_rows:]
+                    rows.truncated = True
+                    logger.warning("Result truncated to %s rows", max_rows)
+                await result.close()
+                return rows
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if deadline.expired():
+                deadline.check()
+            raise QueryError(e)
+
+    async def aformat_response(
+        self, question: str, result: List[Tuple], sql: str, deadline: Optional[Deadline] = None
+    ) -> str:
+        """Format the result in natural language."""
+        return "".join([token async for token in self.astream_response(question, result, sql, deadline)]).strip()
+
+    async def astream_response(
+        self, question: str, result: List[Tuple], sql: str, deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[str]:
+        """Format the result in natural language, yielding tokens as they are produced."""
+        response = self.fast_format(question, result, sql)
+        if response is not None:
+            yield response
+            return
+        async for token in self._allm_stream(self.response_prompt(question, result, sql), "formatting", deadline):
+            yield token
+
+    async def _allm_stream(self, prompt: str, stage: str, deadline: Optional[Deadline] = None) -> AsyncIterator[str]:
+        """Stream tokens from the LLM, recording its token usage for the stage.
+
+        The call waits for a slot of the LLM scheduler first. Waiting for each
+        token is bounded by the time left, including the first one; closing
+        the stream drops the Ollama request.
+        """
+        async with self.llm_scheduler.aslot(stage, deadline):
+            tokens = self.llm.astream(prompt, config={"callbacks": [LLMUsageCallback(stage)]})
+            try:
+                while True:
+                    if deadline is not None:
+                        deadline.check()
+                    try:
+                        async with asyncio.timeout(deadline.remaining() if deadline else None):
+                            token = await anext(tokens)
+                    except StopAsyncIteration:
+                        return
+                    except TimeoutError:
+                        raise DeadlineExceeded("Request deadline exceeded")
+                    yield token
+            finally:
+                await tokens.aclose()
+
+    def _pools(self) -> List[Tuple[str, Any]]:
+        pools = super()._pools()
+        if self.async_engine is not None:
+            pools.append(("async", self.async_engine.pool))
+        return pools
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Occupancy and wait-time metrics of the sync and, if used, async pools."""
+        stats = super().pool_stats()
+        if self.async_engine is not None:
+            stats = {"sync": stats, "async": pool_stats(self.async_engine.pool)}
+        return stats
+
+    async def astream_question(
+        self, question: str, deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Run the full pipeline for a question, yielding the same events as stream_question."""
+        deadline = deadline or Deadline(cfg.request_timeout)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            async for event in self._arun_pipeline(question, deadline):
+                if event["event"] == "done":
+                    outcome = "ok"
+                yield event
+        except DeadlineExceeded:
+            outcome = "timeout"
+            raise
+        finally:
+            QUESTIONS_TOTAL.inc(outcome=outcome)
+            QUESTION_SECONDS.observe(time.perf_counter() - start)
+
+    async def _arun_pipeline(self, question: str, deadline: Deadline) -> AsyncIterator[Dict[str, Any]]:
+        key = await asyncio.to_thread(self.cache_key, question)
+        cached = self.answer_cache.get(key)
+        if cached is not None:
+            logger.info("Answer cache hit for question: %s", key[0])
+            yield {"event": "sql", "sql": cached["sql"]}
+            yield {"event": "done", **cached}
+            return
+
+        # 1. Look up previously generated SQL, otherwise build it from the schema.
+        # Identical questions in flight share one generation, identical SQL one
+        # execution and one answer; waiters skip the token events.
+        sql, from_cache = await asyncio.to_thread(self._known_sql, key, question)
+        if sql is None:
+            generated: Dict[str, Any] = {}
+            async for event in self._acoalesced(
+                self.asql_flight, key, lambda: self._asql_events(question, generated, deadline), generated, deadline
+            ):
+                yield event
+            sql = generated["value"]
+        yield {"event": "sql", "sql": sql}
+        logger.info("Executing SQL query: %s", sql)
+
+        # 2. Execute SQL, repairing it if the database rejects it; only SQL that ran successfully is cached
+        executed: Dict[str, Any] = {}
+        async for event in self._aexecute_events(question, sql, executed, deadline):
+            yield event
+        result = executed["result"]
+        sql = await asyncio.to_thread(self._save_executed, key, question, sql, executed["sql"], result, from_cache)
+        yield {"event": "executed", "row_count": len(result), "truncated": result.truncated}
+
+        # 3. Format response
+        formatted: Dict[str, Any] = {}
+        async for event in self._acoalesced(
+            self.aanswer_flight,
+            (key, sql),
+            lambda: self._aanswer_events(question, result, sql, formatted, deadline),
+            formatted,
+            deadline,
+        ):
+            yield event
+
+        answer = {"sql": sql, "response": formatted["value"]}
+        self.answer_cache.put(key, answer)
+        yield {"event": "done", **answer}
+
+    async def _asql_events(
+        self, question: str, out: Dict[str, Any], deadline: Deadline
+    ) -> AsyncIterator[Dict[str, Any]]:
+        with STAGE_SECONDS.time(stage="table_extraction"):
+            table_names = await self.aselect_tables(question)
+        logger.info("Selected tables: %s", ", ".join(table_names))
+        yield {"event": "table", "table": table_names[0], "tables": table_names}
+        with STAGE_SECONDS.time(stage="schema_fetch"):
+            schema = await self.aget_schemas(table_names, question)
+        SCHEMA_TOKENS.observe(estimate_tokens(schema))
+        tokens = []
+        with STAGE_SECONDS.time(stage="sql_generation"):
+            async for token in self.astream_sql(question, schema, deadline):
+                tokens.append(token)
+                yield {"event": "sql_token", "token": token}
+        with STAGE_SECONDS.time(stage="validation"):
+            out["value"] = await self.avalidate_sql(question, "".join(tokens).strip(), schema, deadline)
+
+    async def _arun_query(self, sql: str, deadline: Deadline) -> QueryResult:
+        routed = self.analytics.route(sql) if self.analytics is not None else None
+        if routed is not None:
+            engine = self.analytics.engine
+            try:
+                with STAGE_SECONDS.time(stage="analytics_execution"):
+                    result = await self.aquery_flight.do(
+                        (engine.url, routed),
+                        lambda: self.aexecute_query(routed, deadline=deadline, engine=engine),
+                        deadline.remaining(),
+                    )
+                ANALYTICS_QUERIES.inc(outcome="ok")
+                return result
+            except QueryError as e:
+                ANALYTICS_QUERIES.inc(outcome="fallback")
+                logger.warning("Query failed on the analytics copy, running it on the database: %s", e.detail)
+        with STAGE_SECONDS.time(stage="db_execution"):
+            return await self.aquery_flight.do(
+                sql, lambda: self.aexecute_query(sql, deadline=deadline), deadline.remaining()
+            )
+
+    async def _aexecute_events(
+        self, question: str, sql: str, out: Dict[str, Any], deadline: Deadline
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Like _execute_events; the SQL that ran and its result go into out["sql"] and out["result"]."""
+        try:
+            out["sql"], out["result"] = sql, await self._arun_query(sql, deadline)
+            return
+        except QueryError as e:
+            steps = self._repair_steps(question, sql, e, deadline)
+        with self._repair_budget(deadline) as budget, closing(steps):
+            done, step = await asyncio.to_thread(advance, steps)
+            while not done:
+                kind, value = step
+                reply, error = None, None
+                try:
+                    if kind == "event":
+                        yield value
+                    elif kind == "schema":
+                        reply = await self.aget_schemas(await self.aselect_tables(question), question)
+                    elif kind == "llm":
+                        reply = "".join([token async for token in self._allm_stream(value, "sql_repair", budget)]).strip()
+                    else:
+                        fixed = await asyncio.to_thread(self.sql_guard.validate, value) if cfg.sql_validation else value
+                        reply = fixed, await self._arun_query(fixed, budget)
+                except Exception as e:
+                    error = e
+                done, step = await asyncio.to_thread(advance, steps, reply, error)
+            out["sql"], out["result"] = step
+
+    async def _aanswer_events(
+        self, question: str, result: List[Tuple], sql: str, out: Dict[str, Any], deadline: Deadline
+    ) -> AsyncIterator[Dict[str, Any]]:
+        tokens = []
+        with STAGE_SECONDS.time(stage="formatting"):
+            async for token in self.astream_response(question, result, sql, deadline):
+                tokens.append(token)
+                yield {"event": "answer_token", "token": token}
+        out["value"] = "".join(tokens).strip()
+
+    async def _acoalesced(
+        self,
+        flight: AsyncSingleFlight,
+        key: Hashable,
+        run: Callable[[], AsyncIterator[Dict[str, Any]]],
+        out: Dict[str, Any],
+        deadline: Deadline,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Run a stage's events once per key; concurrent callers only get its result in out["value"]."""
+        call, leader = flight.claim(key)
+        if not leader:
+            try:
+                value = await flight.wait(call, deadline.remaining())
+            except TimeoutError:
+                raise DeadlineExceeded("Request deadline exceeded")
+            if value is not None:
+                out["value"] = value
+                return
+            # The leader went away before finishing; do the work here instead
+            async for event in run():
+                yield event
+            return
+        try:
+            async for event in run():
+                yield event
+        except DeadlineExceeded:
+            # The leader's deadline is not the waiters'; they take over the work
+            raise
+        except Exception as e:
+            flight.fail(key, call, e)
+            raise
+        finally:
+            flight.finish(key, call, out.get("value"))
+
+    async def _agenerate_valid_sql(
+        self, question: str, schema: str, llm_slots: asyncio.Semaphore, deadline: Deadline
+    ) -> str:
+        async with llm_slots:
+            sql = await self.agenerate_sql(question, schema, deadline)
+            return await self.avalidate_sql(question, sql, schema, deadline)
+
+    def coalesce_stats(self) -> Dict[str, Dict[str, int]]:
+        """In-flight calls, current waiters and coalesced calls per stage."""
+        return {
+            "sql": self.asql_flight.stats(),
+            "execution": self.aquery_flight.stats(),
+            "answer": self.aanswer_flight.stats(),
+        }
+
+    async def aprocess_batch(
+        self, questions: List[str], deadline: Optional[float] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Answer many questions, yielding a ``result`` event per question as it completes.
+
+        Like process_batch, but questions run as tasks and those still open at
+        the deadline are cancelled.
+        """
+        timeout = cfg.batch_deadline if deadline is None else min(deadline, cfg.batch_deadline)
+        expires = time.monotonic() + timeout
+        batch_deadline = Deadline(timeout)
+        plans = await asyncio.to_thread(self.plan_batch, questions)
+        llm_slots = asyncio.Semaphore(max(1, cfg.batch_llm_concurrency))
+        tasks = {
+            asyncio.ensure_future(self._abatch_item(question, plan, llm_slots, batch_deadline)): i
+            for i, (question, plan) in enumerate(zip(questions, plans))
+        }
+        counts = {"completed": 0, "failed": 0, "timed_out": 0}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, expires - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in sorted(done, key=tasks.get):
+                    yield self._batch_result(tasks[task], questions, task, counts)
+            for task in sorted(pending, key=tasks.get):
+                task.cancel()
+                counts["timed_out"] += 1
+                i = tasks[task]
+                yield {"event": "result", "index": i, "question": questions[i], "error": "Deadline exceeded"}
+        finally:
+            for task in pending:
+                task.cancel()
+            batch_deadline.cancel("Batch deadline exceeded")
+        yield {"event": "done", **counts}
+
+    async def _abatch_item(
+        self, question: str, plan: Any, llm_slots: asyncio.Semaphore, deadline: Deadline
+    ) -> Dict[str, str]:
+        """One question of a batch: the pipeline without events, with LLM calls limited by llm_slots."""
+        async def limited(tokens: AsyncIterator[str]) -> str:
+            async with llm_slots:
+                return "".join([token async for token in tokens]).strip()
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            key = await asyncio.to_thread(self.cache_key, question)
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                outcome = "ok"
+                return {"sql": cached["sql"], "response": cached["response"]}
+            sql, from_cache = await asyncio.to_thread(self._known_sql, key, question)
+            if sql is None:
+                if isinstance(plan, Exception):
+                    raise plan
+                with STAGE_SECONDS.time(stage="sql_generation"):
+                    sql = await self.asql_flight.do(
+                        key, lambda: self._agenerate_valid_sql(question, plan, llm_slots, deadline), deadline.remaining()
+                    )
+            executed: Dict[str, Any] = {}
+            async for _ in self._aexecute_events(question, sql, executed, deadline):
+                pass
+            result = executed["result"]
+            sql = await asyncio.to_thread(self._save_executed, key, question, sql, executed["sql"], result, from_cache)
+            with STAGE_SECONDS.time(stage="formatting"):
+                response = self.fast_format(question, result, sql)
+                if response is None:
+                    prompt = self.response_prompt(question, result, sql)
+                    response = await self.aanswer_flight.do(
+                        (key, sql),
+                        lambda: limited(self._allm_stream(prompt, "formatting", deadline)),
+                        deadline.remaining(),
+                    )
+            answer = {"sql": sql, "response": response}
+            self.answer_cache.put(key, answer)
+            outcome = "ok"
+            return answer
+        except DeadlineExceeded:
+            outcome = "timeout"
+            raise
+        finally:
+            QUESTIONS_TOTAL.inc(outcome=outcome)
+            QUESTION_SECONDS.observe(time.perf_counter() - start)
+
+    async def aprocess_question(self, question: str, deadline: Optional[Deadline] = None) -> Dict[str, str]:
+        """Run the full pipeline for a question and return the SQL used and the answer."""
+        async for event in self.astream_question(question, deadline):
+            if event["event"] == "done":
+                return {"sql": event["sql"], "response": event["response"]}
+        raise Exception("Pipeline finished without an answer")
+
+    async def aexport_question(
+        self, question: str, fmt: str, deadline: Optional[Deadline] = None
+    ) -> Tuple[Dict[str, str], AsyncIterator[bytes]]:
+        """Like export_question; the export is read in the thread pool one encoded batch at a time."""
+        export.check_format(fmt)
+        answer = await self.aprocess_question(question, deadline)
+        return answer, self._aexport_query(answer["sql"], fmt)
+
+    async def _aexport_query(self, sql: str, fmt: str) -> AsyncIterator[bytes]:
+        deadline = Deadline(cfg.export_timeout)
+        chunks = self.export_query(sql, fmt, deadline)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # Stops the query if the client went away mid-export
+            deadline.cancel("Export stopped")
+            try:
+                chunks.close()
+            except ValueError:
+                # Still running in a worker thread; it stops at the next deadline check
+                pass
+
+    async def aanswer_question(self, question: str) -> str:
+        """Process a question and return a natural language answer."""
+        try:
+            return (await self.aprocess_question(question))["response"]
+        except Exception as e:
+            return f"I apologize, but I encountered an error: {str(e)}"
@@ -0,0 +1,299 @@
+"""
+Column statistics that ground the values in generated SQL.
+
+A background thread profiles one table at a time: row count, non-null count,
+distinct count and min/max of every column over the first
+COLUMN_PROFILE_SAMPLE_ROWS rows, plus the most frequent values of low-cardinality columns. Tables are
+profiled again only when their columns change or their stats are older than
+the profile interval. The stats are kept as rendered SQL literals in a small
+JSON file so they survive restarts, and the schema prompt shows them as
+column comments, e.g. "-- 3 values: 'O', 'C', 'X'". With several server
+workers only one profiles; the others reload the file when it changes.
+"""
+import decimal
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import column, func, literal_column, select, table
+from sqlalchemy.engine import Engine
+
+from sql_analyzer.deadline import Deadline, statement_deadline
+from sql_analyzer.log_init import logger
+from sql_analyzer.schema_catalog import ColumnInfo, SchemaCatalog
+
+NUMERIC_TYPES = {
+    "int", "integer", "bigint", "smallint", "tinyint", "mediumint", "decimal", "numeric", "float", "real",
+    "double", "money", "smallmoney",
+}
+TEMPORAL_TYPES = {"date", "datetime", "datetime2", "smalldatetime", "datetimeoffset", "time", "timestamp", "year"}
+# Types that cannot be compared, grouped or counted distinct cheaply (or at all on SQL Server)
+SKIPPED_TYPES = {
+    "text", "ntext", "image", "xml", "binary", "varbinary", "blob", "longblob", "mediumblob", "tinyblob",
+    "geography", "geometry", "hierarchyid", "sql_variant", "json",
+}
+MAX_PROFILED_LENGTH = 255
+# Seconds between checks of processes that reload the stats file instead of profiling
+RELOAD_INTERVAL = 60
+
+
+class ColumnStats(NamedTuple):
+    rows: int
+    nulls: int
+    distinct: int
+    minimum: Optional[str]
+    maximum: Optional[str]
+    # Most frequent values as SQL literals with their counts, for low-cardinality columns
+    top_values: List[List[Any]]
+    # Only the first sample rows were read, so the table may hold other values
+    sampled: bool
+
+
+def sql_literal(value: Any, max_length: int = 60) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    text = str(value)
+    if len(text) > max_length:
+        text = text[: max_length - 3] + "..."
+    return "'" + text.replace("'", "''") + "'"
+
+
+def profiled(column_info: ColumnInfo) -> bool:
+    data_type = column_info.data_type.lower()
+    if data_type in SKIPPED_TYPES:
+        return False
+    # nvarchar(max) and long strings: too expensive to group and rarely coded values
+    return column_info.max_length is None or 0 < column_info.max_length <= MAX_PROFILED_LENGTH
+
+
+def has_range(column_info: ColumnInfo) -> bool:
+    return column_info.data_type.lower() in NUMERIC_TYPES | TEMPORAL_TYPES
+
+
+def table_fingerprint(columns: Sequence[ColumnInfo]) -> str:
+    digest = hashlib.sha1()
+    for column_info in columns:
+        digest.update(f"{column_info.name}\0{column_info.data_type}\0{column_info.max_length}\0".encode())
+    return digest.hexdigest()
+
+
+def describe(stats: ColumnStats, max_values: int = 10) -> str:
+    """Comment text for the schema prompt: coded values or the range, and how often the column is NULL.
+
+    Numbers and dates show their values only when all of them fit, otherwise their range.
+    """
+    parts = []
+    complete = stats.distinct <= max_values
+    if stats.top_values and (complete or not stats.minimum):
+        values = ", ".join(value for value, _ in stats.top_values[:max_values])
+        more = ", ..." if stats.distinct > max_values else ""
+        parts.append(f"{stats.distinct} values: {values}{more}")
+    elif stats.minimum is not None and stats.maximum is not None:
+        parts.append(f"{'sampled ' if stats.sampled else ''}range {stats.minimum} to {stats.maximum}")
+    if stats.rows and stats.nulls / stats.rows >= 0.05:
+        parts.append(f"{stats.nulls / stats.rows:.0%} NULL")
+    return "; ".join(parts)
+
+
+class ColumnProfiler:
+    """Profiles tables in the background and serves their column stats from memory."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        catalog: SchemaCatalog,
+        path: str = "",
+        sample_rows: int = 100_000,
+        top_k: int = 10,
+        max_distinct: int = 50,
+        interval: float = 86_400,
+        timeout: float = 60,
+    ):
+        self.engine = engine
+        self.catalog = catalog
+        self.path = path
+        self.sample_rows = sample_rows
+        self.top_k = top_k
+        self.max_distinct = max_distinct
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._tables: Dict[str, Dict[str, Any]] = {}
+        self._loaded_mtime: Optional[int] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if path:
+            self.load()
+
+    def load(self) -> bool:
+        """Read the stats file if it changed since it was last read; returns whether it was read."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return False
+        try:
+            with open(self.path) as f:
+                tables = json.load(f)["tables"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not read column stats from %s: %s", self.path, e)
+            return False
+        with self._lock:
+            self._tables = tables
+            self._loaded_mtime = mtime
+        return True
+
+    def stats(self, table_name: str) -> Dict[str, ColumnStats]:
+        """Column name -> stats of a table, empty until it has been profiled with its current columns."""
+        with self._lock:
+            entry = self._tables.get(table_name)
+        if entry is None or entry["fingerprint"] != table_fingerprint(self.catalog.columns(table_name)):
+            return {}
+        return {name: ColumnStats(*values) for name, values in entry["columns"].items()}
+
+    def start(self, profile: bool = True) -> None:
+        """Profile stale tables now and then every interval, on a daemon thread.
+
+        With profile False another process profiles, and this one only
+        reloads the stats file when it changes (without a file it profiles).
+        """
+        if self._thread is None:
+            target = self._run if profile or not self.path else self._follow
+            self._thread = threading.Thread(target=target, name="column-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.profile_stale()
+            except Exception as e:
+                logger.warning("Column profiling failed: %s", e)
+            self._stopped.wait(min(self.interval, 3600))
+
+    def _follow(self) -> None:
+        while not self._stopped.wait(RELOAD_INTERVAL):
+            if self.load():
+                logger.info("Reloaded column stats from %s", self.path)
+
+    def stale_tables(self) -> List[str]:
+        now = time.time()
+        stale = []
+        for table_name in self.catalog.table_names():
+            with self._lock:
+                entry = self._tables.get(table_name)
+            if (
+                entry is None
+                or entry["fingerprint"] != table_fingerprint(self.catalog.columns(table_name))
+                or now - entry["profiled_at"] >= self.interval
+            ):
+                stale.append(table_name)
+        return stale
+
+    def profile_stale(self) -> int:
+        """Profile the tables without current stats, one at a time; returns how many were profiled."""
+        profiled_tables = 0
+        for table_name in self.stale_tables():
+            if self._stopped.is_set():
+                break
+            try:
+                self.profile_table(table_name)
+                profiled_tables += 1
+            except Exception as e:
+                # Skip the table until the next round, the others still get stats
+                logger.warning("Could not profile table %s: %s", table_name, e)
+        if profiled_tables:
+            self.save()
+        return profiled_tables
+
+    def profile_table(self, table_name: str) -> Dict[str, ColumnStats]:
+        start = time.perf_counter()
+        columns = self.catalog.columns(table_name)
+        targets = [column_info for column_info in columns if profiled(column_info)]
+        stats: Dict[str, ColumnStats] = {}
+        if targets:
+            stats = self._profile_columns(table_name, targets)
+        with self._lock:
+            self._tables[table_name] = {
+                "fingerprint": table_fingerprint(columns),
+                "profiled_at": time.time(),
+                "columns": {name: list(column_stats) for name, column_stats in stats.items()},
+            }
+        logger.info("Profiled %s columns of %s in %.2fs", len(stats), table_name, time.perf_counter() - start)
+        return stats
+
+    def _profile_columns(self, table_name: str, targets: List[ColumnInfo]) -> Dict[str, ColumnStats]:
+        source = table(table_name, *[column(column_info.name) for column_info in targets])
+        sample = select(*source.c)
+        if self.sample_rows > 0:
+            sample = sample.limit(self.sample_rows)
+        sample = sample.subquery("sample")
+
+        aggregates = [func.count(literal_column("*"))]
+        for column_info in targets:
+            values = sample.c[column_info.name]
+            aggregates.extend([func.count(values), func.count(values.distinct())])
+            if has_range(column_info):
+                aggregates.extend([func.min(values), func.max(values)])
+
+        stats: Dict[str, ColumnStats] = {}
+        with self.engine.connect() as conn, statement_deadline(conn, Deadline(self.timeout)):
+            row = conn.execute(select(*aggregates)).one()
+            rows, position = row[0], 1
+            for column_info in targets:
+                present, distinct = row[position], row[position + 1]
+                position += 2
+                minimum = maximum = None
+                if has_range(column_info):
+                    low, high = row[position], row[position + 1]
+                    position += 2
+                    minimum = None if low is None else sql_literal(low)
+                    maximum = None if high is None else sql_literal(high)
+                top_values: List[List[Any]] = []
+                if 0 < distinct <= self.max_distinct:
+                    values = sample.c[column_info.name]
+                    count = func.count(literal_column("*"))
+                    query = (
+                        select(values, count).where(values.is_not(None))
+                        .group_by(values).order_by(count.desc()).limit(self.top_k)
+                    )
+                    top_values = [[sql_literal(value), frequency] for value, frequency in conn.execute(query)]
+                stats[column_info.name] = ColumnStats(
+                    rows, rows - present, distinct, minimum, maximum, top_values, 0 < self.sample_rows <= rows
+                )
+        return stats
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps({"tables": self._tables}, separators=(",", ":"))
+        # Write a file of our own and rename it, so neither a crash nor another
+        # process writing at the same time leaves a partial file behind
+        directory, name = os.path.split(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, prefix=f"{name}.", suffix=".tmp", delete=False) as f:
+            f.write(data)
+        try:
+            os.replace(f.name, self.path)
+        except OSError:
+            os.unlink(f.name)
+            raise
+        with self._lock:
+            self._loaded_mtime = os.stat(self.path).st_mtime_ns
+
+
+if __name__ == "__main__":
+    from sql_analyzer.agent_factory import init_chatbot
+
+    chatbot = init_chatbot()
+    profiler = chatbot.column_profiler or ColumnProfiler(chatbot.engine, chatbot.catalog)
+    logger.info("Profiled %s tables", profiler.profile_stale())
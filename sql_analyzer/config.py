@@ -9,7 +9,20 @@ load_dotenv()
 SNOWFLAKE = "snowflake"
 MYSQL = "mysql"
 MSSQL = "mssql"
-SELECTED_DBS = [MSSQL, MYSQL]
+# Local files, given by DB_CONNECTION_STRING (sqlite:///data.db, duckdb:///data.duckdb)
+SQLITE = "sqlite"
+DUCKDB = "duckdb"
+SELECTED_DBS = [MSSQL, MYSQL, SQLITE, DUCKDB]
+
+
+def duration(value):
+    """Ollama durations are seconds as a number or strings like "30m"."""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
 
 
 class MSSQLConfig:
@@ -24,15 +37,163 @@ class Config:
     # Ollama Configuration
     ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
     ollama_model = os.getenv("OLLAMA_MODEL", "codellama:13b")
+    # How long Ollama keeps the model loaded after a request ("30m", seconds,
+    # or -1 for always), the context window size, and whether to load the model
+    # and its prompt prefix with a warm-up call at startup
+    ollama_keep_alive = duration(os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+    ollama_num_ctx = int(os.getenv("OLLAMA_NUM_CTX")) if os.getenv("OLLAMA_NUM_CTX") else None
+    llm_warm_up = os.getenv("LLM_WARM_UP", "true").lower() == "true"
 
     # Database Configuration
     db_uri = os.getenv("DB_CONNECTION_STRING")
     mssql_config = MSSQLConfig()
     selected_db = os.getenv("SELECTED_DB")
-    if selected_db not in SELECTED_DBS:
-        raise Exception(
-            f"Selected DB {selected_db} not recognized. The possible values are: {SELECTED_DBS}."
-        )
+
+    # Connection pool (QueuePool) settings, shared by the sync and async engines
+    db_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+    db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    db_pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+    # Optional async engine (mssql+aioodbc / mysql+asyncmy) for AsyncSQLChatbot
+    use_async_engine = os.getenv("USE_ASYNC_ENGINE", "false").lower() == "true"
+    async_db_uri = os.getenv("ASYNC_DB_CONNECTION_STRING")
+
+    # Optional local DuckDB or SQLite copy of the tables for analytical queries
+    # (duckdb:///analytics.duckdb). SQL is still generated for the database; with
+    # ANALYTICS_ROUTING=aggregate, queries with GROUP BY, aggregate or window
+    # functions are transpiled and run on the copy; with ANALYTICS_ROUTING=all
+    # every query is routed there, as long as all of its tables are in the copy.
+    analytics_db_uri = os.getenv("ANALYTICS_DB_CONNECTION_STRING")
+    analytics_routing = os.getenv("ANALYTICS_ROUTING", "aggregate")
+
+    # server.py: pre-forked worker processes, request threads per worker and
+    # how many requests may wait per worker before new ones are rejected
+    server_workers = int(os.getenv("SERVER_WORKERS", "1"))
+    server_threads = int(os.getenv("SERVER_THREADS", "8"))
+    server_queue_size = int(os.getenv("SERVER_QUEUE_SIZE", "64"))
+
+    # Start-up: the servers build the chatbot and load the schema in the
+    # background. Requests wait up to STARTUP_WAIT seconds for the chatbot
+    # before 503; an unreachable database is retried every STARTUP_RETRY_INTERVAL
+    # seconds, doubling up to a minute.
+    startup_wait = float(os.getenv("STARTUP_WAIT", "10"))
+    startup_retry_interval = float(os.getenv("STARTUP_RETRY_INTERVAL", "5"))
+
+    # Result guardrails: rows fetched per query (in batches), and how many rows
+    # the formatting prompt sees before the result is summarized
+    max_result_rows = int(os.getenv("MAX_RESULT_ROWS", "1000"))
+    result_fetch_batch = int(os.getenv("RESULT_FETCH_BATCH", "500"))
+    prompt_preview_rows = int(os.getenv("PROMPT_PREVIEW_ROWS", "20"))
+
+    # Generated SQL is parsed and checked before it runs (read-only, known
+    # tables and columns, row limit of max_result_rows). Queries whose estimated
+    # plan cost (SHOWPLAN_XML / EXPLAIN) exceeds SQL_MAX_COST are rejected, 0
+    # skips the plan. Rejected SQL goes back to the LLM SQL_REPAIR_ATTEMPTS times.
+    sql_validation = os.getenv("SQL_VALIDATION", "true").lower() == "true"
+    sql_max_cost = float(os.getenv("SQL_MAX_COST", "0"))
+    sql_repair_attempts = int(os.getenv("SQL_REPAIR_ATTEMPTS", "1"))
+
+    # SQL that fails on the database is repaired up to QUERY_REPAIR_ATTEMPTS
+    # times within QUERY_REPAIR_TIMEOUT seconds: dialect mix-ups are rewritten
+    # without the LLM, other errors go back to it with the error message. Fixes
+    # are cached by failing SQL and error class.
+    query_repair_attempts = int(os.getenv("QUERY_REPAIR_ATTEMPTS", "2"))
+    query_repair_timeout = float(os.getenv("QUERY_REPAIR_TIMEOUT", "30"))
+    query_repair_cache_size = int(os.getenv("QUERY_REPAIR_CACHE_SIZE", "256"))
+
+    # Answer simple results (scalars, single rows, small tables) from templates
+    # instead of a second LLM call
+    fast_format_enabled = os.getenv("FAST_FORMAT_ENABLED", "true").lower() == "true"
+    fast_format_max_rows = int(os.getenv("FAST_FORMAT_MAX_ROWS", "10"))
+
+    # Schema catalog: seconds before the cached schema is re-checked, and whether
+    # to use the sys.objects modify_date watermark to skip reloads when nothing changed
+    schema_cache_ttl = float(os.getenv("SCHEMA_CACHE_TTL", "300"))
+    schema_change_check = os.getenv("SCHEMA_CHANGE_CHECK", "false").lower() == "true"
+
+    # Question caches: generated SQL is kept for long, final answers only briefly
+    sql_cache_size = int(os.getenv("SQL_CACHE_SIZE", "512"))
+    sql_cache_ttl = float(os.getenv("SQL_CACHE_TTL", "86400"))
+    answer_cache_size = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+    answer_cache_ttl = float(os.getenv("ANSWER_CACHE_TTL", "60"))
+
+    # LLM admission control: concurrent LLM calls (match OLLAMA_NUM_PARALLEL),
+    # calls that may wait for a slot before requests get 429 (0 = unbounded),
+    # and the queue order ("priority" runs formatting before new SQL, or "fifo")
+    llm_concurrency = int(os.getenv("LLM_CONCURRENCY", "2"))
+    llm_queue_size = int(os.getenv("LLM_QUEUE_SIZE", "32"))
+    llm_queue_policy = os.getenv("LLM_QUEUE_POLICY", "priority").lower()
+
+    # Result export from /query with "format": most rows exported (0 = all),
+    # rows per fetchmany batch (one Parquet row group each) and the seconds an
+    # export may stream before its query is cancelled (0 = no limit)
+    export_max_rows = int(os.getenv("EXPORT_MAX_ROWS", "1000000"))
+    export_fetch_batch = int(os.getenv("EXPORT_FETCH_BATCH", "10000"))
+    export_timeout = float(os.getenv("EXPORT_TIMEOUT", "600"))
+
+    # Seconds a single question may take end to end; LLM streams stop and
+    # running queries are cancelled on the database when it runs out (0 = no limit)
+    request_timeout = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
+    # Persistent store of questions and the validated SQL that answered them
+    # ("" disables): repeated questions reuse their SQL after restarts, and the
+    # most similar past questions are the few-shot examples of the SQL prompt
+    sql_store_path = os.getenv("SQL_STORE_PATH", "sql_store.sqlite3")
+    sql_store_size = int(os.getenv("SQL_STORE_SIZE", "5000"))
+    few_shot_examples = int(os.getenv("FEW_SHOT_EXAMPLES", "3"))
+    few_shot_min_score = float(os.getenv("FEW_SHOT_MIN_SCORE", "0.2"))
+
+    # /query/batch: most questions per request, concurrent LLM calls (Ollama
+    # serves OLLAMA_NUM_PARALLEL requests at once), worker threads for the
+    # threaded server and the longest a batch may take, in seconds
+    batch_max_questions = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+    batch_llm_concurrency = int(os.getenv("BATCH_LLM_CONCURRENCY", "2"))
+    batch_workers = int(os.getenv("BATCH_WORKERS", "8"))
+    batch_deadline = float(os.getenv("BATCH_DEADLINE", "300"))
+
+    # Table routing for large schemas: a vector index of table descriptions
+    # ("tfidf", "ollama" embeddings or "off") picks the few tables whose schemas
+    # go into the SQL prompt. The index is saved to <path>.npy / <path>.json.
+    table_index_backend = os.getenv("TABLE_INDEX_BACKEND", "tfidf").lower()
+    table_index_path = os.getenv("TABLE_INDEX_PATH", "table_index")
+    embedding_model = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+    max_prompt_tables = int(os.getenv("MAX_PROMPT_TABLES", "3"))
+    table_index_min_score = float(os.getenv("TABLE_INDEX_MIN_SCORE", "0.1"))
+
+    # Schema text in the SQL prompt: "compact" DDL or the "verbose" listing, an
+    # approximate token budget shared by the selected tables (0 for no limit),
+    # sample rows per table and the longest sample value shown
+    schema_style = os.getenv("SCHEMA_STYLE", "compact").lower()
+    schema_token_budget = int(os.getenv("SCHEMA_TOKEN_BUDGET", "1000"))
+    schema_sample_rows = int(os.getenv("SCHEMA_SAMPLE_ROWS", "3"))
+    schema_sample_value_length = int(os.getenv("SCHEMA_SAMPLE_VALUE_LENGTH", "40"))
+
+    # Column profiling: a background thread computes per-column null ratio,
+    # distinct count, min/max and the most frequent values of low-cardinality
+    # columns over the first COLUMN_PROFILE_SAMPLE_ROWS rows of each table (0 =
+    # all), and the schema prompt shows them as column comments. Stats are kept
+    # in COLUMN_STATS_PATH ("" = memory only) and refreshed every interval seconds.
+    column_profile = os.getenv("COLUMN_PROFILE", "true").lower() == "true"
+    column_stats_path = os.getenv("COLUMN_STATS_PATH", "column_stats.json")
+    column_profile_sample_rows = int(os.getenv("COLUMN_PROFILE_SAMPLE_ROWS", "100000"))
+    column_profile_top_k = int(os.getenv("COLUMN_PROFILE_TOP_K", "10"))
+    column_profile_max_distinct = int(os.getenv("COLUMN_PROFILE_MAX_DISTINCT", "50"))
+    column_profile_interval = float(os.getenv("COLUMN_PROFILE_INTERVAL", "86400"))
+    column_profile_timeout = float(os.getenv("COLUMN_PROFILE_TIMEOUT", "60"))
+
+    # Per-table aliases and column notes (JSON), see tables.json
+    table_metadata_path = os.getenv(
+        "TABLE_METADATA_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "tables.json")
+    )
+
+    def check_db(self) -> None:
+        """Raise if no supported database is selected; checked when the engine is created, not at import."""
+        if self.selected_db not in SELECTED_DBS:
+            raise Exception(
+                f"Selected DB {self.selected_db} not recognized. The possible values are: {SELECTED_DBS}."
+            )
 
 
 cfg = Config()
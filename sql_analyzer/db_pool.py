@@ -0,0 +1,90 @@
+"""
+Connection pool configuration and occupancy/wait-time metrics.
+"""
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+from sql_analyzer.config import cfg
+
+
+class _PoolWaitMetrics:
+    """Mixin timing every checkout from the pool, including the time spent queued."""
+
+    def _init_metrics(self) -> None:
+        self._metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.peak_checked_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self.checkout_timeouts += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._metrics_lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.peak_checked_out = max(self.peak_checked_out, self.checkedout())
+        return conn
+
+
+class InstrumentedQueuePool(_PoolWaitMetrics, QueuePool):
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._init_metrics()
+
+
+class InstrumentedAsyncQueuePool(_PoolWaitMetrics, AsyncAdaptedQueuePool):
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._init_metrics()
+
+
+def pool_kwargs(async_engine: bool = False) -> Dict[str, Any]:
+    """Engine keyword arguments for a configured, instrumented queue pool."""
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if async_engine else InstrumentedQueuePool,
+        "pool_size": cfg.db_pool_size,
+        "max_overflow": cfg.db_max_overflow,
+        "pool_timeout": cfg.db_pool_timeout,
+        "pool_recycle": cfg.db_pool_recycle,
+        "pool_pre_ping": cfg.db_pool_pre_ping,
+    }
+
+
+def pool_stats(pool: Pool) -> Dict[str, Any]:
+    """Current occupancy and cumulative wait-time figures of a pool."""
+    stats: Dict[str, Any] = {"pool_class": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+            }
+        )
+    if isinstance(pool, _PoolWaitMetrics):
+        with pool._metrics_lock:
+            stats.update(
+                {
+                    "checkouts": pool.checkouts,
+                    "checkout_timeouts": pool.checkout_timeouts,
+                    "peak_checked_out": pool.peak_checked_out,
+                    "avg_wait_seconds": pool.total_wait / pool.checkouts if pool.checkouts else 0.0,
+                    "max_wait_seconds": pool.max_wait,
+                    "total_wait_seconds": pool.total_wait,
+                }
+            )
+    return stats
@@ -0,0 +1,251 @@
+"""
+Per-request deadlines and cancellation.
+
+A Deadline travels with a question through the pipeline. LLM streams check
+it between tokens and stop, which closes the HTTP stream so Ollama stops
+generating. Queries get a database-side statement timeout for the time that
+is left and are cancelled on the server when the deadline is cancelled,
+for example because the client disconnected.
+"""
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Set
+
+from sql_analyzer.log_init import logger
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Connection
+    from sqlalchemy.ext.asyncio import AsyncConnection
+
+# KILL QUERY tasks started by cancel callbacks, referenced until they finish
+_kill_tasks: Set["asyncio.Task"] = set()
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time or was cancelled."""
+
+
+class Deadline:
+    def __init__(self, seconds: Optional[float] = None):
+        self.expires = time.monotonic() + seconds if seconds and seconds > 0 else None
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a time limit."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.cancelled or (self.expires is not None and time.monotonic() >= self.expires)
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise DeadlineExceeded(self.reason or "Request cancelled")
+        if self.expired():
+            raise DeadlineExceeded("Request deadline exceeded")
+
+    def cancel(self, reason: str = "Request cancelled") -> None:
+        """Cancel the request and run the cancel callbacks of work still in progress."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Cancel callback failed: %s", e)
+
+    def child(self, seconds: Optional[float] = None) -> "Deadline":
+        """A deadline for part of the work: at most seconds, and never later than this one.
+
+        Cancelling this deadline does not cancel the child; link them with
+        ``on_cancel(child.cancel)`` around the work.
+        """
+        child = Deadline(seconds)
+        if self.expires is not None and (child.expires is None or self.expires < child.expires):
+            child.expires = self.expires
+        return child
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """Run callback if the deadline is cancelled while inside the block."""
+        with self._lock:
+            self._callbacks.append(callback)
+            cancelled = self._cancelled.is_set()
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._callbacks.remove(callback)
+
+
+@contextmanager
+def statement_deadline(conn: "Connection", deadline: Optional[Deadline]) -> Iterator[None]:
+    """Bound the statements run on conn by the time left, and cancel them if the deadline is cancelled.
+
+    MSSQL uses the pyodbc query timeout and cursor.cancel(), MySQL the
+    MAX_EXECUTION_TIME session variable and KILL QUERY, SQLite a progress
+    handler and interrupt(), DuckDB a timer calling interrupt(). Session
+    settings are reset before the connection goes back to the pool.
+    """
+    if deadline is None:
+        yield
+        return
+    deadline.check()
+    name = conn.dialect.name
+    raw = conn.connection.driver_connection
+    remaining = deadline.remaining()
+
+    if name == "mssql":
+        from sqlalchemy import event
+
+        cursors = []
+
+        def track(conn, cursor, *args):
+            cursors.append(cursor)
+
+        raw.timeout = max(1, math.ceil(remaining)) if remaining is not None else 0
+        event.listen(conn, "before_cursor_execute", track)
+        try:
+            with deadline.on_cancel(lambda: [cursor.cancel() for cursor in cursors]):
+                yield
+        finally:
+            event.remove(conn, "before_cursor_execute", track)
+            raw.timeout = 0
+    elif name == "mysql":
+        thread_id = raw.thread_id()
+
+        def kill() -> None:
+            with conn.engine.connect() as killer:
+                killer.exec_driver_sql(f"KILL QUERY {thread_id}")
+
+        if remaining is not None:
+            conn.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {max(1, int(remaining * 1000))}")
+        try:
+            with deadline.on_cancel(kill):
+                yield
+        finally:
+            if remaining is not None:
+                conn.exec_driver_sql("SET SESSION MAX_EXECUTION_TIME = 0")
+    elif name == "sqlite":
+        raw.set_progress_handler(lambda: 1 if deadline.expired() else 0, 1000)
+        try:
+            with deadline.on_cancel(raw.interrupt):
+                yield
+        finally:
+            raw.set_progress_handler(None, 0)
+    elif name == "duckdb":
+        # No statement timeout; interrupt the connection once the time is up
+        timer = threading.Timer(remaining, raw.interrupt) if remaining is not None else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            with deadline.on_cancel(raw.interrupt):
+                yield
+        finally:
+            if timer is not None:
+                timer.cancel()
+    else:
+        yield
+
+
+@asynccontextmanager
+async def astatement_deadline(conn: "AsyncConnection", deadline: Optional[Deadline]) -> AsyncIterator[None]:
+    """statement_deadline for a connection of an async engine.
+
+    MSSQL (aioodbc) uses the pyodbc query timeout and cursor.cancel(), MySQL
+    (asyncmy) MAX_EXECUTION_TIME and KILL QUERY from another connection,
+    SQLite (aiosqlite) a progress handler that also stops on cancel. The
+    statement is cancelled as well when the awaiting task is cancelled, and
+    the connection is then invalidated instead of going back to the pool.
+    """
+    if deadline is None:
+        yield
+        return
+    deadline.check()
+    name = conn.dialect.name
+    raw = (await conn.get_raw_connection()).driver_connection
+    remaining = deadline.remaining()
+    loop = asyncio.get_running_loop()
+    stop: Callable[[], None] = lambda: None
+    reset: Optional[Callable[[], Awaitable[None]]] = None
+
+    if name == "mssql":
+        from sqlalchemy import event
+
+        cursors = []
+
+        def track(conn, cursor, *args):
+            cursors.append(cursor)
+
+        def stop() -> None:
+            # The pyodbc cursor under the aioodbc one; cancel() may be called from any thread
+            for cursor in cursors:
+                cursor._cursor._impl.cancel()
+
+        async def reset() -> None:
+            event.remove(conn.sync_connection, "before_cursor_execute", track)
+            raw._conn.timeout = 0
+
+        raw._conn.timeout = max(1, math.ceil(remaining)) if remaining is not None else 0
+        event.listen(conn.sync_connection, "before_cursor_execute", track)
+    elif name == "mysql":
+        thread_id = (await conn.exec_driver_sql("SELECT CONNECTION_ID()")).scalar()
+
+        async def kill() -> None:
+            try:
+                async with conn.engine.connect() as killer:
+                    await killer.exec_driver_sql(f"KILL QUERY {thread_id}")
+            except Exception as e:
+                logger.warning("Could not kill query %s: %s", thread_id, e)
+
+        def stop() -> None:
+            def start() -> None:
+                task = loop.create_task(kill())
+                _kill_tasks.add(task)
+                task.add_done_callback(_kill_tasks.discard)
+
+            loop.call_soon_threadsafe(start)
+
+        if remaining is not None:
+            await conn.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {max(1, int(remaining * 1000))}")
+
+            async def reset() -> None:
+                await conn.exec_driver_sql("SET SESSION MAX_EXECUTION_TIME = 0")
+    elif name == "sqlite":
+        # Runs on the aiosqlite thread, so it stops the query as soon as the deadline is cancelled
+        await raw.set_progress_handler(lambda: 1 if deadline.expired() else 0, 1000)
+
+        async def reset() -> None:
+            await raw.set_progress_handler(None, 0)
+
+    cancelled = False
+    try:
+        with deadline.on_cancel(stop):
+            yield
+    except asyncio.CancelledError:
+        cancelled = True
+        stop()
+        # The statement may still be running; do not hand the connection to the next request
+        await conn.invalidate()
+        raise
+    finally:
+        if reset is not None and not cancelled:
+            await reset()
@@ -0,0 +1,160 @@
+"""
+What differs between the databases the chatbot can query.
+
+A Dialect has the sqlglot name used to parse, limit and rewrite generated
+SQL, the metadata queries of the schema catalog, and the rules that tell the
+model how to write SQL for the database. Row limits and sample rows are
+built with sqlglot and SQLAlchemy, which render them for the dialect (TOP on
+SQL Server, LIMIT elsewhere).
+"""
+from typing import Dict, List, Optional
+
+import sqlglot
+from sqlalchemy.engine import Engine
+
+
+class Dialect:
+    # SQLAlchemy dialect name, sqlglot dialect name and the name shown to the model
+    name = ""
+    sqlglot = ""
+    label = "SQL"
+    # Syntax rules of the SQL prompt, and how to quote names
+    syntax_rules: List[str] = ["Use LIMIT instead of TOP"]
+    quoting_rule = "Do not use backticks (`) around names"
+    # Catalog queries; both return rows in the column order of ColumnInfo, after the table name
+    tables_query = "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE'"
+    columns_query = """
+        SELECT
+            TABLE_NAME,
+            COLUMN_NAME,
+            DATA_TYPE,
+            CHARACTER_MAXIMUM_LENGTH,
+            COLUMN_DEFAULT,
+            IS_NULLABLE
+        FROM INFORMATION_SCHEMA.COLUMNS
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """
+    # Cheap change detection: any create/alter/drop of a table changes its result; None reloads on the TTL only
+    watermark_query: Optional[str] = None
+
+    def transpile(self, sql: str, read: str) -> str:
+        """SQL written for another sqlglot dialect, in this one."""
+        if read == self.sqlglot:
+            return sql
+        return sqlglot.transpile(sql, read=read, write=self.sqlglot)[0]
+
+
+class MSSQLDialect(Dialect):
+    name = "mssql"
+    sqlglot = "tsql"
+    label = "Microsoft SQL Server"
+    syntax_rules = [
+        "Use TOP instead of LIMIT",
+        "Use GETDATE() instead of NOW()",
+        "Use DATEADD/DATEDIFF for date math",
+    ]
+    watermark_query = "SELECT COUNT(*), MAX(modify_date) FROM sys.objects WHERE type = 'U'"
+
+
+class MySQLDialect(Dialect):
+    name = "mysql"
+    sqlglot = "mysql"
+    label = "MySQL"
+    syntax_rules = [
+        "Use LIMIT instead of TOP",
+        "Use NOW() and CURDATE() for the current date and time",
+        "Use DATE_ADD/DATE_SUB/DATEDIFF for date math",
+    ]
+    quoting_rule = "Quote names with backticks only when they need it"
+    # INFORMATION_SCHEMA lists the tables of every database on the server
+    tables_query = (
+        "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES "
+        "WHERE TABLE_TYPE = 'BASE TABLE' AND TABLE_SCHEMA = DATABASE()"
+    )
+    columns_query = """
+        SELECT
+            TABLE_NAME,
+            COLUMN_NAME,
+            DATA_TYPE,
+            CHARACTER_MAXIMUM_LENGTH,
+            COLUMN_DEFAULT,
+            IS_NULLABLE
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """
+    watermark_query = (
+        "SELECT COUNT(*), MAX(CREATE_TIME) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE()"
+    )
+
+
+class SQLiteDialect(Dialect):
+    name = "sqlite"
+    sqlglot = "sqlite"
+    label = "SQLite"
+    syntax_rules = [
+        "Use LIMIT instead of TOP",
+        "Use date('now') and datetime('now') for the current date and time",
+        "Use date(column, '-7 days') and julianday() for date math",
+    ]
+    quoting_rule = "Quote names with double quotes only when they need it, never with backticks"
+    tables_query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    # Declared types like VARCHAR(20) are split into the type and the length of character columns
+    columns_query = """
+        SELECT
+            m.name,
+            p.name,
+            lower(CASE WHEN instr(p.type, '(') THEN trim(substr(p.type, 1, instr(p.type, '(') - 1)) ELSE p.type END),
+            CASE WHEN instr(p.type, '(') AND lower(p.type) LIKE '%char%'
+                THEN CAST(substr(p.type, instr(p.type, '(') + 1) AS INTEGER) END,
+            p.dflt_value,
+            CASE WHEN p."notnull" THEN 'NO' ELSE 'YES' END
+        FROM sqlite_master m JOIN pragma_table_info(m.name) p
+        WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+        ORDER BY m.name, p.cid
+    """
+    watermark_query = "SELECT schema_version FROM pragma_schema_version"
+
+
+class DuckDBDialect(Dialect):
+    name = "duckdb"
+    sqlglot = "duckdb"
+    label = "DuckDB"
+    syntax_rules = [
+        "Use LIMIT instead of TOP",
+        "Use current_date and now() for the current date and time",
+        "Use INTERVAL, date_trunc and date_diff for date math",
+    ]
+    quoting_rule = "Quote names with double quotes only when they need it, never with backticks"
+    tables_query = (
+        "SELECT table_name FROM information_schema.tables "
+        "WHERE table_type = 'BASE TABLE' AND table_schema = current_schema()"
+    )
+    columns_query = """
+        SELECT
+            table_name,
+            column_name,
+            lower(data_type),
+            character_maximum_length,
+            column_default,
+            is_nullable
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        ORDER BY table_name, ordinal_position
+    """
+
+
+# SQLAlchemy dialect name -> dialect
+DIALECTS: Dict[str, Dialect] = {
+    dialect.name: dialect for dialect in (MSSQLDialect(), MySQLDialect(), SQLiteDialect(), DuckDBDialect())
+}
+
+
+def dialect_for(engine: Engine) -> Dialect:
+    """The dialect of an engine; other databases get the generic INFORMATION_SCHEMA and LIMIT rules."""
+    name = engine.dialect.name
+    if name in DIALECTS:
+        return DIALECTS[name]
+    dialect = Dialect()
+    dialect.name = dialect.sqlglot = name
+    return dialect
@@ -0,0 +1,163 @@
+"""
+Streaming encoders for exporting query results.
+
+Rows arrive in fetchmany batches and each batch is encoded and handed on
+before the next one is read, so memory use depends on the batch size and
+not on the size of the result. CSV and newline-delimited JSON need nothing
+extra; Arrow IPC streams and Parquet need pyarrow, which is imported only
+when one of them is requested.
+"""
+import csv
+import io
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+from urllib.parse import quote
+
+CSV = "csv"
+NDJSON = "ndjson"
+ARROW = "arrow"
+PARQUET = "parquet"
+
+# Format -> (content type, file extension)
+FORMATS = {
+    CSV: ("text/csv; charset=utf-8", "csv"),
+    NDJSON: ("application/x-ndjson", "ndjson"),
+    ARROW: ("application/vnd.apache.arrow.stream", "arrows"),
+    PARQUET: ("application/vnd.apache.parquet", "parquet"),
+}
+
+Batches = Iterable[Sequence[Tuple]]
+
+
+def check_format(fmt: str) -> None:
+    """Raise ValueError for a format that is unknown or whose dependency is missing."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    if fmt in (ARROW, PARQUET):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(f"The {fmt} export format requires pyarrow (pip install pyarrow)")
+
+
+def content_type(fmt: str) -> str:
+    return FORMATS[fmt][0]
+
+
+def filename(fmt: str) -> str:
+    return f"result.{FORMATS[fmt][1]}"
+
+
+def encode(fmt: str, columns: List[str], batches: Batches) -> Iterator[bytes]:
+    """Encode row batches in the export format, one chunk per batch."""
+    if fmt == CSV:
+        return encode_csv(columns, batches)
+    if fmt == NDJSON:
+        return encode_ndjson(columns, batches)
+    if fmt in (ARROW, PARQUET):
+        return encode_arrow(columns, batches, parquet=fmt == PARQUET)
+    raise ValueError(f"Unknown export format '{fmt}'")
+
+
+def encode_csv(columns: List[str], batches: Batches) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header of an empty result
+        yield buffer.getvalue().encode("utf-8")
+
+
+def encode_ndjson(columns: List[str], batches: Batches) -> Iterator[bytes]:
+    for batch in batches:
+        lines = [json.dumps(dict(zip(columns, row)), default=str) for row in batch]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that collects what pyarrow writes until it is drained."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self.chunks.append(chunk)
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def arrow_schema(columns: List[str], batch: Sequence[Tuple]) -> Any:
+    """Column types inferred from the first batch; all-null columns become strings."""
+    import pyarrow as pa
+
+    fields = []
+    for i, name in enumerate(columns):
+        kind = pa.array([row[i] for row in batch]).type
+        fields.append(pa.field(name, pa.string() if pa.types.is_null(kind) else kind))
+    return pa.schema(fields)
+
+
+def arrow_batch(schema: Any, batch: Sequence[Tuple]) -> Any:
+    import pyarrow as pa
+
+    arrays = []
+    for i, field in enumerate(schema):
+        values = [row[i] for row in batch]
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def encode_arrow(columns: List[str], batches: Batches, parquet: bool = False) -> Iterator[bytes]:
+    """Arrow IPC stream or Parquet file, one record batch or row group per fetched batch."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = ChunkSink()
+    writer = None
+    schema = None
+    try:
+        for batch in batches:
+            if not batch:
+                continue
+            if writer is None:
+                schema = arrow_schema(columns, batch)
+                writer = pq.ParquetWriter(sink, schema) if parquet else pa.ipc.new_stream(sink, schema)
+            writer.write_batch(arrow_batch(schema, batch))
+            yield sink.drain()
+        if writer is None:
+            # Empty result: a valid file with string columns and no rows
+            schema = pa.schema([pa.field(name, pa.string()) for name in columns])
+            writer = pq.ParquetWriter(sink, schema) if parquet else pa.ipc.new_stream(sink, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def export_headers(fmt: str, answer: Dict[str, str]) -> Dict[str, str]:
+    """Download headers, with the SQL and the answer percent-encoded so they fit in a header."""
+    return {
+        "Content-Disposition": f'attachment; filename="{filename(fmt)}"',
+        "X-Query-SQL": quote(answer["sql"]),
+        "X-Query-Answer": quote(answer["response"]),
+    }
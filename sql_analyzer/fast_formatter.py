@@ -0,0 +1,154 @@
+"""
+Rule-based answers for simple query results, so they do not need a second LLM call.
+"""
+import datetime
+import decimal
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+AGGREGATE_PATTERN = re.compile(r"^\s*SELECT\s+(?:DISTINCT\s+)?(?:TOP\s*\(?\s*\d+\s*\)?\s+)?(COUNT|SUM|AVG|MIN|MAX)\s*\(", re.I)
+HOW_MANY_PATTERN = re.compile(r"^\s*how\s+many\s+(.+?)[\s?.!]*$", re.I)
+AUXILIARY_VERBS = {"are", "were", "is", "was", "have", "has", "had", "did", "do", "does", "will", "can"}
+STATEMENT_VERBS = {"are", "were", "is", "was", "have", "has", "had"}
+# "how many X are there" -> "There are N X"; singular verb for a count of 1, by tense
+THERE_VERBS = {"are": ("are", "is"), "is": ("are", "is"), "were": ("were", "was"), "was": ("were", "was")}
+# A verb followed by one of these is a question ("have we shipped"), not a statement
+SUBJECT_WORDS = {"i", "we", "you", "they", "he", "she", "it", "there", "the", "a", "an", "this", "that", "these", "those"}
+PREPOSITIONS = {"in", "of", "for", "from", "with", "on", "at", "by", "per", "during", "since", "before", "after", "between"}
+# Longest noun phrase before a preposition read as "how many <noun>" without a verb
+MAX_NOUN_WORDS = 3
+AGGREGATE_WORDS = {"SUM": "total", "AVG": "average", "MIN": "minimum", "MAX": "maximum"}
+
+
+def format_value(value: Any) -> str:
+    """Render a single database value for a sentence or table cell."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, (float, decimal.Decimal)):
+        return f"{value:,.2f}".rstrip("0").rstrip(".")
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def column_names(result: Sequence[Tuple]) -> Optional[List[str]]:
+    """Column names of a query result, when the result or its rows carry them."""
+    fields = getattr(result, "columns", None) or (getattr(result[0], "_fields", None) if result else None)
+    return list(fields) if fields else None
+
+
+def humanize(name: str) -> str:
+    return re.sub(r"(?<=[a-z])(?=[A-Z])", " ", name).replace("_", " ").strip().lower()
+
+
+class FastFormatter:
+    """Formats scalar, single-row and small tabular results from templates.
+
+    ``format`` returns None for anything it cannot phrase reliably, in which
+    case the caller falls back to the LLM. Hit and fallback counters are kept
+    to track how often the fast path is taken.
+    """
+
+    def __init__(self, max_rows: int = 10, max_columns: int = 6):
+        self.max_rows = max_rows
+        self.max_columns = max_columns
+        self.hits = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def format(self, question: str, result: Sequence[Tuple], sql: str) -> Optional[str]:
+        response = self._format(question, result, sql)
+        with self._lock:
+            if response is None:
+                self.fallbacks += 1
+            else:
+                self.hits += 1
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.fallbacks
+            return {
+                "fast_path": self.hits,
+                "llm_fallback": self.fallbacks,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _format(self, question: str, result: Sequence[Tuple], sql: str) -> Optional[str]:
+        if not result:
+            return "No matching records were found."
+        names = column_names(result)
+        if len(result) == 1 and len(result[0]) == 1:
+            return self._format_scalar(question, result[0][0], sql, names)
+        if len(result) > self.max_rows or len(result[0]) > self.max_columns or names is None:
+            return None
+        if len(result) == 1:
+            pairs = ", ".join(f"{humanize(name)}: {format_value(value)}" for name, value in zip(names, result[0]))
+            return f"Here is the matching record: {pairs}."
+        return self._format_table(names, result)
+
+    def _format_scalar(self, question: str, value: Any, sql: str, names: Optional[List[str]]) -> Optional[str]:
+        aggregate = AGGREGATE_PATTERN.match(sql)
+        function = aggregate.group(1).upper() if aggregate else None
+        rendered = format_value(value)
+
+        if function == "COUNT":
+            return self._format_count(question, value, rendered) or f"The count is {rendered}."
+        if function in AGGREGATE_WORDS:
+            label = humanize(names[0]) if names and names[0] and not names[0].lower().startswith(function.lower()) else None
+            if label and AGGREGATE_WORDS[function] in label.split():
+                return f"The {label} is {rendered}."
+            if label:
+                return f"The {AGGREGATE_WORDS[function]} {label} is {rendered}."
+            return f"The {AGGREGATE_WORDS[function]} is {rendered}."
+        if names and names[0]:
+            return f"The {humanize(names[0])} is {rendered}."
+        return None
+
+    def _format_count(self, question: str, value: Any, rendered: str) -> Optional[str]:
+        """A sentence for "how many" questions of a shape that can be rephrased, else None."""
+        how_many = HOW_MANY_PATTERN.match(question)
+        if not how_many:
+            return None
+        words = how_many.group(1).split()
+        lowered = [word.lower() for word in words]
+        verb = next((i for i, word in enumerate(lowered) if word in AUXILIARY_VERBS), None)
+        if verb is None:
+            # "how many customers in France" -> "There are 42 customers in France."
+            noun = next((i for i, word in enumerate(lowered) if word in PREPOSITIONS), len(words))
+            if value != 1 and 0 < noun <= MAX_NOUN_WORDS:
+                return f"There are {rendered} {' '.join(words)}."
+            return None
+        if verb == 0:
+            return None
+        following = lowered[verb + 1] if verb + 1 < len(words) else None
+        if following == "there" and lowered[verb] in THERE_VERBS:
+            # "how many transfers are there" -> "There are 2,000 transfers."
+            plural, singular = THERE_VERBS[lowered[verb]]
+            if value == 1 and lowered[verb] == plural:
+                # "There is 1 transfers" reads wrong, and the noun cannot be singularized reliably
+                return None
+            noun = " ".join(words[:verb] + words[verb + 2:])
+            return f"There {singular if value == 1 else plural} {rendered} {noun}."
+        if value != 1 and lowered[verb] in STATEMENT_VERBS and following and following not in SUBJECT_WORDS:
+            # "how many transfers were received" -> "42 transfers were received."
+            return f"{rendered} {' '.join(words)}."
+        return None
+
+    def _format_table(self, names: List[str], result: Sequence[Tuple]) -> str:
+        lines = [
+            f"Found {len(result)} records:",
+            "",
+            "| " + " | ".join(names) + " |",
+            "|" + "---|" * len(names),
+        ]
+        for row in result:
+            lines.append("| " + " | ".join(format_value(value).replace("|", "\\|") for value in row) + " |")
+        return "\n".join(lines)
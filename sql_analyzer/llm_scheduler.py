@@ -0,0 +1,185 @@
+"""
+Admission control for calls to the LLM backend.
+
+A local Ollama decodes only a few requests at a time (OLLAMA_NUM_PARALLEL);
+sending it more just makes every request slower. The scheduler lets at most
+``concurrency`` LLM calls run and queues the rest, by priority or in arrival
+order. Formatting calls go first by default: their question already has its
+SQL and result, so finishing it frees everything the question holds. When
+the queue is full new questions are shed with LLMOverloaded, which the HTTP
+layers turn into 429 with a Retry-After estimated from recent call times.
+
+Slots are shared between threads and event loops: a queued call waits on a
+threading.Event or, for coroutines, on a future of its own loop.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sql_analyzer.deadline import Deadline
+from sql_analyzer.metrics import LLM_QUEUE_SECONDS, LLM_SHED
+
+# Lower runs first
+STAGE_PRIORITIES = {"formatting": 0, "sql_repair": 1, "sql_generation": 2}
+# Only calls that start a question are shed; later calls of admitted questions
+# always queue, so work already done is not thrown away
+SHED_STAGES = {"sql_generation"}
+
+
+class LLMOverloaded(Exception):
+    """The LLM queue is full; retry after retry_after seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("The language model is busy, please retry")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A queued call, woken through notify once release() hands it a slot."""
+
+    def __init__(self, notify: Callable[[], None]):
+        self.notify = notify
+        self.granted = False
+        self.abandoned = False
+
+
+class LLMScheduler:
+    def __init__(self, concurrency: int, max_queue: int = 0, policy: str = "priority"):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[int, int, Ticket]] = []
+        self._order = itertools.count()
+        self._active = 0
+        self._queued = 0
+        self._shed = 0
+        # Moving average of how long a call holds its slot, for Retry-After
+        self._call_seconds = 5.0
+
+    def priority(self, stage: str) -> int:
+        return STAGE_PRIORITIES.get(stage, len(STAGE_PRIORITIES)) if self.policy == "priority" else 0
+
+    def admit(self) -> None:
+        """Raise LLMOverloaded if a new request would find the queue full.
+
+        Lets the HTTP layer shed load before it starts a response.
+        """
+        with self._lock:
+            if self.max_queue and self._queued >= self.max_queue:
+                self._shed += 1
+                LLM_SHED.inc(stage="admission")
+                raise LLMOverloaded(self._retry_after())
+
+    def _retry_after(self) -> int:
+        # Time for the queue ahead to drain through the slots
+        return max(1, math.ceil((self._queued + 1) * self._call_seconds / self.concurrency))
+
+    def _enqueue(self, stage: str, notify: Callable[[], None]) -> Optional[Ticket]:
+        """None if a slot was free, otherwise the queued ticket."""
+        with self._lock:
+            if self._active < self.concurrency and not self._queued:
+                self._active += 1
+                return None
+            if stage in SHED_STAGES and self.max_queue and self._queued >= self.max_queue:
+                self._shed += 1
+                LLM_SHED.inc(stage=stage)
+                raise LLMOverloaded(self._retry_after())
+            ticket = Ticket(notify)
+            heapq.heappush(self._queue, (self.priority(stage), next(self._order), ticket))
+            self._queued += 1
+            return ticket
+
+    def _abandon(self, ticket: Ticket) -> None:
+        """Give up a queued ticket; a slot granted in the meantime is passed on."""
+        with self._lock:
+            if not ticket.granted:
+                ticket.abandoned = True
+                self._queued -= 1
+                return
+        self.release()
+
+    def release(self, seconds: Optional[float] = None) -> None:
+        """Free a slot, handing it to the next queued call if there is one."""
+        with self._lock:
+            if seconds is not None:
+                self._call_seconds = 0.8 * self._call_seconds + 0.2 * seconds
+            while self._queue:
+                _, _, ticket = heapq.heappop(self._queue)
+                if ticket.abandoned:
+                    continue
+                ticket.granted = True
+                self._queued -= 1
+                break
+            else:
+                self._active -= 1
+                return
+        ticket.notify()
+
+    @contextmanager
+    def slot(self, stage: str, deadline: Optional[Deadline] = None) -> Iterator[None]:
+        """Hold an LLM slot for the block, waiting in the queue for one if needed."""
+        start = time.perf_counter()
+        event = threading.Event()
+        ticket = self._enqueue(stage, event.set)
+        if ticket is not None:
+            try:
+                # Wake up regularly so a cancelled deadline stops the wait
+                while not event.wait(0.5):
+                    if deadline is not None:
+                        deadline.check()
+            except BaseException:
+                self._abandon(ticket)
+                raise
+        LLM_QUEUE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        held = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - held)
+
+    @asynccontextmanager
+    async def aslot(self, stage: str, deadline: Optional[Deadline] = None) -> AsyncIterator[None]:
+        """Hold an LLM slot for the block without blocking the event loop."""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify() -> None:
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        ticket = self._enqueue(stage, notify)
+        if ticket is not None:
+            try:
+                while True:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(granted), 0.5)
+                        break
+                    except TimeoutError:
+                        if deadline is not None:
+                            deadline.check()
+            except BaseException:
+                self._abandon(ticket)
+                raise
+        LLM_QUEUE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        held = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - held)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "active": self._active,
+                "queued": self._queued,
+                "max_queue": self.max_queue,
+                "shed": self._shed,
+                "avg_call_seconds": round(self._call_seconds, 3),
+            }
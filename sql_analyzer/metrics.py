@@ -0,0 +1,132 @@
+"""
+Minimal Prometheus-style metrics for the question pipeline.
+
+Histograms and counters live in a process-wide registry and are rendered in
+the Prometheus text exposition format by the /metrics endpoints. Figures that
+already live elsewhere (cache, formatter and pool stats) are rendered as
+gauges at scrape time.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+EXPORT_BUCKETS = (0, 100, 1000, 10000, 100000, 1000000, 10000000)
+ATTEMPT_BUCKETS = (0, 1, 2, 3, 5)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Per series: one count per bucket, then +Inf count, then sum
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in self._series.items():
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(labels, ('le', str(bound)))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(labels, ('le', '+Inf'))} {series[len(self.buckets)]}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {series[-1]}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {series[len(self.buckets)]}")
+        return lines
+
+
+def gauge(name: str, documentation: str, samples: Sequence[Tuple[Dict[str, str], Any]], kind: str = "gauge") -> List[str]:
+    """Render values computed at scrape time."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {float(value)}")
+    return lines
+
+
+STAGE_SECONDS = Histogram("sql_chatbot_stage_seconds", "Time spent in each pipeline stage.")
+QUESTION_SECONDS = Histogram("sql_chatbot_question_seconds", "End-to-end time to answer a question.")
+QUESTIONS_TOTAL = Counter("sql_chatbot_questions_total", "Questions processed, by outcome.")
+LLM_TOKENS = Histogram("sql_chatbot_llm_tokens", "LLM prompt and completion tokens per call.", TOKEN_BUCKETS)
+ROWS_RETURNED = Histogram("sql_chatbot_rows_returned", "Rows returned by executed queries.", ROW_BUCKETS)
+SCHEMA_TOKENS = Histogram("sql_chatbot_schema_tokens", "Estimated tokens of the schema text in SQL prompts.", TOKEN_BUCKETS)
+SQL_REJECTED = Counter("sql_chatbot_sql_rejected_total", "Generated SQL rejected before execution, by reason.")
+LLM_QUEUE_SECONDS = Histogram("sql_chatbot_llm_queue_seconds", "Time LLM calls waited for a slot, by stage.")
+EXPORT_ROWS = Histogram("sql_chatbot_export_rows", "Rows streamed by result exports.", EXPORT_BUCKETS)
+LLM_SHED = Counter("sql_chatbot_llm_shed_total", "Requests and LLM calls rejected because the LLM queue was full.")
+QUERY_ERRORS = Counter("sql_chatbot_query_errors_total", "Queries that failed on the database, by error class.")
+SQL_REPAIRS = Counter("sql_chatbot_sql_repairs_total", "Repair attempts of failed queries, by method and outcome.")
+ANALYTICS_QUERIES = Counter(
+    "sql_chatbot_analytics_queries_total", "Queries routed to the analytics copy, by outcome (ok or fallback)."
+)
+REPAIR_ATTEMPTS = Histogram(
+    "sql_chatbot_repair_attempts", "Repair attempts per question whose query failed.", ATTEMPT_BUCKETS
+)
+
+REGISTRY = [
+    STAGE_SECONDS, QUESTION_SECONDS, QUESTIONS_TOTAL, LLM_TOKENS, ROWS_RETURNED, SCHEMA_TOKENS, SQL_REJECTED,
+    LLM_QUEUE_SECONDS, LLM_SHED, EXPORT_ROWS, QUERY_ERRORS, SQL_REPAIRS, REPAIR_ATTEMPTS,
+    ANALYTICS_QUERIES,
+]
+
+
+def render(extra: Sequence[List[str]] = ()) -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for block in extra:
+        lines.extend(block)
+    return "\n".join(lines) + "\n"
+
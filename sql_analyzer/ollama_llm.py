@@ -0,0 +1,77 @@
+"""
+Ollama client with model residency and context size settings, and the
+callback that records its token counts.
+"""
+from typing import Any, Dict, Optional, Union
+
+from langchain_community.llms import Ollama
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.outputs import LLMResult
+
+from sql_analyzer.config import cfg
+from sql_analyzer.log_init import logger
+from sql_analyzer.metrics import LLM_TOKENS
+
+
+class ResidentOllama(Ollama):
+    """Ollama that sends keep_alive with every request.
+
+    The LangChain client has no keep_alive field and would put unknown
+    arguments under "options", where Ollama ignores it. keep_alive is a
+    duration ("30m") or seconds; a negative value keeps the model loaded
+    until Ollama restarts.
+    """
+
+    keep_alive: Optional[Union[int, str]] = None
+
+    @property
+    def _default_params(self) -> Dict[str, Any]:
+        params = super()._default_params
+        if self.keep_alive is not None:
+            params["keep_alive"] = self.keep_alive
+        return params
+
+
+def llm_factory() -> Ollama:
+    return ResidentOllama(
+        base_url=cfg.ollama_url,
+        model=cfg.ollama_model,
+        keep_alive=cfg.ollama_keep_alive,
+        num_ctx=cfg.ollama_num_ctx,
+    )
+
+
+def with_timeout(llm: BaseLLM, seconds: Optional[float]) -> BaseLLM:
+    """The LLM with its HTTP timeout lowered to seconds, for clients that have one.
+
+    Ollama's timeout is the requests read timeout, so it also bounds the wait
+    for the first token while the prompt is evaluated.
+    """
+    if seconds is None or "timeout" not in llm.__fields__:
+        return llm
+    if llm.timeout is not None and llm.timeout <= seconds:
+        return llm
+    # copy() would drop the fields excluded from serialization, such as callbacks
+    return type(llm).construct(**{**llm.__dict__, "timeout": max(0.1, seconds)})
+
+
+class LLMUsageCallback(BaseCallbackHandler):
+    """Records Ollama's prompt/completion token counts when a generation ends."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                if "prompt_eval_count" in info or "eval_count" in info:
+                    logger.info(
+                        "LLM %s: %s prompt tokens, %s completion tokens",
+                        self.stage, info.get("prompt_eval_count"), info.get("eval_count"),
+                    )
+                if "prompt_eval_count" in info:
+                    LLM_TOKENS.observe(info["prompt_eval_count"], stage=self.stage, kind="prompt")
+                if "eval_count" in info:
+                    LLM_TOKENS.observe(info["eval_count"], stage=self.stage, kind="completion")
@@ -0,0 +1,104 @@
+"""
+Prompt templates for SQL generation and answer formatting.
+
+Each prompt starts with a static block of instructions that is byte-for-byte
+identical on every call, followed by the parts that vary per question. Ollama
+keeps the KV cache of the last prompt it processed, so a shared prefix is only
+evaluated once and later calls start decoding sooner. Keep anything that
+varies (question, schema, examples, results, dates) out of the static blocks.
+"""
+from typing import List, Optional, Tuple
+
+from sql_analyzer.dialects import DIALECTS, Dialect
+
+MSSQL = DIALECTS["mssql"]
+
+
+def sql_instructions(dialect: Dialect = MSSQL) -> str:
+    """The static block of the SQL prompt; the same text for every question on the database."""
+    syntax = "\n".join(f"   - {rule}" for rule in dialect.syntax_rules)
+    return f"""You are an expert in {dialect.label}.
+Write a SQL query that answers the question at the end, using the database schema given after these rules.
+
+Rules:
+1. Return ONLY the SQL query, no explanations
+2. Use proper {dialect.label} syntax:
+{syntax}
+3. Use proper case for SQL keywords (SELECT, FROM, etc.)
+4. Use EXACT column names as shown in the schema (e.g., use 'CompanyId', not 'company_id')
+5. {dialect.quoting_rule}
+6. The query should be complete and runnable
+7. When a column comment lists the column's values, filter with exactly those values (e.g. Estatus = 'O', not 'Open')
+"""
+
+
+# Used when no similar question has been answered before; written in T-SQL and transpiled for other databases
+DEFAULT_EXAMPLES = [
+    ("How many transfers does company 1 have?", "SELECT COUNT(*) FROM Prj_Data_Transfers_SC WHERE CompanyId = 1"),
+    (
+        "What is the most recently received transfer?",
+        "SELECT TOP 1 * FROM Prj_Data_Transfers_SC\nWHERE Recibido = 'Y'\nORDER BY Fecha_Recibo DESC",
+    ),
+]
+
+RESPONSE_INSTRUCTIONS = """Answer a question about a database from the result of the SQL query that was run for it.
+
+Provide a clear, natural language response that:
+1. Directly answers the question
+2. Is concise and to the point
+3. Includes relevant numbers/counts
+4. Uses proper grammar and complete sentences
+5. Does not include the SQL query or technical details
+
+Example:
+Question: "How many active users are there?"
+Result: [(42,)]
+Response: "There are 42 active users."
+"""
+
+
+def format_examples(examples: List[Tuple[str, str]]) -> str:
+    return "\n\n".join(f"Question: {question}\nSQL query:\n{sql}" for question, sql in examples)
+
+
+def default_examples(dialect: Dialect = MSSQL) -> List[Tuple[str, str]]:
+    return [(question, dialect.transpile(sql, "tsql")) for question, sql in DEFAULT_EXAMPLES]
+
+
+def sql_prompt(
+    question: str, schema: str, examples: Optional[List[Tuple[str, str]]] = None, dialect: Dialect = MSSQL
+) -> str:
+    """The SQL generation prompt, with (question, sql) pairs as few-shot examples."""
+    return f"""{sql_instructions(dialect)}
+Database schema:
+{schema}
+
+Examples:
+{format_examples(examples or default_examples(dialect))}
+
+Question: {question}
+SQL query:
+"""
+
+
+def repair_prompt(question: str, schema: str, sql: str, error: str, dialect: Dialect = MSSQL) -> str:
+    """Same prefix as sql_prompt up to the schema, so the cached prefix is reused."""
+    return f"""{sql_instructions(dialect)}
+Database schema:
+{schema}
+
+Question: {question}
+This SQL query was rejected:
+{sql}
+Problem: {error}
+Corrected SQL query:
+"""
+
+
+def response_prompt(question: str, sql: str, result: str) -> str:
+    return f"""{RESPONSE_INSTRUCTIONS}
+Question: {question}
+SQL query used: {sql}
+Query result: {result}
+Response:
+"""
@@ -0,0 +1,55 @@
+"""
+Bounded query results and compact summaries of them for LLM prompts.
+"""
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+from sql_analyzer.fast_formatter import format_value
+
+
+class QueryResult(list):
+    """Rows of a query, capped at a maximum, with the column names and a truncation flag."""
+
+    def __init__(self, rows: Iterable[Tuple] = (), columns: Optional[List[str]] = None, truncated: bool = False):
+        super().__init__(rows)
+        self.columns = columns or []
+        self.truncated = truncated
+
+
+def truncate_value(value: Any, max_length: int) -> str:
+    text = format_value(value)
+    return text if len(text) <= max_length else text[: max_length - 3] + "..."
+
+
+def column_stats(values: Sequence[Any]) -> str:
+    """One-line description of a column: nulls plus range or distinct count."""
+    present = [v for v in values if v is not None]
+    parts = []
+    nulls = len(values) - len(present)
+    if nulls:
+        parts.append(f"{nulls} null")
+    numbers = [v for v in present if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if numbers and len(numbers) == len(present):
+        parts.append(f"min {format_value(min(numbers))}, max {format_value(max(numbers))}, avg {format_value(sum(numbers) / len(numbers))}")
+    elif present:
+        try:
+            parts.append(f"{len(set(present))} distinct, from {format_value(min(present))} to {format_value(max(present))}")
+        except TypeError:
+            parts.append(f"{len(set(map(str, present)))} distinct")
+    return ", ".join(parts) or "all null"
+
+
+def summarize_result(result: QueryResult, preview_rows: int, max_value_length: int = 80) -> str:
+    """Describe a large result by row count, per-column stats and its first rows.
+
+    The summary size depends only on the column count and ``preview_rows``,
+    never on the number of rows returned.
+    """
+    count = f"at least {len(result)} (truncated)" if result.truncated else str(len(result))
+    lines = [f"{count} rows returned.", "Column statistics:"]
+    columns = result.columns or [f"column_{i + 1}" for i in range(len(result[0]) if result else 0)]
+    for i, name in enumerate(columns):
+        lines.append(f"- {name}: {column_stats([row[i] for row in result])}")
+    lines.append(f"First {min(preview_rows, len(result))} rows ({', '.join(columns)}):")
+    for row in result[:preview_rows]:
+        lines.append("(" + ", ".join(truncate_value(value, max_value_length) for value in row) + ")")
+    return "\n".join(lines)
@@ -0,0 +1,135 @@
+"""
+In-process schema catalog that caches tables, columns and sample rows.
+"""
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, table, text
+from sqlalchemy.engine import Engine
+
+from sql_analyzer.config import cfg
+from sql_analyzer.dialects import Dialect, dialect_for
+from sql_analyzer.log_init import logger
+
+
+class ColumnInfo(NamedTuple):
+    name: str
+    data_type: str
+    max_length: Optional[int]
+    default: Optional[str]
+    nullable: bool
+
+
+class SchemaCatalog:
+    """Loads the schema once and serves it from memory until it expires or is invalidated.
+
+    The metadata queries come from the engine's dialect.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        ttl: Optional[float] = None,
+        change_check: Optional[bool] = None,
+        sample_size: int = 3,
+        dialect: Optional[Dialect] = None,
+    ):
+        self.engine = engine
+        self.dialect = dialect or dialect_for(engine)
+        self.ttl = cfg.schema_cache_ttl if ttl is None else ttl
+        change_check = cfg.schema_change_check if change_check is None else change_check
+        self.change_check = change_check and self.dialect.watermark_query is not None
+        self.sample_size = sample_size
+        self._version = 0
+        self._lock = threading.RLock()
+        self._tables: List[str] = []
+        self._columns: Dict[str, List[ColumnInfo]] = {}
+        self._samples: Dict[str, Tuple[List[str], List[Tuple[Any, ...]]]] = {}
+        self._watermark: Optional[Tuple[Any, ...]] = None
+        self._loaded_at: Optional[float] = None
+
+    @property
+    def version(self) -> int:
+        """Counter that changes whenever the loaded tables or columns change."""
+        self._ensure_fresh()
+        return self._version
+
+    def invalidate(self) -> None:
+        """Drop the cached schema so the next access reloads it."""
+        with self._lock:
+            self._loaded_at = None
+            self._watermark = None
+
+    def refresh(self) -> None:
+        """Reload the schema from the database right away."""
+        with self._lock:
+            self._load()
+
+    def table_names(self) -> List[str]:
+        """Get the list of base tables."""
+        self._ensure_fresh()
+        return list(self._tables)
+
+    def has_table(self, table_name: str) -> bool:
+        self._ensure_fresh()
+        return table_name in self._columns
+
+    def columns(self, table_name: str) -> List[ColumnInfo]:
+        """Get the column definitions of a table in ordinal order."""
+        self._ensure_fresh()
+        if table_name not in self._columns:
+            raise ValueError(
+                f"Table '{table_name}' not found in database. Available tables: {', '.join(sorted(self._tables))}"
+            )
+        return self._columns[table_name]
+
+    def sample_rows(self, table_name: str) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+        """Get column names and a few sample rows, loaded on first use per table."""
+        self.columns(table_name)
+        sample = self._samples.get(table_name)
+        if sample is None:
+            with self.engine.connect() as conn:
+                query = select(text("*")).select_from(table(table_name)).limit(self.sample_size)
+                result = conn.execute(query)
+                sample = (list(result.keys()), [tuple(row) for row in result.fetchall()])
+            with self._lock:
+                self._samples[table_name] = sample
+        return sample
+
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            if self._loaded_at is None:
+                self._load()
+            elif time.monotonic() - self._loaded_at >= self.ttl:
+                if self.change_check and self._read_watermark() == self._watermark:
+                    self._loaded_at = time.monotonic()
+                else:
+                    self._load()
+
+    def _read_watermark(self) -> Optional[Tuple[Any, ...]]:
+        try:
+            with self.engine.connect() as conn:
+                return tuple(conn.execute(text(self.dialect.watermark_query)).fetchone())
+        except Exception as e:
+            logger.warning("Schema change check failed, falling back to TTL reload: %s", e)
+            self.change_check = False
+            return None
+
+    def _load(self) -> None:
+        watermark = self._read_watermark() if self.change_check else None
+        with self.engine.connect() as conn:
+            tables = [row[0] for row in conn.execute(text(self.dialect.tables_query))]
+            columns: Dict[str, List[ColumnInfo]] = {name: [] for name in tables}
+            for row in conn.execute(text(self.dialect.columns_query)):
+                if row[0] in columns:
+                    columns[row[0]].append(ColumnInfo(row[1], row[2], row[3], row[4], row[5] == "YES"))
+
+        if tables != self._tables or columns != self._columns:
+            self._version += 1
+        self._samples = {}
+        self._tables = tables
+        self._columns = columns
+        self._watermark = watermark
+        self._loaded_at = time.monotonic()
+        logger.info("Loaded schema catalog version %s with %s tables", self._version, len(tables))
@@ -0,0 +1,190 @@
+"""
+Schema text for SQL prompts, kept within a token budget.
+
+The compact style renders a table as DDL with per-column notes and profiled
+value lists or ranges as comments, and a few pipe-separated sample rows.
+When the text exceeds the budget, sample rows are dropped first, then the
+columns least related to the question, then the column comments.
+"""
+import json
+import os
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set
+
+from sql_analyzer.column_profile import ColumnProfiler, describe
+from sql_analyzer.log_init import logger
+from sql_analyzer.result_summary import truncate_value
+from sql_analyzer.schema_catalog import ColumnInfo, SchemaCatalog
+from sql_analyzer.table_index import tokenize
+from sql_analyzer.table_matcher import split_name
+
+COMPACT = "compact"
+VERBOSE = "verbose"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for code-heavy prompts, about four characters per token."""
+    return (len(text) + 3) // 4
+
+
+def load_table_metadata(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Per-table aliases and column notes, e.g. {"Orders": {"aliases": [...], "columns": {"Id": "..."}}}."""
+    if not path or not os.path.exists(path):
+        if path:
+            logger.warning("Table metadata file %s not found", path)
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def column_type(column: ColumnInfo) -> str:
+    if column.max_length == -1:
+        return f"{column.data_type}(max)"
+    if column.max_length:
+        return f"{column.data_type}({column.max_length})"
+    return column.data_type
+
+
+class SchemaSerializer:
+    """Renders table schemas from the catalog for the SQL prompt."""
+
+    def __init__(
+        self,
+        catalog: SchemaCatalog,
+        column_notes: Mapping[str, Mapping[str, str]],
+        token_budget: int,
+        sample_rows: int = 3,
+        max_value_length: int = 40,
+        style: str = COMPACT,
+        profiler: Optional[ColumnProfiler] = None,
+    ):
+        self.catalog = catalog
+        self.column_notes = column_notes
+        self.token_budget = token_budget
+        self.sample_rows = sample_rows
+        self.max_value_length = max_value_length
+        self.style = style
+        self.profiler = profiler
+
+    def relevance(self, table: str, column: ColumnInfo, question_words: Set[str]) -> int:
+        """How many question words appear in the column name or its note."""
+        words = set(split_name(column.name))
+        note = self.column_notes.get(table, {}).get(column.name)
+        if note:
+            words.update(tokenize(note))
+        return len(words & question_words)
+
+    def column_comments(self, table: str) -> Dict[str, str]:
+        """Column name -> comment: the note from the table metadata and the profiled values or range."""
+        comments = dict(self.column_notes.get(table, {}))
+        if self.profiler is not None:
+            for name, stats in self.profiler.stats(table).items():
+                description = describe(stats)
+                if description:
+                    comments[name] = f"{comments[name]}; {description}" if name in comments else description
+        return comments
+
+    def serialize(self, tables: Sequence[str], question: str = "") -> str:
+        """Schemas of the tables, sharing the token budget between them."""
+        budget = self.token_budget // max(1, len(tables)) if self.token_budget > 0 else 0
+        return "\n\n".join(self.table_schema(table, question, budget) for table in tables)
+
+    def table_schema(self, table: str, question: str = "", budget: int = 0) -> str:
+        """Schema of one table, within budget tokens when budget is positive."""
+        columns = self.catalog.columns(table)
+        col_names, rows = self.catalog.sample_rows(table)
+        if self.style == VERBOSE:
+            return self.verbose(table, columns, col_names, rows)
+
+        rows = rows[: self.sample_rows]
+        schema = self.compact(table, columns, col_names, rows)
+        if budget <= 0 or estimate_tokens(schema) <= budget:
+            return schema
+
+        # Over budget: fewer sample rows first
+        while rows and estimate_tokens(schema) > budget:
+            rows = rows[:-1]
+            schema = self.compact(table, columns, col_names, rows)
+        if estimate_tokens(schema) <= budget:
+            return schema
+
+        # Then drop the columns least related to the question, keeping table order
+        question_words = set(tokenize(question))
+        ranked = sorted(
+            range(len(columns)), key=lambda i: (-self.relevance(table, columns[i], question_words), i)
+        )
+        kept = list(columns)
+        for position in reversed(ranked[1:]):
+            if estimate_tokens(schema) <= budget:
+                break
+            kept.remove(columns[position])
+            schema = self.compact(table, kept, col_names, rows, omitted=len(columns) - len(kept))
+        if estimate_tokens(schema) > budget:
+            schema = self.compact(table, kept, col_names, rows, omitted=len(columns) - len(kept), notes=False)
+        logger.info(
+            "Schema of %s trimmed to %s of %s columns (~%s tokens)",
+            table, len(kept), len(columns), estimate_tokens(schema),
+        )
+        return schema
+
+    def compact(
+        self,
+        table: str,
+        columns: Sequence[ColumnInfo],
+        col_names: List[str],
+        rows: Sequence[Sequence[Any]],
+        omitted: int = 0,
+        notes: bool = True,
+    ) -> str:
+        """DDL-like form: CREATE TABLE with notes and column stats as comments, then sample rows."""
+        table_notes = self.column_comments(table) if notes else {}
+        lines = [f"CREATE TABLE {table} ("]
+        for i, column in enumerate(columns):
+            line = f"  {column.name} {column_type(column)}"
+            if not column.nullable:
+                line += " NOT NULL"
+            if column.default:
+                line += f" DEFAULT {column.default}"
+            if i < len(columns) - 1:
+                line += ","
+            if column.name in table_notes:
+                line += f" -- {table_notes[column.name]}"
+            lines.append(line)
+        if omitted:
+            lines.append(f"  -- {omitted} more columns not shown")
+        lines.append(")")
+
+        if rows:
+            positions = [col_names.index(column.name) for column in columns if column.name in col_names]
+            lines.append(f"/* {len(rows)} sample rows:")
+            lines.append("|".join(col_names[i] for i in positions))
+            for row in rows:
+                lines.append("|".join(truncate_value(row[i], self.max_value_length) for i in positions))
+            lines.append("*/")
+        return "\n".join(lines)
+
+    def verbose(
+        self, table: str, columns: Sequence[ColumnInfo], col_names: List[str], rows: Sequence[Sequence[Any]]
+    ) -> str:
+        """The original long form: one line per column and sample rows as dicts."""
+        comments = self.column_comments(table)
+        formatted = []
+        for column in columns:
+            col_info = f"{column.name} ({column.data_type}"
+            if column.max_length:  # if has length
+                col_info += f"({column.max_length})"
+            col_info += ")"
+            if column.default:  # if has default
+                col_info += f" DEFAULT {column.default}"
+            col_info += " NULL" if column.nullable else " NOT NULL"
+            note = comments.get(column.name)
+            if note:
+                col_info += f": {note}"
+            formatted.append(col_info)
+
+        schema = f"Table: {table}\n\nColumns (name, type, constraints):\n" + "\n".join(f"- {col}" for col in formatted)
+        if rows:
+            schema += f"\n\nSample data (showing {len(rows)} rows):\n"
+            for row in rows:
+                row_dict = dict(zip(col_names, row))
+                schema += str({k: str(v) if v is not None else 'NULL' for k, v in row_dict.items()}) + "\n"
+        return schema
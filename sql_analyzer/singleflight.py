@@ -0,0 +1,181 @@
+"""
+Coalescing of identical in-flight work.
+
+The first caller for a key becomes the leader and does the work; callers
+that arrive with the same key while it runs wait for the leader's result
+instead of repeating it. If the leader goes away without a result (a client
+disconnect closing its generator or cancelling its task, or its own deadline
+running out), waiters get None and do the work themselves.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from sql_analyzer.deadline import DeadlineExceeded
+
+
+class Call:
+    """One in-flight computation shared by a leader and its waiters."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        if not self._done.wait(timeout):
+            raise TimeoutError("Timed out waiting for an in-flight call")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """Thread-safe coalescing of concurrent calls with the same key."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Call] = {}
+        self._lock = threading.Lock()
+        self._waiters = 0
+        self._coalesced = 0
+
+    def claim(self, key: Hashable) -> Tuple[Call, bool]:
+        """The in-flight call for the key and whether the caller leads it.
+
+        A leader must end the call with finish() or fail(), normally in a
+        finally block.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._coalesced += 1
+                return call, False
+            call = self._calls[key] = Call()
+            return call, True
+
+    def wait(self, call: Call, timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            self._waiters += 1
+        try:
+            return call.wait(timeout)
+        finally:
+            with self._lock:
+                self._waiters -= 1
+
+    def finish(self, key: Hashable, call: Call, value: Any) -> None:
+        with self._lock:
+            if self._calls.get(key) is not call:
+                return
+            del self._calls[key]
+        call.value = value
+        call._done.set()
+
+    def fail(self, key: Hashable, call: Call, error: BaseException) -> None:
+        call.error = error
+        self.finish(key, call, None)
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Run fn once for all concurrent callers with the same key.
+
+        Waiters give up with DeadlineExceeded after timeout seconds.
+        """
+        call, leader = self.claim(key)
+        if not leader:
+            try:
+                value = self.wait(call, timeout)
+            except TimeoutError:
+                raise DeadlineExceeded("Request deadline exceeded")
+            if value is not None:
+                return value
+            return fn()
+        value = None
+        try:
+            value = fn()
+        except TimeoutError:
+            # The leader's time ran out, not necessarily the waiters'
+            raise
+        except Exception as e:
+            self.fail(key, call, e)
+            raise
+        finally:
+            self.finish(key, call, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._calls), "waiters": self._waiters, "coalesced": self._coalesced}
+
+
+class AsyncCall:
+    def __init__(self):
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class AsyncSingleFlight:
+    """Coalescing of concurrent coroutines with the same key on one event loop."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, AsyncCall] = {}
+        self._waiters = 0
+        self._coalesced = 0
+
+    def claim(self, key: Hashable) -> Tuple[AsyncCall, bool]:
+        call = self._calls.get(key)
+        if call is not None:
+            self._coalesced += 1
+            return call, False
+        call = self._calls[key] = AsyncCall()
+        return call, True
+
+    async def wait(self, call: AsyncCall, timeout: Optional[float] = None) -> Any:
+        self._waiters += 1
+        try:
+            # Shielded so a cancelled or timed out waiter does not cancel the shared result
+            return await asyncio.wait_for(asyncio.shield(call.future), timeout)
+        finally:
+            self._waiters -= 1
+
+    def finish(self, key: Hashable, call: AsyncCall, value: Any) -> None:
+        if self._calls.get(key) is not call:
+            return
+        del self._calls[key]
+        if not call.future.done():
+            call.future.set_result(value)
+
+    def fail(self, key: Hashable, call: AsyncCall, error: BaseException) -> None:
+        if self._calls.get(key) is not call:
+            return
+        del self._calls[key]
+        if not call.future.done():
+            call.future.set_exception(error)
+            # Waiters may all have gone; do not warn about an unretrieved exception
+            call.future.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """Await fn once for all concurrent callers with the same key.
+
+        Waiters give up with DeadlineExceeded after timeout seconds.
+        """
+        call, leader = self.claim(key)
+        if not leader:
+            try:
+                value = await self.wait(call, timeout)
+            except TimeoutError:
+                raise DeadlineExceeded("Request deadline exceeded")
+            if value is not None:
+                return value
+            return await fn()
+        value = None
+        try:
+            value = await fn()
+        except TimeoutError:
+            raise
+        except Exception as e:
+            self.fail(key, call, e)
+            raise
+        finally:
+            self.finish(key, call, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "waiters": self._waiters, "coalesced": self._coalesced}
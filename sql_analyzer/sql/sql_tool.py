@@ -96,8 +96,7 @@ class InfoViewSQLDatabaseTool(BaseSQLDatabaseTool, BaseTool):
                 view_info += "\n\n/*"
                 view_info += f"\n{self.db._get_sample_rows(meta_tables[i])}\n"
                 view_info += "*/"
-            # return view_info
-            return self.db.get_table_info_no_throw()
+            return view_info
         except Exception as e:
             """Format the error message"""
             return f"Error: {e}"
@@ -1,212 +1,951 @@
 """
 SQL Chatbot implementation with linear flow.
 """
-from typing import Any, Dict, List, Optional, Tuple
-import re
-from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_community.llms import Ollama
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, Hashable, Iterator, List, Optional, Tuple
+import threading
+import time
+from contextlib import closing, contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
 from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from sql_analyzer import export, prompts
+from sql_analyzer.analytics import AnalyticsRouter
+from sql_analyzer.answer_cache import TTLCache, normalize_question
+from sql_analyzer.column_profile import ColumnProfiler
+from sql_analyzer.config import cfg
+from sql_analyzer.deadline import Deadline, DeadlineExceeded, statement_deadline
+from sql_analyzer.db_pool import pool_stats
+from sql_analyzer.dialects import dialect_for
+from sql_analyzer.fast_formatter import FastFormatter
+from sql_analyzer.llm_scheduler import LLMScheduler
+from sql_analyzer.log_init import logger
+from sql_analyzer.metrics import (
+    ANALYTICS_QUERIES,
+    EXPORT_ROWS,
+    QUERY_ERRORS,
+    QUESTION_SECONDS,
+    QUESTIONS_TOTAL,
+    REPAIR_ATTEMPTS,
+    ROWS_RETURNED,
+    SCHEMA_TOKENS,
+    SQL_REJECTED,
+    SQL_REPAIRS,
+    STAGE_SECONDS,
+    gauge,
+    render,
+)
+from sql_analyzer.ollama_llm import LLMUsageCallback, with_timeout
+from sql_analyzer.result_summary import QueryResult, summarize_result
+from sql_analyzer.schema_catalog import SchemaCatalog
+from sql_analyzer.schema_prompt import SchemaSerializer, estimate_tokens, load_table_metadata
+from sql_analyzer.singleflight import SingleFlight
+from sql_analyzer.sql_guard import SQLGuard, SQLValidationError
+from sql_analyzer.sql_repair import QueryError, SQLRepairer, classify, repairable, rewrite
+from sql_analyzer.sql_store import SQLStore
+from sql_analyzer.table_matcher import TableMatch, TableMatcher
+
+if TYPE_CHECKING:
+    from langchain_community.llms import Ollama
+
+    from sql_analyzer.table_index import TableIndex
+
+
+def advance(
+    steps: Generator[Any, Any, Any], reply: Any = None, error: Optional[BaseException] = None
+) -> Tuple[bool, Any]:
+    """Run a generator of pipeline steps to its next step.
+
+    Sends reply, or throws error, into it and returns (False, step), or
+    (True, its return value) once it finished.
+    """
+    try:
+        return False, steps.throw(error) if error is not None else steps.send(reply)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def fetch_batches(
+    result: Any, batch_size: int, limit: Optional[int] = None, deadline: Optional[Deadline] = None
+) -> Iterator[List[Tuple]]:
+    """Yield the rows of a streamed result in fetchmany batches, at most limit rows.
+
+    The deadline is checked before each batch.
+    """
+    fetched = 0
+    while limit is None or fetched < limit:
+        if deadline is not None:
+            deadline.check()
+        batch = result.fetchmany(batch_size if limit is None else min(batch_size, limit - fetched))
+        if not batch:
+            break
+        fetched += len(batch)
+        yield batch
+
 
 class SQLChatbot:
-    def __init__(self, db: SQLDatabase, llm: Ollama):
-        """Initialize the chatbot with a database connection and LLM."""
-        self.db = db
+    def __init__(
+        self,
+        engine: Engine,
+        llm: "Ollama",
+        catalog: Optional[SchemaCatalog] = None,
+        analytics_engine: Optional[Engine] = None,
+    ):
+        """Initialize the chatbot with a database engine and LLM; nothing connects until first use.
+
+        With an analytics engine, analytical queries run on that local copy instead.
+        """
         self.llm = llm
-        self.engine = db._engine
-        # Table aliases for more natural language matching
-        self.table_aliases = {
-            'Prj_Data_Transfers_SC': ['transfer', 'transfers', 'data transfer', 'data transfers', 'recibados'],
-            'greg': ['greg', 'greg table']
-        }
-        # Build reverse lookup for quick alias resolution
-        self.alias_to_table = {}
-        for table, aliases in self.table_aliases.items():
-            for alias in aliases:
-                self.alias_to_table[alias.lower()] = table
+        self.engine = engine
+        # Prompt rules and metadata queries of the database
+        self.dialect = dialect_for(engine)
+        # Tables, columns and sample rows are cached here instead of queried per question
+        self.catalog = catalog or SchemaCatalog(self.engine, sample_size=cfg.schema_sample_rows)
+        # Repeated questions reuse their SQL, and very recent ones their whole answer
+        self.sql_cache = TTLCache(cfg.sql_cache_size, cfg.sql_cache_ttl)
+        self.answer_cache = TTLCache(cfg.answer_cache_size, cfg.answer_cache_ttl)
+        self.fast_formatter = FastFormatter(max_rows=cfg.fast_format_max_rows)
+        # Checks generated SQL before it runs
+        self.sql_guard = SQLGuard(self.engine, self.catalog, cfg.max_result_rows, cfg.sql_max_cost)
+        # Fixes of SQL that failed on the database, without the LLM where possible
+        self.sql_repairer = SQLRepairer(self.sql_guard.dialect, cfg.query_repair_cache_size, cfg.sql_cache_ttl)
+        self.analytics = (
+            AnalyticsRouter(analytics_engine, self.sql_guard.dialect, cfg.analytics_routing)
+            if analytics_engine is not None
+            else None
+        )
+        # Concurrent identical questions and queries share one in-flight computation
+        self.sql_flight = SingleFlight()
+        self.query_flight = SingleFlight()
+        self.answer_flight = SingleFlight()
+        # Validated SQL of past questions, kept across restarts for reuse and as few-shot examples
+        self.sql_store = (
+            SQLStore(cfg.sql_store_path, cfg.sql_store_size, self.sql_guard.dialect) if cfg.sql_store_path else None
+        )
+        # Bounds the LLM calls running at once; the rest queue or are shed
+        self.llm_scheduler = LLMScheduler(cfg.llm_concurrency, cfg.llm_queue_size, cfg.llm_queue_policy)
+        # Table aliases for more natural language matching, and notes explaining columns
+        metadata = load_table_metadata(cfg.table_metadata_path)
+        self.table_aliases = {table: meta["aliases"] for table, meta in metadata.items() if meta.get("aliases")}
+        self.column_notes = {table: meta["columns"] for table, meta in metadata.items() if meta.get("columns")}
+        # Value lists, ranges and NULL ratios of the columns, profiled in the background once started
+        self.column_profiler = (
+            ColumnProfiler(
+                self.engine,
+                self.catalog,
+                cfg.column_stats_path,
+                sample_rows=cfg.column_profile_sample_rows,
+                top_k=cfg.column_profile_top_k,
+                max_distinct=cfg.column_profile_max_distinct,
+                interval=cfg.column_profile_interval,
+                timeout=cfg.column_profile_timeout,
+            )
+            if cfg.column_profile
+            else None
+        )
+        self.schema_serializer = SchemaSerializer(
+            self.catalog,
+            self.column_notes,
+            cfg.schema_token_budget,
+            sample_rows=cfg.schema_sample_rows,
+            max_value_length=cfg.schema_sample_value_length,
+            style=cfg.schema_style,
+            profiler=self.column_profiler,
+        )
+        # Word-trie index over table names and aliases, rebuilt when the schema changes
+        self._matcher: Optional[TableMatcher] = None
+        self._matcher_version: Optional[int] = None
+        # Vector index of table descriptions, for questions that name no table
+        # and for picking related tables on large schemas
+        self._table_index: Optional["TableIndex"] = None
+        self._table_index_version: Optional[int] = None
+        self._table_index_lock = threading.Lock()
 
     def get_table_names(self) -> List[str]:
-        """Get list of tables from database."""
-        with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE'"))
-            return [row[0] for row in result]
+        """Get list of tables from the schema catalog."""
+        return self.catalog.table_names()
+
+    def table_matcher(self) -> TableMatcher:
+        """Matcher over the current tables and aliases, rebuilt when the schema catalog changes."""
+        version = self.catalog.version
+        if self._matcher is None or self._matcher_version != version:
+            self._matcher = TableMatcher(self.get_table_names(), self.table_aliases)
+            self._matcher_version = version
+        return self._matcher
+
+    def rank_tables(self, question: str) -> List[TableMatch]:
+        """Candidate tables for the question, best match first."""
+        return self.table_matcher().rank(question)
+
+    def table_index(self) -> Optional["TableIndex"]:
+        """Vector index over the current tables, loaded or rebuilt when the schema catalog changes."""
+        if cfg.table_index_backend == "off":
+            return None
+        # numpy is only needed once there is an index to build
+        from sql_analyzer.table_index import load_or_build
+
+        version = self.catalog.version
+        with self._table_index_lock:
+            if self._table_index is None or self._table_index_version != version:
+                self._table_index = load_or_build(
+                    self.catalog, self.table_aliases, cfg.table_index_backend, cfg.table_index_path, self.column_notes
+                )
+                self._table_index_version = version
+            return self._table_index
+
+    def select_tables(self, question: str) -> List[str]:
+        """Tables whose schemas go into the SQL prompt, most relevant first.
+
+        Tables named in the question (by name, name variant or alias), up to
+        cfg.max_prompt_tables. Only when the question names none does the
+        vector index pick them, keeping tables that score at least half as
+        well as its best match, so unrelated schemas stay out of the prompt.
+        """
+        limit = max(1, cfg.max_prompt_tables)
+        candidates = self.rank_tables(question)
+        if len(candidates) > 1:
+            logger.info("Table candidates: %s", ", ".join(f"{c.table} ({c.score:.1f})" for c in candidates))
+        tables = [c.table for c in candidates[:limit]]
+
+        index = self.table_index() if not tables else None
+        if index is not None:
+            similar = index.query(question, limit, cfg.table_index_min_score)
+            if similar:
+                logger.info("Similar tables: %s", ", ".join(f"{table} ({score:.2f})" for table, score in similar))
+                tables = [table for table, score in similar if score >= similar[0][1] / 2]
+        if tables:
+            return tables
 
-    def extract_table_name(self, question: str) -> str:
-        """Extract table name from the question using aliases and fuzzy matching."""
-        tables = self.get_table_names()
-        question_lower = question.lower()
-        
-        # First try exact table name matches
-        for table in tables:
-            if table.lower() in question_lower:
-                return table
-        
-        # Then try aliases
-        words = re.findall(r'\b\w+\b', question_lower)
-        for i in range(len(words)):
-            # Try two-word combinations first
-            if i < len(words) - 1:
-                two_words = words[i] + ' ' + words[i + 1]
-                if two_words in self.alias_to_table:
-                    return self.alias_to_table[two_words]
-            
-            # Try single words
-            if words[i] in self.alias_to_table:
-                return self.alias_to_table[words[i]]
-        
         # If no match found, show available tables and aliases
         alias_help = []
-        for table in tables:
+        for table in self.get_table_names():
             if table in self.table_aliases:
                 alias_help.append(f"{table} (also known as: {', '.join(self.table_aliases[table])})")
             else:
                 alias_help.append(table)
-                
+
         raise ValueError(f"Could not find a table matching your question. Available tables:\n" + "\n".join(alias_help))
 
-    def get_schema(self, table_name: str) -> str:
-        """Get schema information for the table."""
-        tables = self.get_table_names()
-        if table_name not in tables:
-            raise ValueError(f"Table '{table_name}' not found in database. Available tables: {', '.join(sorted(tables))}")
-        
-        # Get schema information directly
-        with self.engine.connect() as conn:
-            # Get detailed column information
-            result = conn.execute(text(f"""
-                SELECT 
-                    COLUMN_NAME,
-                    DATA_TYPE,
-                    CHARACTER_MAXIMUM_LENGTH,
-                    COLUMN_DEFAULT,
-                    IS_NULLABLE
-                FROM INFORMATION_SCHEMA.COLUMNS 
-                WHERE TABLE_NAME = '{table_name}'
-                ORDER BY ORDINAL_POSITION
-            """))
-            
-            # Format column info more clearly
-            columns = []
-            for row in result:
-                col_info = f"{row[0]} ({row[1]}"
-                if row[2]:  # if has length
-                    col_info += f"({row[2]})"
-                col_info += ")"
-                if row[3]:  # if has default
-                    col_info += f" DEFAULT {row[3]}"
-                if row[4] == 'YES':  # if nullable
-                    col_info += " NULL"
-                else:
-                    col_info += " NOT NULL"
-                columns.append(col_info)
-            
-            # Get sample data with column names
-            result = conn.execute(text(f"SELECT TOP 3 * FROM {table_name}"))
-            rows = result.fetchall()
-            col_names = [col[0] for col in result.keys()]
-            
-            schema = f"""Table: {table_name}
-
-Columns (name, type, constraints):
-""" + "\n".join(f"- {col}" for col in columns)
-
-            if rows:
-                schema += "\n\nSample data (showing 3 rows):\n"
-                for row in rows:
-                    row_dict = dict(zip(col_names, row))
-                    formatted_row = {k: str(v) if v is not None else 'NULL' for k, v in row_dict.items()}
-                    schema += str(formatted_row) + "\n"
-            
-            return schema
-
-    def generate_sql(self, question: str, schema: str) -> str:
+    def extract_table_name(self, question: str) -> str:
+        """Extract table name from the question using table names, name variants, aliases and the vector index."""
+        return self.select_tables(question)[0]
+
+    def get_schema(self, table_name: str, question: str = "") -> str:
+        """Get schema information for the table, within the schema token budget."""
+        return self.schema_serializer.table_schema(table_name, question, cfg.schema_token_budget)
+
+    def get_schemas(self, table_names: List[str], question: str = "") -> str:
+        """Schema information for each of the tables, sharing the schema token budget."""
+        return self.schema_serializer.serialize(table_names, question)
+
+    def generate_sql(self, question: str, schema: str, deadline: Optional[Deadline] = None) -> str:
         """Generate SQL based on question and schema."""
-        prompt = f"""You are an expert in Microsoft SQL Server.
-Given this database schema:
-{schema}
-
-For the Prj_Data_Transfers_SC table:
-- CompanyId: The ID of the company (integer)
-- Recibido: 'Y' when a transfer is received, 'N' when not received
-- Despachado: 'Y' when a transfer is dispatched, 'N' when not dispatched
-- Estatus: Shows the current status (e.g., 'O' for open)
-- Draft_Numero: The transfer number
-- Fecha_Originacion: When the transfer was created
-- Fecha_Despacho: When the transfer was dispatched
-- Fecha_Recibo: When the transfer was received
-
-Generate a SQL query to answer this question: {question}
-
-Rules:
-1. Return ONLY the SQL query, no explanations
-2. Use proper MS SQL Server syntax:
-   - Use TOP instead of LIMIT
-   - Use GETDATE() instead of NOW()
-   - Use DATEADD/DATEDIFF for date math
-3. Use proper case for SQL keywords (SELECT, FROM, etc.)
-4. Use EXACT column names as shown in the schema (e.g., use 'CompanyId', not 'company_id')
-5. Do not use backticks (`) around names
-6. The query should be complete and runnable
-
-Example outputs:
-SELECT COUNT(*) FROM Prj_Data_Transfers_SC WHERE CompanyId = 1
-
-SELECT TOP 1 * FROM Prj_Data_Transfers_SC 
-WHERE Recibido = 'Y' 
-ORDER BY Fecha_Recibo DESC
-"""
-        return self.llm.invoke(prompt).strip()
+        return "".join(self.stream_sql(question, schema, deadline)).strip()
+
+    def stream_sql(self, question: str, schema: str, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """Generate SQL, yielding tokens as the LLM produces them."""
+        yield from self._llm_stream(self.sql_prompt(question, schema), "sql_generation", deadline)
+
+    def sql_prompt(self, question: str, schema: str) -> str:
+        """Build the prompt used to generate SQL: static instructions first, then schema, examples and question.
+
+        The examples are the most similar past questions whose SQL ran, or
+        the built-in examples when there are none yet.
+        """
+        examples = None
+        if self.sql_store is not None:
+            examples = self.sql_store.examples(question, schema, cfg.few_shot_examples, cfg.few_shot_min_score)
+        return prompts.sql_prompt(question, schema, examples, self.dialect)
+
+    def stored_sql(self, question: str) -> Optional[str]:
+        """SQL that answered the same question before, if it still validates against the schema."""
+        if self.sql_store is None:
+            return None
+        sql = self.sql_store.get(question)
+        if sql is None or not cfg.sql_validation:
+            return sql
+        try:
+            return self.sql_guard.validate(sql)
+        except SQLValidationError as e:
+            logger.info("Stored SQL no longer valid (%s), generating new SQL", e)
+            self.sql_store.remove(question)
+            return None
+
+    def remember_sql(self, question: str, sql: str) -> None:
+        """Save SQL that executed successfully to the persistent store."""
+        if self.sql_store is None:
+            return
+        try:
+            self.sql_store.add(question, sql)
+        except Exception as e:
+            # The store only saves work; never fail a question because of it
+            logger.warning("Could not save SQL to the store: %s", e)
+
+    def validate_sql(self, question: str, sql: str, schema: str, deadline: Optional[Deadline] = None) -> str:
+        """Check generated SQL before it runs, sending rejected SQL back to the LLM for repair.
+
+        SQL in another dialect that does not parse is rewritten once without
+        the LLM. Returns the SQL to execute, which may have a row limit added,
+        or raises SQLValidationError once the repair attempts are used up.
+        """
+        if not cfg.sql_validation:
+            return sql
+        steps = self._validation_steps(question, sql, schema)
+        done, value = advance(steps)
+        while not done:
+            done, value = advance(steps, "".join(self._llm_stream(value, "sql_repair", deadline)).strip())
+        return value
+
+    def _validation_steps(self, question: str, sql: str, schema: str) -> Generator[str, str, str]:
+        """validate_sql without the LLM calls: yields repair prompts and is sent the SQL the LLM wrote."""
+        attempts = 0
+        rewritten = False
+        while True:
+            try:
+                return self.sql_guard.validate(sql)
+            except SQLValidationError as e:
+                SQL_REJECTED.inc(reason=e.reason)
+                fixed = rewrite(sql, self.sql_guard.dialect) if e.reason == "parse" and not rewritten else None
+                if fixed is not None:
+                    logger.info("Rewrote unparsable SQL as %s: %s", self.sql_guard.dialect, fixed)
+                    sql, rewritten = fixed, True
+                    continue
+                if attempts >= cfg.sql_repair_attempts:
+                    raise
+                attempts += 1
+                logger.warning("Generated SQL rejected (%s): %s", e.reason, e)
+                sql = yield prompts.repair_prompt(question, schema, sql, str(e), self.dialect)
+
+    def execute_query(
+        self,
+        sql: str,
+        max_rows: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+        engine: Optional[Engine] = None,
+    ) -> QueryResult:
+        """Execute a SQL query and return at most max_rows rows of the results.
 
-    def execute_query(self, sql: str) -> List[Tuple]:
-        """Execute a SQL query and return the results."""
+        With a deadline, the database stops the query when the time is up or
+        the deadline is cancelled. The query runs on the chatbot's engine
+        unless another one is given.
+        """
+        max_rows = cfg.max_result_rows if max_rows is None else max_rows
+        engine = engine or self.engine
         try:
-            # Create a new connection for each query
-            with self.engine.connect() as conn:
-                result = conn.execute(text(sql))
-                return result.fetchall()
+            # Borrow a connection from the engine's pool for the query
+            with engine.connect() as conn, statement_deadline(conn, deadline):
+                result = conn.execution_options(stream_results=True).execute(text(sql))
+                rows = QueryResult(columns=list(result.keys()))
+                # Fetch in batches and stop one row past the cap to detect truncation
+                for batch in fetch_batches(result, cfg.result_fetch_batch, max_rows + 1, deadline):
+                    rows.extend(batch)
+                if len(rows) > max_rows:
+                    del rows[max_rows:]
+                    rows.truncated = True
+                    logger.warning("Result truncated to %s rows", max_rows)
+                result.close()
+                return rows
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            raise Exception(f"Error executing query: {str(e)}")
+            if deadline is not None and deadline.expired():
+                deadline.check()
+            raise QueryError(e)
 
-    def format_response(self, question: str, result: List[Tuple], sql: str) -> str:
+    def export_query(self, sql: str, fmt: str, deadline: Optional[Deadline] = None) -> Iterator[bytes]:
+        """Stream the full result of a query encoded in an export format.
+
+        Rows are read through a server-side cursor in fetchmany batches of
+        cfg.export_fetch_batch and encoded batch by batch, so memory stays
+        constant. At most cfg.export_max_rows rows are exported (0 = all).
+        """
+        export.check_format(fmt)
+        if cfg.sql_validation:
+            sql = self.sql_guard.with_row_limit(sql, cfg.export_max_rows)
+        with self.engine.connect() as conn, statement_deadline(conn, deadline):
+            result = conn.execution_options(stream_results=True).execute(text(sql))
+
+            def batches() -> Iterator[List[Tuple]]:
+                exported = 0
+                for batch in fetch_batches(result, cfg.export_fetch_batch, cfg.export_max_rows or None, deadline):
+                    exported += len(batch)
+                    yield batch
+                EXPORT_ROWS.observe(exported)
+
+            yield from export.encode(fmt, list(result.keys()), batches())
+            result.close()
+
+    def export_question(
+        self, question: str, fmt: str, deadline: Optional[Deadline] = None
+    ) -> Tuple[Dict[str, str], Iterator[bytes]]:
+        """Answer a question and return the answer with a stream of its full result in an export format.
+
+        The answer comes from the usual pipeline, which only reads up to
+        cfg.max_result_rows rows and phrases them from a bounded preview; the
+        export then reads the whole result again as it is streamed.
+        """
+        export.check_format(fmt)
+        answer = self.process_question(question, deadline)
+        return answer, self.export_query(answer["sql"], fmt, Deadline(cfg.export_timeout))
+
+    def format_response(
+        self, question: str, result: List[Tuple], sql: str, deadline: Optional[Deadline] = None
+    ) -> str:
         """Format the result in natural language."""
-        prompt = f"""Given:
-- Question: {question}
-- SQL query used: {sql}
-- Query result: {result}
-
-Provide a clear, natural language response that:
-1. Directly answers the question
-2. Is concise and to the point
-3. Includes relevant numbers/counts
-4. Uses proper grammar and complete sentences
-5. Does not include the SQL query or technical details
-
-Example:
-Question: "How many active users are there?"
-Result: [(42,)]
-Response: "There are 42 active users."
-"""
-        return self.llm.invoke(prompt).strip()
+        return "".join(self.stream_response(question, result, sql, deadline)).strip()
+
+    def stream_response(
+        self, question: str, result: List[Tuple], sql: str, deadline: Optional[Deadline] = None
+    ) -> Iterator[str]:
+        """Format the result in natural language, yielding tokens as they are produced.
+
+        Simple results are phrased from templates without calling the LLM.
+        """
+        response = self.fast_format(question, result, sql)
+        if response is not None:
+            yield response
+            return
+        yield from self._llm_stream(self.response_prompt(question, result, sql), "formatting", deadline)
+
+    def _llm_stream(self, prompt: str, stage: str, deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """Stream tokens from the LLM, recording its token usage for the stage.
+
+        The call waits for a slot of the LLM scheduler first. The deadline is
+        checked between tokens, and the HTTP timeout of the call is the time
+        left, so a long prompt evaluation cannot outlast it either. Stopping
+        closes the HTTP stream, and Ollama stops generating once its client
+        is gone.
+        """
+        with self.llm_scheduler.slot(stage, deadline):
+            llm = with_timeout(self.llm, deadline.remaining() if deadline else None)
+            tokens = llm.stream(prompt, config={"callbacks": [LLMUsageCallback(stage)]})
+            try:
+                for token in tokens:
+                    if deadline is not None:
+                        deadline.check()
+                    yield token
+            except DeadlineExceeded:
+                raise
+            except Exception:
+                # A read timeout of the time left
+                if deadline is not None and deadline.expired():
+                    deadline.check()
+                raise
+            finally:
+                tokens.close()
+
+    def fast_format(self, question: str, result: List[Tuple], sql: str) -> Optional[str]:
+        """Template answer for simple results, or None when the LLM is needed."""
+        if not cfg.fast_format_enabled:
+            return None
+        return self.fast_formatter.format(question, result, sql)
+
+    def response_prompt(self, question: str, result: List[Tuple], sql: str) -> str:
+        """Build the prompt used to phrase the result in natural language."""
+        return prompts.response_prompt(question, sql, self.result_for_prompt(result))
+
+    def result_for_prompt(self, result: List[Tuple]) -> str:
+        """Small results go into the prompt as-is, larger ones as a bounded summary."""
+        truncated = getattr(result, "truncated", False)
+        if len(result) <= cfg.prompt_preview_rows and not truncated:
+            return str(list(result))
+        if not isinstance(result, QueryResult):
+            result = QueryResult(result)
+        return "\n" + summarize_result(result, cfg.prompt_preview_rows)
+
+    def warm_up(self) -> None:
+        """Load the model and evaluate the static SQL prompt prefix so the first question starts faster."""
+        start = time.perf_counter()
+        try:
+            self.llm.invoke(prompts.sql_instructions(self.dialect), num_predict=1)
+        except Exception as e:
+            logger.warning("LLM warm-up failed: %s", e)
+            return
+        logger.info("LLM warmed up in %.1fs", time.perf_counter() - start)
+
+    def cache_key(self, question: str) -> Tuple[str, int]:
+        """Cache key for a question: its normalized text plus the schema version."""
+        return normalize_question(question), self.catalog.version
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Hit/miss counters and sizes of the question caches and the persistent SQL store."""
+        stats = {"sql": self.sql_cache.stats(), "answer": self.answer_cache.stats(), "repair": self.sql_repairer.stats()}
+        if self.sql_store is not None:
+            stats["store"] = self.sql_store.stats()
+        return stats
+
+    def format_stats(self) -> Dict[str, Any]:
+        """How often answers came from the template fast path instead of the LLM."""
+        return self.fast_formatter.stats()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Occupancy and wait-time metrics of the database connection pool."""
+        return pool_stats(self.engine.pool)
+
+    def llm_stats(self) -> Dict[str, Any]:
+        """Running, queued and shed LLM calls of the scheduler."""
+        return self.llm_scheduler.stats()
+
+    def stream_question(self, question: str, deadline: Optional[Deadline] = None) -> Iterator[Dict[str, Any]]:
+        """Run the full pipeline for a question, yielding an event as each stage progresses.
+
+        Events, in order: ``table`` with the selected tables, ``sql_token`` (repeated), ``sql``, ``repair``
+        with the fixed SQL (repeated, only when the query failed), ``executed`` with the row count,
+        ``answer_token`` (repeated) and ``done`` with the SQL and the answer. Cache hits skip the events of
+        the stages they replace.
+        Without a deadline the request gets REQUEST_TIMEOUT seconds; running
+        out or cancelling the deadline raises DeadlineExceeded.
+        """
+        deadline = deadline or Deadline(cfg.request_timeout)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            for event in self._run_pipeline(question, deadline):
+                if event["event"] == "done":
+                    outcome = "ok"
+                yield event
+        except DeadlineExceeded:
+            outcome = "timeout"
+            raise
+        finally:
+            QUESTIONS_TOTAL.inc(outcome=outcome)
+            QUESTION_SECONDS.observe(time.perf_counter() - start)
+
+    def _run_pipeline(self, question: str, deadline: Deadline) -> Iterator[Dict[str, Any]]:
+        key = self.cache_key(question)
+        cached = self.answer_cache.get(key)
+        if cached is not None:
+            logger.info("Answer cache hit for question: %s", key[0])
+            yield {"event": "sql", "sql": cached["sql"]}
+            yield {"event": "done", **cached}
+            return
+
+        # 1. Look up previously generated SQL, otherwise build it from the schema.
+        # Identical questions in flight share one generation, identical SQL one
+        # execution and one answer; waiters skip the token events.
+        sql, from_cache = self._known_sql(key, question)
+        if sql is None:
+            sql = yield from self._coalesced(
+                self.sql_flight, key, lambda: self._sql_events(question, deadline), deadline
+            )
+        yield {"event": "sql", "sql": sql}
+        logger.info("Executing SQL query: %s", sql)
+
+        # 2. Execute SQL, repairing it if the database rejects it; only SQL that ran successfully is cached
+        executed_sql, result = yield from self._execute_events(question, sql, deadline)
+        sql = self._save_executed(key, question, sql, executed_sql, result, from_cache)
+        yield {"event": "executed", "row_count": len(result), "truncated": result.truncated}
+
+        # 3. Format response
+        response = yield from self._coalesced(
+            self.answer_flight, (key, sql), lambda: self._answer_events(question, result, sql, deadline), deadline
+        )
+        answer = {"sql": sql, "response": response}
+        self.answer_cache.put(key, answer)
+        yield {"event": "done", **answer}
+
+    def _known_sql(self, key: Tuple[str, int], question: str) -> Tuple[Optional[str], bool]:
+        """SQL generated for the question before, and whether it came from the SQL cache."""
+        sql = self.sql_cache.get(key)
+        if sql is not None:
+            logger.info("SQL cache hit for question: %s", key[0])
+            return sql, True
+        sql = self.stored_sql(question)
+        if sql is not None:
+            logger.info("Stored SQL hit for question: %s", key[0])
+        return sql, False
+
+    def _save_executed(
+        self, key: Tuple[str, int], question: str, sql: str, executed_sql: str, result: QueryResult, from_cache: bool
+    ) -> str:
+        """Cache and store the SQL that ran for the question, which is returned; repaired SQL replaces sql."""
+        if executed_sql != sql:
+            sql, from_cache = executed_sql, False
+        ROWS_RETURNED.observe(len(result))
+        self.sql_cache.put(key, sql)
+        if not from_cache:
+            self.remember_sql(question, sql)
+        return sql
+
+    def _sql_events(self, question: str, deadline: Deadline) -> Generator[Dict[str, Any], None, str]:
+        with STAGE_SECONDS.time(stage="table_extraction"):
+            table_names = self.select_tables(question)
+        logger.info("Selected tables: %s", ", ".join(table_names))
+        yield {"event": "table", "table": table_names[0], "tables": table_names}
+        with STAGE_SECONDS.time(stage="schema_fetch"):
+            schema = self.get_schemas(table_names, question)
+        SCHEMA_TOKENS.observe(estimate_tokens(schema))
+        tokens = []
+        with STAGE_SECONDS.time(stage="sql_generation"):
+            for token in self.stream_sql(question, schema, deadline):
+                tokens.append(token)
+                yield {"event": "sql_token", "token": token}
+        with STAGE_SECONDS.time(stage="validation"):
+            return self.validate_sql(question, "".join(tokens).strip(), schema, deadline)
+
+    def _run_query(self, sql: str, deadline: Deadline) -> QueryResult:
+        routed = self.analytics.route(sql) if self.analytics is not None else None
+        if routed is not None:
+            engine = self.analytics.engine
+            try:
+                with STAGE_SECONDS.time(stage="analytics_execution"):
+                    result = self.query_flight.do(
+                        (engine.url, routed),
+                        lambda: self.execute_query(routed, deadline=deadline, engine=engine),
+                        deadline.remaining(),
+                    )
+                ANALYTICS_QUERIES.inc(outcome="ok")
+                return result
+            except QueryError as e:
+                ANALYTICS_QUERIES.inc(outcome="fallback")
+                logger.warning("Query failed on the analytics copy, running it on the database: %s", e.detail)
+        with STAGE_SECONDS.time(stage="db_execution"):
+            return self.query_flight.do(sql, lambda: self.execute_query(sql, deadline=deadline), deadline.remaining())
+
+    def _execute_events(
+        self, question: str, sql: str, deadline: Deadline
+    ) -> Generator[Dict[str, Any], None, Tuple[str, QueryResult]]:
+        """Execute the SQL, repairing it if the database rejects it; returns the SQL that ran and its result.
+
+        The repair itself is decided by _repair_steps; this runs its steps.
+        """
+        try:
+            return sql, self._run_query(sql, deadline)
+        except QueryError as e:
+            steps = self._repair_steps(question, sql, e, deadline)
+        with self._repair_budget(deadline) as budget, closing(steps):
+            done, step = advance(steps)
+            while not done:
+                kind, value = step
+                reply, error = None, None
+                try:
+                    if kind == "event":
+                        yield value
+                    elif kind == "schema":
+                        reply = self.get_schemas(self.select_tables(question), question)
+                    elif kind == "llm":
+                        reply = "".join(self._llm_stream(value, "sql_repair", budget)).strip()
+                    else:
+                        fixed = self.sql_guard.validate(value) if cfg.sql_validation else value
+                        reply = fixed, self._run_query(fixed, budget)
+                except Exception as e:
+                    error = e
+                done, step = advance(steps, reply, error)
+            return step
+
+    @contextmanager
+    def _repair_budget(self, deadline: Deadline) -> Iterator[Deadline]:
+        """The deadline of a repair: cfg.query_repair_timeout at most, and cancelled with the request."""
+        budget = deadline.child(cfg.query_repair_timeout)
+        with deadline.on_cancel(lambda: budget.cancel(deadline.reason or "Request cancelled")):
+            yield budget
+
+    def _repair_steps(
+        self, question: str, sql: str, error: QueryError, deadline: Deadline
+    ) -> Generator[Tuple[str, Any], Any, Tuple[str, QueryResult]]:
+        """The repair of a query that failed, as steps for the sync and async pipelines to carry out.
+
+        Each repair attempt takes a cached fix of the same failure, a dialect
+        rewrite, or else asks the LLM with the error. Steps are
+        ``("schema", None)``, to be sent the schema of the question's tables,
+        ``("llm", prompt)``, to be sent the SQL the LLM wrote, ``("event", event)``
+        to pass on, and ``("query", sql)``, to be sent the validated SQL and its
+        result within the repair budget. Errors of a step are thrown in.
+        Repairs stop after cfg.query_repair_attempts attempts or
+        cfg.query_repair_timeout seconds, and then the first error is raised.
+        """
+        error_class = classify(error.detail)
+        QUERY_ERRORS.inc(error_class=error_class)
+        if cfg.query_repair_attempts <= 0 or not repairable(error_class):
+            raise error
+        version = self.catalog.version
+        failed, failed_class, detail = sql, error_class, error.detail
+        tried = {sql}
+        schema = None
+        attempts = 0
+        start = time.perf_counter()
+        try:
+            while attempts < cfg.query_repair_attempts:
+                attempts += 1
+                logger.warning("Query failed (%s), repair attempt %s: %s", failed_class, attempts, detail)
+                fixed, method = self.sql_repairer.known_fix(failed, failed_class, version)
+                if fixed is None or fixed in tried:
+                    if schema is None:
+                        schema = yield "schema", None
+                    prompt = prompts.repair_prompt(question, schema, failed, detail, self.dialect)
+                    fixed, method = (yield "llm", prompt), "llm"
+                    if fixed in tried:
+                        # The same SQL would fail the same way again
+                        SQL_REPAIRS.inc(method=method, outcome="failed")
+                        break
+                tried.add(fixed)
+                yield "event", {"event": "repair", "attempt": attempts, "error": detail, "method": method, "sql": fixed}
+                try:
+                    fixed, result = yield "query", fixed
+                except (QueryError, SQLValidationError) as e:
+                    SQL_REPAIRS.inc(method=method, outcome="failed")
+                    detail = e.detail if isinstance(e, QueryError) else str(e)
+                    failed, failed_class = fixed, classify(detail)
+                    if not repairable(failed_class):
+                        break
+                    continue
+                SQL_REPAIRS.inc(method=method, outcome="fixed")
+                logger.info("Query repaired (%s) after %s attempt(s): %s", method, attempts, fixed)
+                self.sql_repairer.remember(sql, error_class, version, fixed)
+                return fixed, result
+        except DeadlineExceeded:
+            # Out of repair time, but the request may still answer with the error
+            if deadline.expired():
+                raise
+            logger.warning("Query repair ran out of time after %s attempt(s)", attempts)
+        finally:
+            REPAIR_ATTEMPTS.observe(attempts)
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="repair")
+        raise error
+
+    @staticmethod
+    def _drain(events: Generator[Dict[str, Any], None, Any]) -> Any:
+        """Run a stage for its return value, dropping its events."""
+        while True:
+            try:
+                next(events)
+            except StopIteration as stop:
+                return stop.value
+
+    def _answer_events(
+        self, question: str, result: List[Tuple], sql: str, deadline: Deadline
+    ) -> Generator[Dict[str, Any], None, str]:
+        tokens = []
+        with STAGE_SECONDS.time(stage="formatting"):
+            for token in self.stream_response(question, result, sql, deadline):
+                tokens.append(token)
+                yield {"event": "answer_token", "token": token}
+        return "".join(tokens).strip()
+
+    def _coalesced(
+        self,
+        flight: SingleFlight,
+        key: Hashable,
+        run: Callable[[], Generator[Dict[str, Any], None, Any]],
+        deadline: Deadline,
+    ) -> Generator[Dict[str, Any], None, Any]:
+        """Run a stage's events once per key; concurrent callers only get its result."""
+        call, leader = flight.claim(key)
+        if not leader:
+            while True:
+                # Wake up regularly so a cancelled waiter does not wait for the leader
+                remaining = deadline.remaining()
+                try:
+                    value = flight.wait(call, 0.5 if remaining is None else min(remaining, 0.5))
+                    break
+                except TimeoutError:
+                    deadline.check()
+            if value is not None:
+                return value
+            # The leader went away before finishing; do the work here instead
+            return (yield from run())
+        value = None
+        try:
+            value = yield from run()
+        except DeadlineExceeded:
+            # The leader's deadline is not the waiters'; they take over the work
+            raise
+        except Exception as e:
+            flight.fail(key, call, e)
+            raise
+        finally:
+            flight.finish(key, call, value)
+        return value
+
+    def coalesce_stats(self) -> Dict[str, Dict[str, int]]:
+        """In-flight calls, current waiters and coalesced calls per stage."""
+        return {
+            "sql": self.sql_flight.stats(),
+            "execution": self.query_flight.stats(),
+            "answer": self.answer_flight.stats(),
+        }
+
+    def _pools(self) -> List[Tuple[str, Any]]:
+        pools = [("sync", self.engine.pool)]
+        if self.analytics is not None:
+            pools.append(("analytics", self.analytics.engine.pool))
+        return pools
+
+    def metrics_text(self) -> str:
+        """Pipeline metrics plus cache, formatter and pool figures in Prometheus text format."""
+        caches = self.cache_stats()
+        formats = self.format_stats()
+        pools = [(name, pool_stats(pool)) for name, pool in self._pools()]
+        flights = self.coalesce_stats()
+        llm = self.llm_stats()
+        return render([
+            gauge("sql_chatbot_cache_hits_total", "Cache lookups that found an entry.",
+                  [({"cache": name}, stats["hits"]) for name, stats in caches.items()], "counter"),
+            gauge("sql_chatbot_cache_misses_total", "Cache lookups that found no entry.",
+                  [({"cache": name}, stats["misses"]) for name, stats in caches.items()], "counter"),
+            gauge("sql_chatbot_cache_hit_ratio", "Share of cache lookups that hit.",
+                  [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()]),
+            gauge("sql_chatbot_cache_entries", "Entries currently cached.",
+                  [({"cache": name}, stats["size"]) for name, stats in caches.items()]),
+            gauge("sql_chatbot_format_total", "Answers by formatting path.",
+                  [({"path": "fast"}, formats["fast_path"]), ({"path": "llm"}, formats["llm_fallback"])], "counter"),
+            gauge("sql_chatbot_db_pool_checked_out", "Connections currently checked out.",
+                  [({"engine": name}, stats.get("checked_out", 0)) for name, stats in pools]),
+            gauge("sql_chatbot_db_pool_checkouts_total", "Connections checked out of the pool.",
+                  [({"engine": name}, stats.get("checkouts", 0)) for name, stats in pools], "counter"),
+            gauge("sql_chatbot_db_pool_wait_seconds_total", "Time spent waiting for pooled connections.",
+                  [({"engine": name}, stats.get("total_wait_seconds", 0)) for name, stats in pools], "counter"),
+            gauge("sql_chatbot_db_pool_timeouts_total", "Pool checkouts that timed out.",
+                  [({"engine": name}, stats.get("checkout_timeouts", 0)) for name, stats in pools], "counter"),
+            gauge("sql_chatbot_coalesced_total", "Calls that waited for an identical in-flight call instead of running.",
+                  [({"stage": name}, stats["coalesced"]) for name, stats in flights.items()], "counter"),
+            gauge("sql_chatbot_coalesce_waiters", "Calls currently waiting for an identical in-flight call.",
+                  [({"stage": name}, stats["waiters"]) for name, stats in flights.items()]),
+            gauge("sql_chatbot_llm_active", "LLM calls currently holding a slot.", [({}, llm["active"])]),
+            gauge("sql_chatbot_llm_queue_depth", "LLM calls waiting for a slot.", [({}, llm["queued"])]),
+        ])
+
+    def plan_batch(self, questions: List[str]) -> List[Any]:
+        """Schema text for each question, or the exception raised while resolving its tables.
+
+        Each distinct set of tables has its schema built once, trimmed for
+        the combined questions that use it.
+        """
+        selected: List[Any] = []
+        groups: Dict[Tuple[str, ...], List[str]] = {}
+        for question in questions:
+            try:
+                tables = tuple(self.select_tables(question))
+            except Exception as e:
+                selected.append(e)
+                continue
+            selected.append(tables)
+            groups.setdefault(tables, []).append(question)
+        schemas: Dict[Tuple[str, ...], Any] = {}
+        for tables, group in groups.items():
+            try:
+                schemas[tables] = self.get_schemas(list(tables), " ".join(group))
+            except Exception as e:
+                schemas[tables] = e
+        return [schemas[plan] if isinstance(plan, tuple) else plan for plan in selected]
+
+    def process_batch(
+        self, questions: List[str], deadline: Optional[float] = None, cancel: Optional[Deadline] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Answer many questions, yielding a ``result`` event per question as it completes.
+
+        SQL generation and formatting run at most cfg.batch_llm_concurrency LLM
+        calls at a time while queries run in parallel on the connection pool.
+        A failing question only fails its own result. Questions still open when
+        the deadline (in seconds, capped by cfg.batch_deadline) passes are
+        reported as timed out and their LLM calls and queries are cancelled.
+        Cancelling cancel, for example when the client went away, stops the
+        batch the same way. A final ``done`` event carries the counts.
+        """
+        timeout = cfg.batch_deadline if deadline is None else min(deadline, cfg.batch_deadline)
+        expires = time.monotonic() + timeout
+        batch_deadline = Deadline(timeout)
+        plans = self.plan_batch(questions)
+        llm_slots = threading.Semaphore(max(1, cfg.batch_llm_concurrency))
+        executor = ThreadPoolExecutor(max_workers=max(1, min(len(questions), cfg.batch_workers)))
+        futures = {
+            executor.submit(self._batch_item, question, plan, llm_slots, batch_deadline): i
+            for i, (question, plan) in enumerate(zip(questions, plans))
+        }
+        counts = {"completed": 0, "failed": 0, "timed_out": 0}
+        pending = set(futures)
+        linked = cancel.on_cancel(lambda: batch_deadline.cancel(cancel.reason)) if cancel is not None else nullcontext()
+        try:
+            with linked:
+                for future in as_completed(futures, timeout=max(0.0, expires - time.monotonic())):
+                    pending.discard(future)
+                    yield self._batch_result(futures[future], questions, future, counts)
+        except FuturesTimeout:
+            for future in sorted(pending, key=futures.get):
+                if future.done():
+                    yield self._batch_result(futures[future], questions, future, counts)
+                else:
+                    counts["timed_out"] += 1
+                    i = futures[future]
+                    yield {"event": "result", "index": i, "question": questions[i], "error": "Deadline exceeded"}
+        finally:
+            # Queued work is dropped and running work stops at its next deadline check
+            batch_deadline.cancel("Batch deadline exceeded")
+            executor.shutdown(wait=False, cancel_futures=True)
+        yield {"event": "done", **counts}
+
+    def _batch_result(self, i: int, questions: List[str], future: Any, counts: Dict[str, int]) -> Dict[str, Any]:
+        try:
+            answer = future.result()
+        except Exception as e:
+            counts["failed"] += 1
+            return {"event": "result", "index": i, "question": questions[i], "error": str(e)}
+        counts["completed"] += 1
+        return {"event": "result", "index": i, "question": questions[i], **answer}
+
+    def _batch_item(
+        self, question: str, plan: Any, llm_slots: threading.Semaphore, deadline: Deadline
+    ) -> Dict[str, str]:
+        """One question of a batch: the pipeline without events, with LLM calls limited by llm_slots."""
+        def limited(fn: Callable[[], Any]) -> Any:
+            while not llm_slots.acquire(timeout=0.5):
+                deadline.check()
+            try:
+                deadline.check()
+                return fn()
+            finally:
+                llm_slots.release()
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            key = self.cache_key(question)
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                outcome = "ok"
+                return {"sql": cached["sql"], "response": cached["response"]}
+            sql, from_cache = self._known_sql(key, question)
+            if sql is None:
+                if isinstance(plan, Exception):
+                    raise plan
+                with STAGE_SECONDS.time(stage="sql_generation"):
+                    sql = self.sql_flight.do(key, lambda: limited(
+                        lambda: self.validate_sql(
+                            question, self.generate_sql(question, plan, deadline), plan, deadline
+                        )
+                    ), deadline.remaining())
+            executed_sql, result = self._drain(self._execute_events(question, sql, deadline))
+            sql = self._save_executed(key, question, sql, executed_sql, result, from_cache)
+            with STAGE_SECONDS.time(stage="formatting"):
+                response = self.fast_format(question, result, sql)
+                if response is None:
+                    prompt = self.response_prompt(question, result, sql)
+                    response = self.answer_flight.do(
+                        (key, sql),
+                        lambda: limited(lambda: "".join(self._llm_stream(prompt, "formatting", deadline)).strip()),
+                        deadline.remaining(),
+                    )
+            answer = {"sql": sql, "response": response}
+            self.answer_cache.put(key, answer)
+            outcome = "ok"
+            return answer
+        except DeadlineExceeded:
+            outcome = "timeout"
+            raise
+        finally:
+            QUESTIONS_TOTAL.inc(outcome=outcome)
+            QUESTION_SECONDS.observe(time.perf_counter() - start)
+
+    def process_question(self, question: str, deadline: Optional[Deadline] = None) -> Dict[str, str]:
+        """Run the full pipeline for a question and return the SQL used and the answer."""
+        for event in self.stream_question(question, deadline):
+            if event["event"] == "done":
+                return {"sql": event["sql"], "response": event["response"]}
+        raise Exception("Pipeline finished without an answer")
 
     def answer_question(self, question: str) -> str:
         """Process a question and return a natural language answer."""
         try:
-            # 1. Extract table name from question
-            table_name = self.extract_table_name(question)
-            
-            # 2. Get schema
-            schema = self.get_schema(table_name)
-            
-            # 3. Generate SQL based on schema and question
-            sql = self.generate_sql(question, schema)
-            print(f"\nExecuting SQL query:\n{sql}\n")
-            
-            # 4. Execute SQL
-            result = self.execute_query(sql)
-            
-            # 5. Format response
-            response = self.format_response(question, result, sql)
-            
-            return response
-            
+            return self.process_question(question)["response"]
         except Exception as e:
             return f"I apologize, but I encountered an error: {str(e)}"
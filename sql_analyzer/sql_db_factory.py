@@ -1,53 +1,104 @@
-from langchain_community.utilities.sql_database import SQLDatabase
+from typing import TYPE_CHECKING, Optional
+
 from sqlalchemy import create_engine, text
-from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
-from sql_analyzer.config import MSSQL, MYSQL, cfg
+from sql_analyzer.config import DUCKDB, MSSQL, MYSQL, SQLITE, cfg
+from sql_analyzer.db_pool import pool_kwargs
 from sql_analyzer.log_init import logger
 
+if TYPE_CHECKING:
+    from langchain_community.utilities.sql_database import SQLDatabase
+
+
+def mssql_odbc_connect() -> str:
+    mssql_config = cfg.mssql_config
+
+    # Create connection string for pyodbc
+    return (
+        "DRIVER={" + mssql_config.driver + "};"
+        "SERVER=" + mssql_config.server + ";"
+        "DATABASE=" + mssql_config.database + ";"
+        "UID=" + mssql_config.user + ";"
+        "PWD=" + mssql_config.password + ";"
+        "TrustServerCertificate=yes;"
+    )
+
+
+def engine_factory() -> Engine:
+    """Create the engine with a shared, bounded connection pool.
 
-def sql_db_factory() -> SQLDatabase:
+    Nothing connects until the engine is first used, so this works while the
+    database is down; the schema catalog loads the tables on first use.
+    """
+    cfg.check_db()
     if cfg.selected_db == MSSQL:
-        mssql_config = cfg.mssql_config
-        
-        # Create connection string for pyodbc
-        conn_str = (
-            "DRIVER={" + mssql_config.driver + "};"
-            "SERVER=" + mssql_config.server + ";"
-            "DATABASE=" + mssql_config.database + ";"
-            "UID=" + mssql_config.user + ";"
-            "PWD=" + mssql_config.password + ";"
-            "TrustServerCertificate=yes;"
-        )
-        
-        # Create engine with singleton pool
-        engine = create_engine(
+        conn_str = mssql_odbc_connect()
+        return create_engine(
             f"mssql+pyodbc:///?odbc_connect={conn_str}",
-            poolclass=SingletonThreadPool,  # Use a single connection
             connect_args={
                 "autocommit": True
-            }
+            },
+            **pool_kwargs(),
         )
-        
-        # Create SQLDatabase instance
-        sql_db = SQLDatabase(
-            engine=engine,
+    elif cfg.selected_db == MYSQL:
+        return create_engine(cfg.db_uri, **pool_kwargs())
+    elif cfg.selected_db in (SQLITE, DUCKDB):
+        return local_engine(cfg.db_uri)
+    else:
+        raise Exception(f"Could not create sql database factory: {cfg.selected_db}")
+
+
+def local_engine(uri: str) -> Engine:
+    """Engine on a local SQLite or DuckDB file, shared by the request threads."""
+    url = make_url(uri)
+    connect_args = {"check_same_thread": False} if url.get_backend_name() == SQLITE else {}
+    return create_engine(url, connect_args=connect_args, **pool_kwargs())
+
+
+def analytics_engine_factory() -> Optional[Engine]:
+    """Engine on the local copy that analytical queries are routed to, if configured."""
+    if not cfg.analytics_db_uri:
+        return None
+    return local_engine(cfg.analytics_db_uri)
+
+
+def sql_db_factory() -> "SQLDatabase":
+    """LangChain SQLDatabase over the engine, for the agent tools; it connects to list the tables."""
+    from langchain_community.utilities.sql_database import SQLDatabase
+
+    if cfg.selected_db == MSSQL:
+        return SQLDatabase(
+            engine=engine_factory(),
             schema="dbo",  # Default schema for MSSQL
-            sample_rows_in_table_info=3
+            sample_rows_in_table_info=3,
+            lazy_table_reflection=True,
         )
-        
-        # Test the connection and log table names
-        tables = sql_db.get_usable_table_names()
-        logger.info("Available tables: %s", tables)
-        
-        return sql_db
+    return SQLDatabase(engine_factory(), view_support=True, lazy_table_reflection=True)
+
+
+def async_engine_factory() -> Optional[AsyncEngine]:
+    """Create the optional async engine used by AsyncSQLChatbot, if enabled."""
+    if not cfg.use_async_engine:
+        return None
+    cfg.check_db()
+    if cfg.async_db_uri:
+        uri = cfg.async_db_uri
+    elif cfg.selected_db == MSSQL:
+        uri = f"mssql+aioodbc:///?odbc_connect={mssql_odbc_connect()}"
     elif cfg.selected_db == MYSQL:
-        return SQLDatabase.from_uri(cfg.db_uri, view_support=True)
+        uri = make_url(cfg.db_uri).set(drivername="mysql+asyncmy")
+    elif cfg.selected_db == SQLITE:
+        uri = make_url(cfg.db_uri).set(drivername="sqlite+aiosqlite")
     else:
-        raise Exception(f"Could not create sql database factory: {cfg.selected_db}")
+        raise Exception(f"Could not create async engine: {cfg.selected_db}")
+
+    connect_args = {"autocommit": True} if cfg.selected_db == MSSQL else {}
+    return create_async_engine(uri, connect_args=connect_args, **pool_kwargs(async_engine=True))
 
 
 if __name__ == "__main__":
     logger.info("sql_db_factory")
     sql_database = sql_db_factory()
-    logger.info("sql_database %s", sql_database)
+    logger.info("Available tables: %s", sql_database.get_usable_table_names())
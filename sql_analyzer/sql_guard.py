@@ -0,0 +1,178 @@
+"""
+Validation of generated SQL before it reaches the database.
+
+Generated SQL is parsed with sqlglot and must be a single read-only query
+over tables and columns known to the schema catalog. A row limit is added
+when the query has none, and the optimizer's cost estimate (SHOWPLAN_XML on
+MSSQL, EXPLAIN on MySQL) can be used to reject expensive queries.
+"""
+import json
+import re
+from typing import Optional, Set
+
+import sqlglot
+from sqlalchemy.engine import Engine
+from sqlglot import exp
+
+from sql_analyzer.dialects import dialect_for
+from sql_analyzer.log_init import logger
+from sql_analyzer.schema_catalog import SchemaCatalog
+
+WRITE_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create, exp.Alter, exp.Into, exp.Command,
+)
+
+SHOWPLAN_COST = re.compile(r'StatementSubTreeCost="([^"]+)"')
+
+
+class SQLValidationError(ValueError):
+    """Generated SQL that must not run; reason is one of parse, write, identifier or cost."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class SQLGuard:
+    def __init__(self, engine: Engine, catalog: SchemaCatalog, max_rows: int, max_cost: float = 0.0):
+        self.engine = engine
+        self.catalog = catalog
+        self.max_rows = max_rows
+        self.max_cost = max_cost
+        # sqlglot dialect name
+        self.dialect = dialect_for(engine).sqlglot
+
+    def validate(self, sql: str) -> str:
+        """The SQL to run, with a row limit added if needed; raises SQLValidationError."""
+        try:
+            statements = [s for s in sqlglot.parse(sql, read=self.dialect) if s is not None]
+        except sqlglot.errors.ParseError as e:
+            detail = e.errors[0] if e.errors else {}
+            message = detail.get("description") or str(e)
+            if detail.get("line"):
+                message += f" (line {detail['line']}, column {detail['col']})"
+            raise SQLValidationError(f"The SQL could not be parsed: {message}", "parse")
+        if len(statements) != 1:
+            raise SQLValidationError("Only a single SQL statement is allowed.", "write")
+        statement = statements[0]
+        if not isinstance(statement, exp.Query) or statement.find(*WRITE_NODES):
+            raise SQLValidationError("Only read-only SELECT queries are allowed.", "write")
+
+        self.check_identifiers(statement)
+        limited = self.limit(statement)
+        if limited is not None:
+            sql = limited.sql(dialect=self.dialect)
+
+        if self.max_cost > 0:
+            cost = self.estimate_cost(sql)
+            if cost is not None and cost > self.max_cost:
+                raise SQLValidationError(
+                    f"The query is too expensive (estimated cost {cost:.1f}, limit {self.max_cost:.1f}). "
+                    "Filter with a WHERE clause, avoid cross joins and aggregate instead of listing rows.",
+                    "cost",
+                )
+        return sql
+
+    def check_identifiers(self, statement: exp.Expression) -> None:
+        """Every table must be in the catalog, and every column in one of the tables used."""
+        known_tables = {name.lower(): name for name in self.catalog.table_names()}
+        ctes = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        tables: Set[str] = set()
+        for table in statement.find_all(exp.Table):
+            name = table.name.lower()
+            if name in ctes:
+                continue
+            if name not in known_tables:
+                raise SQLValidationError(f"Unknown table '{table.name}'.", "identifier")
+            tables.add(known_tables[name])
+
+        # Columns of derived tables and CTEs are not tracked; only check plain queries
+        if ctes or any(isinstance(source.this, exp.Subquery) for source in statement.find_all(exp.From)):
+            return
+        columns = {column.name.lower() for table in tables for column in self.catalog.columns(table)}
+        aliases = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+        for column in statement.find_all(exp.Column):
+            if isinstance(column.this, exp.Star):
+                continue
+            name = column.name.lower()
+            if name and name not in columns and name not in aliases:
+                raise SQLValidationError(f"Unknown column '{column.name}'.", "identifier")
+
+    def limit(self, statement: exp.Query) -> Optional[exp.Query]:
+        """The statement with a row limit one past max_rows, or None if it needs no change.
+
+        One extra row lets execution detect that the result was truncated.
+        Aggregates without GROUP BY or window functions return a single row
+        and are left alone.
+        """
+        cap = self.max_rows + 1
+        existing = statement.args.get("limit")
+        if existing is not None:
+            value = existing.expression
+            if isinstance(value, exp.Literal) and value.is_int and int(value.this) <= cap:
+                return None
+            if isinstance(statement, exp.Select) and not existing.args.get("percent"):
+                return statement.limit(cap)
+            return None
+        if isinstance(statement, exp.Select) and not statement.args.get("group") and single_row(statement):
+            return None
+        return statement.limit(cap)
+
+    def with_row_limit(self, sql: str, max_rows: int) -> str:
+        """Validated SQL with the row limit added by validate() changed to max_rows (0 removes it).
+
+        Limits the query had of its own are kept.
+        """
+        statement = sqlglot.parse_one(sql, read=self.dialect)
+        existing = statement.args.get("limit")
+        if existing is None:
+            return sql
+        value = existing.expression
+        if not (isinstance(value, exp.Literal) and value.is_int and int(value.this) == self.max_rows + 1):
+            return sql
+        if max_rows:
+            statement = statement.limit(max_rows)
+        else:
+            statement.set("limit", None)
+        return statement.sql(dialect=self.dialect)
+
+    def estimate_cost(self, sql: str) -> Optional[float]:
+        """The optimizer's estimated cost of the query, or None where the database gives none."""
+        name = self.engine.dialect.name
+        try:
+            with self.engine.connect() as conn:
+                if name == "mssql":
+                    conn.exec_driver_sql("SET SHOWPLAN_XML ON")
+                    try:
+                        plan = conn.exec_driver_sql(sql).scalar()
+                    finally:
+                        try:
+                            conn.exec_driver_sql("SET SHOWPLAN_XML OFF")
+                        except Exception:
+                            # Never return a connection that answers queries with plans to the pool
+                            conn.invalidate()
+                            raise
+                    costs = [float(cost) for cost in SHOWPLAN_COST.findall(plan or "")]
+                    return max(costs) if costs else None
+                if name == "mysql":
+                    plan = json.loads(conn.exec_driver_sql(f"EXPLAIN FORMAT=JSON {sql}").scalar())
+                    return float(plan["query_block"]["cost_info"]["query_cost"])
+        except Exception as e:
+            # The plan is advisory; a failure here should not block the query
+            logger.warning("Could not estimate query cost: %s", e)
+        return None
+
+
+def single_row(statement: exp.Select) -> bool:
+    """The SELECT aggregates all of its rows into one.
+
+    Only aggregates and window functions of the SELECT itself count, not those
+    of subqueries; COUNT(*) OVER () returns a row per input row.
+    """
+    def own(node: exp.Expression, kind: type) -> bool:
+        return node.find_ancestor(kind, exp.Select) is statement
+
+    nodes = [node for projection in statement.expressions for node in projection.find_all(exp.AggFunc, exp.Window)]
+    if any(isinstance(node, exp.Window) and own(node, exp.Window) for node in nodes):
+        return False
+    return any(isinstance(node, exp.AggFunc) and own(node, exp.Window) for node in nodes)
@@ -0,0 +1,132 @@
+"""
+Repair of SQL that failed on the database.
+
+The error message of a failed query is sorted into an error class. Dialect
+mix-ups the model makes often (LIMIT instead of TOP, backticks, NOW()) are
+rewritten with sqlglot without an LLM call; other errors go back to the LLM
+with the failing SQL. Fixes that ran are cached by failing SQL, error class
+and schema version, so the same mistake is only repaired once.
+"""
+import re
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from sql_analyzer.answer_cache import TTLCache
+
+# (error class, pattern over the driver message), first match wins
+ERROR_CLASSES: List[Tuple[str, re.Pattern]] = [
+    (name, re.compile(pattern, re.IGNORECASE))
+    for name, pattern in [
+        ("timeout", r"timeout|timed out|execution was interrupted|maximum statement execution time|interrupted"),
+        ("connection", r"communication link|lost connection|gone away|tcp provider|login failed|unable to connect"),
+        ("permission", r"permission|access denied|denied"),
+        ("unknown_function", r"not a recognized (built-in )?function|no such function|function \S+ does not exist"),
+        ("unknown_column", r"invalid column name|unknown column|no such column"),
+        ("unknown_table", r"invalid object name|table \S+ doesn't exist|no such table|unknown table"),
+        ("ambiguous_column", r"ambiguous column"),
+        ("group_by", r"group by|only_full_group_by|aggregate function"),
+        ("conversion", r"conversion failed|error converting|truncated incorrect|invalid input syntax|overflow"),
+        ("divide_by_zero", r"divide by zero|division by zero"),
+        ("syntax", r"syntax|could not be parsed|near ['\"`]"),
+    ]
+]
+# Retrying does not help: the database is slow, down, or the query is not allowed
+NOT_REPAIRABLE = {"timeout", "connection", "permission"}
+# Errors a dialect rewrite can fix
+REWRITE_CLASSES = {"syntax", "unknown_function"}
+# Dialects the model writes when it forgets the target one
+SOURCE_DIALECTS = ("tsql", "mysql", "postgres", "sqlite")
+# Functions of other dialects that sqlglot keeps as unknown names
+FUNCTION_REWRITES = {
+    "NOW": exp.CurrentTimestamp,
+    "CURDATE": exp.CurrentDate,
+    "SYSDATE": exp.CurrentTimestamp,
+}
+
+
+class QueryError(Exception):
+    """A query failed on the database; detail is the driver's message without the SQL."""
+
+    def __init__(self, error: Exception):
+        super().__init__(f"Error executing query: {error}")
+        self.detail = error_detail(error)
+
+
+def error_detail(error: Exception) -> str:
+    # SQLAlchemy wraps the driver error and appends the SQL and a documentation link
+    orig = getattr(error, "orig", None)
+    message = str(orig if orig is not None else error)
+    return message.split("\n[SQL:")[0].split("\n(Background on this error")[0].strip()
+
+
+def classify(message: str) -> str:
+    for name, pattern in ERROR_CLASSES:
+        if pattern.search(message):
+            return name
+    return "other"
+
+
+def repairable(error_class: str) -> bool:
+    return error_class not in NOT_REPAIRABLE
+
+
+def _normalized(sql: str, dialect: str) -> Optional[str]:
+    try:
+        return sqlglot.parse_one(sql, read=dialect).sql(dialect=dialect)
+    except sqlglot.errors.ParseError:
+        return None
+
+
+def _same(a: str, b: str) -> bool:
+    return " ".join(a.lower().split()) == " ".join(b.lower().split())
+
+
+def rewrite(sql: str, dialect: str) -> Optional[str]:
+    """The SQL written in this dialect, or None when that changes nothing.
+
+    The SQL is read leniently as this dialect first (sqlglot reads LIMIT as
+    TOP for T-SQL), then as each of the others.
+    """
+    def convert(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.Anonymous) and node.name.upper() in FUNCTION_REWRITES:
+            return FUNCTION_REWRITES[node.name.upper()]()
+        if isinstance(node, exp.ILike) and dialect == "tsql":
+            # SQL Server collations are case-insensitive by default
+            return exp.Like(this=node.this, expression=node.expression)
+        return node
+
+    for source in (dialect, *[other for other in SOURCE_DIALECTS if other != dialect]):
+        try:
+            fixed = sqlglot.parse_one(sql, read=source).transform(convert).sql(dialect=dialect)
+        except (sqlglot.errors.ParseError, sqlglot.errors.UnsupportedError):
+            continue
+        if not _same(fixed, sql) and _normalized(fixed, dialect) is not None:
+            return fixed
+    return None
+
+
+class SQLRepairer:
+    """Fixes without the LLM: cached fixes of earlier failures, then dialect rewrites."""
+
+    def __init__(self, dialect: str, cache_size: int = 256, cache_ttl: float = 86_400):
+        self.dialect = dialect
+        self.fixes = TTLCache(cache_size, cache_ttl)
+
+    def known_fix(self, sql: str, error_class: str, version: Hashable) -> Tuple[Optional[str], str]:
+        """A fix and how it was found (cache or rewrite), or (None, "llm") when the LLM is needed."""
+        fixed = self.fixes.get((sql, error_class, version))
+        if fixed is not None:
+            return fixed, "cache"
+        if error_class in REWRITE_CLASSES:
+            fixed = rewrite(sql, self.dialect)
+            if fixed is not None:
+                return fixed, "rewrite"
+        return None, "llm"
+
+    def remember(self, sql: str, error_class: str, version: Hashable, fixed: str) -> None:
+        self.fixes.put((sql, error_class, version), fixed)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.fixes.stats()
@@ -0,0 +1,201 @@
+"""
+Persistent store of questions and the validated SQL that answered them.
+
+Every SQL query that passed validation and executed successfully is saved
+with its question in a small SQLite file, so the work survives restarts.
+The store is loaded into memory at startup and serves two purposes: a
+question seen before reuses its SQL without an LLM call, and the most
+similar past questions become the few-shot examples of the SQL prompt.
+
+Similarity is the IDF-weighted overlap of the questions' words. Examples
+are only used when every table their SQL reads is in the prompt's schema.
+The file is shared by the server's worker processes; it is written in WAL
+mode and writers wait for each other instead of failing.
+"""
+import math
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from sql_analyzer.answer_cache import normalize_question
+from sql_analyzer.log_init import logger
+from sql_analyzer.table_matcher import WORD_PATTERN, normalize_word
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS examples (
+    normalized TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    tables TEXT NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 1,
+    last_used REAL NOT NULL
+)
+"""
+# Seconds a write waits for another process holding the database lock
+BUSY_TIMEOUT = 10.0
+
+
+def question_words(question: str) -> Set[str]:
+    return {normalize_word(word) for word in WORD_PATTERN.findall(question)}
+
+
+def sql_tables(sql: str, dialect: Optional[str] = None) -> List[str]:
+    """Lowercased names of the tables a query reads, without its CTEs."""
+    try:
+        statement = sqlglot.parse_one(sql, read=dialect)
+    except sqlglot.errors.ParseError:
+        return []
+    ctes = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+    return sorted({table.name.lower() for table in statement.find_all(exp.Table)} - ctes)
+
+
+class Example:
+    __slots__ = ("question", "sql", "tables", "words")
+
+    def __init__(self, question: str, sql: str, tables: List[str]):
+        self.question = question
+        self.sql = sql
+        self.tables = tables
+        self.words = question_words(question)
+
+
+class SQLStore:
+    """Question -> SQL pairs kept in SQLite and mirrored in memory for lookups."""
+
+    def __init__(self, path: str, max_size: int = 5000, dialect: Optional[str] = None):
+        self.path = path
+        self.max_size = max_size
+        self.dialect = dialect
+        self.hits = 0
+        self.misses = 0
+        self._examples: Dict[str, Example] = {}
+        self._document_frequency: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # Readers do not block the writer, and commits do not wait for fsync of the whole file
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+        for normalized, question, sql, tables in self._conn.execute(
+            "SELECT normalized, question, sql, tables FROM examples ORDER BY last_used DESC LIMIT ?", (max_size,)
+        ):
+            self._index(normalized, Example(question, sql, tables.split(",") if tables else []))
+        logger.info("Loaded %s stored SQL examples from %s", len(self._examples), path)
+
+    def _index(self, normalized: str, example: Example) -> None:
+        previous = self._examples.get(normalized)
+        if previous is not None:
+            self._count(previous.words, -1)
+        self._examples[normalized] = example
+        self._count(example.words, 1)
+
+    def _count(self, words: Set[str], delta: int) -> None:
+        for word in words:
+            self._document_frequency[word] = self._document_frequency.get(word, 0) + delta
+
+    def get(self, question: str) -> Optional[str]:
+        """The SQL stored for the same question, if any; a hit counts as a use for eviction."""
+        normalized = normalize_question(question)
+        with self._lock:
+            example = self._examples.get(normalized)
+            if example is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            try:
+                self._conn.execute(
+                    "UPDATE examples SET uses = uses + 1, last_used = ? WHERE normalized = ?", (time.time(), normalized)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # Only the eviction order suffers; the SQL is still good
+                logger.warning("Could not record use of stored SQL: %s", e)
+            return example.sql
+
+    def add(self, question: str, sql: str) -> None:
+        """Save SQL that executed successfully for the question, replacing what was stored for it."""
+        normalized = normalize_question(question)
+        example = Example(question, sql, sql_tables(sql, self.dialect))
+        with self._lock:
+            self._index(normalized, example)
+            self._conn.execute(
+                "INSERT INTO examples (normalized, question, sql, tables, last_used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(normalized) DO UPDATE SET question = excluded.question, sql = excluded.sql, "
+                "tables = excluded.tables, uses = uses + 1, last_used = excluded.last_used",
+                (normalized, question, sql, ",".join(example.tables), time.time()),
+            )
+            if len(self._examples) > self.max_size:
+                self._evict()
+            self._conn.commit()
+
+    def remove(self, question: str) -> None:
+        """Forget the SQL of a question, for example when it no longer validates."""
+        normalized = normalize_question(question)
+        with self._lock:
+            example = self._examples.pop(normalized, None)
+            if example is not None:
+                self._count(example.words, -1)
+            self._conn.execute("DELETE FROM examples WHERE normalized = ?", (normalized,))
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        # Drop the least recently used entries beyond max_size
+        stale = [row[0] for row in self._conn.execute(
+            "SELECT normalized FROM examples ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_size,)
+        )]
+        self._conn.executemany("DELETE FROM examples WHERE normalized = ?", [(key,) for key in stale])
+        for key in stale:
+            example = self._examples.pop(key, None)
+            if example is not None:
+                self._count(example.words, -1)
+
+    def examples(self, question: str, schema: str, k: int, min_score: float = 0.0) -> List[Tuple[str, str]]:
+        """Up to k (question, sql) pairs most similar to the question whose tables all appear in the schema."""
+        if k <= 0:
+            return []
+        words = question_words(question)
+        normalized = normalize_question(question)
+        schema_words = set(re.findall(r"\w+", schema.lower()))
+        with self._lock:
+            total = len(self._examples)
+            scored = []
+            for key, example in self._examples.items():
+                if key == normalized or not example.tables:
+                    continue
+                if not all(table in schema_words for table in example.tables):
+                    continue
+                score = self._similarity(words, example.words, total)
+                if score >= min_score and score > 0:
+                    scored.append((score, example))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [(example.question, example.sql) for _, example in scored[:k]]
+
+    def _similarity(self, words: Set[str], other: Set[str], total: int) -> float:
+        def weight(word: str) -> float:
+            return math.log((1 + total) / (1 + self._document_frequency.get(word, 0))) + 1.0
+
+        union = words | other
+        if not union:
+            return 0.0
+        return sum(weight(word) for word in words & other) / sum(weight(word) for word in union)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._examples),
+                "max_size": self.max_size,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
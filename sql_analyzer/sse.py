@@ -0,0 +1,10 @@
+"""
+Server-sent events encoding for the streaming query endpoints.
+"""
+import json
+from typing import Any, Dict
+
+
+def sse_event(event: Dict[str, Any]) -> str:
+    """Encode a pipeline event as one SSE message, named after its ``event`` field."""
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
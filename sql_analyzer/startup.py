@@ -0,0 +1,138 @@
+"""
+Background start-up of the chatbot for the servers and the CLI.
+
+Building a chatbot imports LangChain, SQLAlchemy and sqlglot but does not
+connect to anything, so the servers start listening right away and build it
+on a thread. Warm-up then loads the schema catalog (the first connection),
+the table index and the model, and starts the column profiler. A database that is down is retried with
+backoff instead of stopping the process; until the schema has loaded the
+readiness check fails.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from sql_analyzer.config import cfg
+from sql_analyzer.log_init import logger
+
+MAX_RETRY_INTERVAL = 60.0
+
+
+class NotReady(RuntimeError):
+    """The chatbot has not been built (yet); retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Startup:
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        warm_up_llm: Optional[bool] = None,
+        retry_interval: Optional[float] = None,
+        profile_columns: bool = True,
+    ):
+        self.factory = factory
+        # False in all but one of several worker processes; those reload the column stats file instead
+        self.profile_columns = profile_columns
+        self.warm_up_llm = cfg.llm_warm_up if warm_up_llm is None else warm_up_llm
+        self.retry_interval = cfg.startup_retry_interval if retry_interval is None else retry_interval
+        self.chatbot: Any = None
+        self.error: Optional[str] = None
+        # Seconds from creation until each stage finished
+        self.timings: Dict[str, float] = {}
+        self._created = time.perf_counter()
+        self._built = threading.Event()
+        self._schema_loaded = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        """The chatbot is built and the database answered with its schema."""
+        return self._schema_loaded.is_set()
+
+    def start(self) -> "Startup":
+        """Start building in the background; calling it again does nothing."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="startup", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop retrying the database and profiling columns."""
+        self._stopped.set()
+        if self.chatbot is not None and self.chatbot.column_profiler is not None:
+            self.chatbot.column_profiler.stop()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """The chatbot, waiting up to timeout seconds while it is built; raises NotReady."""
+        if self.chatbot is not None:
+            return self.chatbot
+        self.start()
+        self._built.wait(timeout)
+        if self.chatbot is None:
+            raise NotReady(self.error or "The chatbot is starting, please retry")
+        return self.chatbot
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for start-up and warm-up to finish; False on timeout."""
+        self.start()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "chatbot": self.chatbot is not None,
+            "timings": dict(self.timings),
+            "error": self.error,
+        }
+
+    def _mark(self, stage: str) -> None:
+        self.timings[stage] = time.perf_counter() - self._created
+        logger.info("Start-up: %s after %.2fs", stage, self.timings[stage])
+
+    def _run(self) -> None:
+        try:
+            self.chatbot = self.factory()
+        except Exception as e:
+            # Configuration errors do not go away by retrying
+            self.error = f"Could not build the chatbot: {e}"
+            logger.exception("Could not build the chatbot")
+            return
+        finally:
+            self._built.set()
+        self._mark("chatbot")
+
+        interval = self.retry_interval
+        while not self._stopped.is_set():
+            try:
+                self.chatbot.get_table_names()
+                break
+            except Exception as e:
+                self.error = f"Database unavailable: {e}"
+                logger.warning("Could not load the schema, retrying in %.1fs: %s", interval, e)
+                self._stopped.wait(interval)
+                interval = min(interval * 2, MAX_RETRY_INTERVAL)
+        if self._stopped.is_set():
+            return
+        self.error = None
+        self._schema_loaded.set()
+        self._mark("schema")
+
+        try:
+            self.chatbot.table_index()
+            self._mark("table_index")
+        except Exception as e:
+            # Questions that name their tables still work without the index
+            logger.warning("Could not load the table index: %s", e)
+        if self.chatbot.column_profiler is not None:
+            self.chatbot.column_profiler.start(self.profile_columns)
+        if self.warm_up_llm:
+            self.chatbot.warm_up()
+            self._mark("llm")
@@ -0,0 +1,197 @@
+"""
+Vector index of table descriptions for routing questions to the relevant tables.
+
+Each table is described by its name, aliases and columns. The descriptions
+are embedded with Ollama's embedding endpoint, or with a TF-IDF model when no
+network is wanted. The matrix is stored as a .npy file and memory-mapped on
+load. Queries are a single matrix-vector product followed by a top-k
+selection.
+
+Build the index offline from the live database with:
+
+    python -m sql_analyzer.table_index
+"""
+import hashlib
+import json
+import math
+import os
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from sql_analyzer.config import cfg
+from sql_analyzer.log_init import logger
+from sql_analyzer.schema_catalog import SchemaCatalog
+from sql_analyzer.table_matcher import WORD_PATTERN, normalize_word, split_name
+
+TFIDF = "tfidf"
+OLLAMA = "ollama"
+
+
+def table_documents(
+    catalog: SchemaCatalog,
+    aliases: Mapping[str, Iterable[str]],
+    column_notes: Optional[Mapping[str, Mapping[str, str]]] = None,
+) -> Dict[str, str]:
+    """One plain-text description per table: split name, aliases, column names and column notes."""
+    column_notes = column_notes or {}
+    documents = {}
+    for table in catalog.table_names():
+        columns = ", ".join(" ".join(split_name(column.name)) for column in catalog.columns(table))
+        parts = [" ".join(split_name(table)), table]
+        if table in aliases:
+            parts.append(", ".join(aliases[table]))
+        parts.append(f"columns: {columns}")
+        parts.extend(column_notes.get(table, {}).values())
+        documents[table] = ". ".join(parts)
+    return documents
+
+
+def fingerprint(documents: Mapping[str, str], backend: str) -> str:
+    digest = hashlib.sha1(backend.encode())
+    for table in sorted(documents):
+        digest.update(f"{table}\0{documents[table]}\0".encode())
+    return digest.hexdigest()
+
+
+def tokenize(text: str) -> List[str]:
+    words = []
+    for word in WORD_PATTERN.findall(text):
+        words.extend(split_name(word) if "_" in word or not word.islower() else [normalize_word(word)])
+    return words
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+class TableIndex:
+    """Top-k similarity search over table descriptions."""
+
+    def __init__(
+        self,
+        tables: List[str],
+        matrix: np.ndarray,
+        backend: str,
+        vocabulary: Optional[Dict[str, int]] = None,
+        idf: Optional[List[float]] = None,
+    ):
+        self.tables = tables
+        self.matrix = matrix
+        self.backend = backend
+        self.vocabulary = vocabulary or {}
+        self.idf = np.asarray(idf or [], dtype=np.float32)
+        self._embeddings = None
+
+    @classmethod
+    def build(cls, documents: Mapping[str, str], backend: str = TFIDF) -> "TableIndex":
+        tables = list(documents)
+        if backend == OLLAMA:
+            index = cls(tables, np.zeros((0, 0), dtype=np.float32), backend)
+            vectors = index.embeddings().embed_documents([documents[table] for table in tables])
+            index.matrix = normalize_rows(np.asarray(vectors, dtype=np.float32))
+            return index
+
+        tokenized = [tokenize(documents[table]) for table in tables]
+        vocabulary: Dict[str, int] = {}
+        for tokens in tokenized:
+            for token in tokens:
+                vocabulary.setdefault(token, len(vocabulary))
+        frequency = np.zeros(len(vocabulary), dtype=np.float32)
+        counts = np.zeros((len(tables), len(vocabulary)), dtype=np.float32)
+        for row, tokens in enumerate(tokenized):
+            for token in tokens:
+                counts[row, vocabulary[token]] += 1
+            for token in set(tokens):
+                frequency[vocabulary[token]] += 1
+        idf = [math.log((1 + len(tables)) / (1 + f)) + 1 for f in frequency]
+        matrix = normalize_rows(counts * np.asarray(idf, dtype=np.float32))
+        return cls(tables, matrix, backend, vocabulary, idf)
+
+    def embeddings(self):
+        if self._embeddings is None:
+            from langchain_community.embeddings import OllamaEmbeddings
+
+            self._embeddings = OllamaEmbeddings(base_url=cfg.ollama_url, model=cfg.embedding_model)
+        return self._embeddings
+
+    def save(self, path: str, index_fingerprint: str) -> None:
+        np.save(f"{path}.npy", self.matrix)
+        with open(f"{path}.json", "w") as f:
+            json.dump(
+                {
+                    "fingerprint": index_fingerprint,
+                    "backend": self.backend,
+                    "tables": self.tables,
+                    "vocabulary": self.vocabulary,
+                    "idf": self.idf.tolist(),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str, index_fingerprint: str) -> Optional["TableIndex"]:
+        """Load a saved index, memory-mapping its matrix; None if missing or stale."""
+        if not (os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")):
+            return None
+        with open(f"{path}.json") as f:
+            meta = json.load(f)
+        if meta["fingerprint"] != index_fingerprint:
+            return None
+        matrix = np.load(f"{path}.npy", mmap_mode="r")
+        return cls(meta["tables"], matrix, meta["backend"], meta["vocabulary"], meta["idf"])
+
+    def _vectorize(self, text: str) -> np.ndarray:
+        if self.backend == OLLAMA:
+            vector = np.asarray(self.embeddings().embed_query(text), dtype=np.float32)
+        else:
+            vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+            for token in tokenize(text):
+                position = self.vocabulary.get(token)
+                if position is not None:
+                    vector[position] += 1
+            vector *= self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def query(self, text: str, k: int = 3, min_score: float = 0.0) -> List[Tuple[str, float]]:
+        """The k most similar tables with their cosine similarity, best first."""
+        if not self.tables:
+            return []
+        scores = np.asarray(self.matrix @ self._vectorize(text))
+        k = min(k, len(self.tables))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.tables[i], float(scores[i])) for i in top if scores[i] > min_score]
+
+
+def load_or_build(
+    catalog: SchemaCatalog,
+    aliases: Mapping[str, Iterable[str]],
+    backend: str,
+    path: Optional[str],
+    column_notes: Optional[Mapping[str, Mapping[str, str]]] = None,
+) -> TableIndex:
+    """Reuse the saved index if it matches the current schema, otherwise build and save it."""
+    documents = table_documents(catalog, aliases, column_notes)
+    index_fingerprint = fingerprint(documents, backend)
+    if path:
+        index = TableIndex.load(path, index_fingerprint)
+        if index is not None:
+            return index
+    logger.info("Building %s table index for %s tables", backend, len(documents))
+    index = TableIndex.build(documents, backend)
+    if path:
+        index.save(path, index_fingerprint)
+    return index
+
+
+if __name__ == "__main__":
+    from sql_analyzer.agent_factory import init_chatbot
+
+    chatbot = init_chatbot()
+    backend = cfg.table_index_backend if cfg.table_index_backend != "off" else TFIDF
+    index = load_or_build(chatbot.catalog, chatbot.table_aliases, backend, cfg.table_index_path, chatbot.column_notes)
+    logger.info("Table index with %s tables saved to %s.npy", len(index.tables), cfg.table_index_path)
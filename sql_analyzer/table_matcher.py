@@ -0,0 +1,97 @@
+"""
+Prebuilt word-trie index for resolving table names and aliases in questions.
+"""
+import re
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Tuple
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Scores per kind of phrase; longer phrases win ties through the length bonus
+EXACT_SCORE = 3.0
+SPLIT_NAME_SCORE = 2.0
+PARTIAL_NAME_SCORE = 1.5
+ALIAS_SCORE = 1.0
+LENGTH_BONUS = 0.1
+
+
+def normalize_word(word: str) -> str:
+    """Lowercase and strip a plural 's' so 'transfer' and 'transfers' match."""
+    word = word.lower()
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def split_name(name: str) -> List[str]:
+    """Split a table name on underscores and camel case: PrjDataTransfers_SC -> prj data transfers sc."""
+    spaced = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", name.replace("_", " "))
+    return [normalize_word(word) for word in spaced.split()]
+
+
+class TableMatch(NamedTuple):
+    table: str
+    score: float
+    phrases: Tuple[str, ...]
+
+
+class TableMatcher:
+    """Matches every table name, name variant and alias in one pass over the question.
+
+    Phrases are stored in a trie keyed by normalized words, so matching costs
+    O(question words x longest phrase) no matter how many tables and aliases
+    exist. Build a new matcher when the schema changes.
+    """
+
+    def __init__(self, tables: Iterable[str], aliases: Mapping[str, Iterable[str]]):
+        self._trie: Dict = {}
+        self.tables = list(tables)
+        known = set(self.tables)
+        for table in self.tables:
+            self._add([normalize_word(table)], table, EXACT_SCORE)
+            words = split_name(table)
+            if len(words) > 1:
+                self._add(words, table, SPLIT_NAME_SCORE)
+                for size in range(2, len(words)):
+                    for start in range(len(words) - size + 1):
+                        self._add(words[start:start + size], table, PARTIAL_NAME_SCORE)
+        for table, table_aliases in aliases.items():
+            if table not in known:
+                continue
+            for alias in table_aliases:
+                self._add([normalize_word(word) for word in WORD_PATTERN.findall(alias)], table, ALIAS_SCORE)
+
+    def _add(self, words: List[str], table: str, score: float) -> None:
+        if not words:
+            return
+        node = self._trie
+        for word in words:
+            node = node.setdefault(word, {})
+        # Keep the best score if two phrases of a table normalize to the same words
+        targets = node.setdefault(None, {})
+        targets[table] = max(score + LENGTH_BONUS * len(words), targets.get(table, 0.0))
+
+    def rank(self, question: str) -> List[TableMatch]:
+        """Candidate tables for a question, best first.
+
+        A phrase contained in a longer matched phrase is ignored, so "customer
+        orders" counts for CustomerOrders and not also for Orders.
+        """
+        raw_words = WORD_PATTERN.findall(question)
+        words = [normalize_word(word) for word in raw_words]
+        matches: List[Tuple[int, int, str, float]] = []
+        for start in range(len(words)):
+            node = self._trie
+            for end in range(start, len(words)):
+                node = node.get(words[end])
+                if node is None:
+                    break
+                for table, score in node.get(None, {}).items():
+                    matches.append((start, end, table, score))
+
+        scores: Dict[str, float] = {}
+        phrases: Dict[str, List[str]] = {}
+        for start, end, table, score in matches:
+            if any(s <= start and end <= e and e - s > end - start for s, e, _, _ in matches):
+                continue
+            scores[table] = scores.get(table, 0.0) + score
+            phrases.setdefault(table, []).append(" ".join(raw_words[start:end + 1]))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [TableMatch(table, score, tuple(phrases[table])) for table, score in ranked]